@@ -0,0 +1,52 @@
+# Load test the batch runner and the response cache against the offline mock models
+# Usage: python benchmarks/batch_runner.py [--rows 1000] [--workers 8 32 64] [--model mock-fast]
+import os
+import sys
+import tempfile
+import argparse
+from time import perf_counter
+
+# Offline and on a scratch database, before the helpers read the environment
+os.environ['LLM_OFFLINE'] = '1'
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'batch_runner.db')
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.batch_helper import run_batch, summarize_batch
+from utils.response_cache_helper import clear_response_cache
+
+TEMPLATE = "Summarize the {{ topic }} article in the style of {{ style }}."
+
+
+def run(rows:int, workers:int, model_name:str, temperature:float) -> dict:
+    dataset = pd.DataFrame({
+        'topic': [f'topic {i}' for i in range(rows)],
+        'style': ['a haiku', 'a tweet', 'a report', 'a limerick'] * (rows // 4) + ['a haiku'] * (rows % 4),
+    })
+    model_settings = {'provider': 'Mock', 'model_name': model_name, 'temperature': temperature}
+
+    start = perf_counter()
+    results = run_batch(TEMPLATE, ['topic', 'style'], dataset, model_settings, max_workers=workers)
+    summary = summarize_batch(results)
+
+    return {**summary, 'workers': workers, 'wall_s': perf_counter() - start}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[8, 32, 64])
+    parser.add_argument('--model', default='mock-fast')
+    args = parser.parse_args()
+
+    print(f"{'run':<6} {'workers':>7} {'rows':>6} {'errors':>6} {'cached':>6} {'wall_s':>8} {'rows/s':>8} {'mean_s':>7} {'p95_s':>7}")
+    for workers in args.workers:
+        # Sampled calls skip the cache, then the same batch at temperature 0 twice: cold and fully cached
+        clear_response_cache()
+        for label, temperature in (('sample', 1), ('cold', 0), ('warm', 0)):
+            result = run(args.rows, workers, args.model, temperature)
+            print(
+                f"{label:<6} {result['workers']:>7} {result['rows']:>6} {result['errors']:>6} {result['cached']:>6} {result['wall_s']:>8.2f} "
+                f"{result['rows'] / result['wall_s']:>8.1f} {result['mean_latency'] or 0:>7.3f} {result['p95_latency'] or 0:>7.3f}"
+            )
@@ -0,0 +1,95 @@
+# Compare database size and read latency of the template storage modes
+# Usage: python benchmarks/template_storage.py [--groups 20] [--versions 50]
+import os
+import sys
+import random
+import tempfile
+import argparse
+from time import perf_counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import sql_helper
+from utils.db_helper import get_connection
+
+
+# A long template that evolves through small edits
+def evolve_template(template:str, rng:random.Random) -> str:
+    lines = template.splitlines()
+    for _ in range(rng.randint(1, 3)):
+        idx = rng.randrange(len(lines))
+        action = rng.random()
+        if action < 0.4:
+            lines[idx] = lines[idx] + ' Be concise.'
+        elif action < 0.8:
+            lines.insert(idx, f'Rule {rng.randint(0, 10**6)}: answer using the {{{{ context }}}} only.')
+        elif len(lines) > 10:
+            lines.pop(idx)
+    return '\n'.join(lines)
+
+
+# Size in bytes of the prompt_templates table, None if dbstat is not compiled in
+def template_table_size(connection) -> int:
+    try:
+        return connection.execute("SELECT SUM(pgsize) FROM dbstat WHERE name IN ('prompt_templates', 'sqlite_autoindex_prompt_templates_1')").fetchone()[0]
+    except Exception:
+        return None
+
+
+def run(mode:str, groups:int, versions:int, seed:int) -> dict:
+    rng = random.Random(seed)
+    sql_helper.TEMPLATE_STORAGE = mode
+    sql_helper.clear_caches()
+
+    db_path = os.path.join(tempfile.mkdtemp(), f'{mode}.db')
+    connection = get_connection(db_path)
+    cursor = connection.cursor()
+    sql_helper.create_project('Benchmark', connection, cursor)
+    project_id = list(sql_helper.get_all_projects(cursor))[0]
+
+    ids = []
+    start = perf_counter()
+    for group in range(groups):
+        template = '\n'.join(f'Instruction {i}: you are a helpful assistant, follow the style guide for {{{{ topic }}}}.' for i in range(60))
+        parent_id = None
+        for version in range(1, versions + 1):
+            template = evolve_template(template, rng)
+            parent_id, _ = sql_helper.create_prompt(project_id, f'Prompt {group:03d}', parent_id, None, version, template, 'topic, context', False, None, connection, cursor)
+            ids.append(parent_id)
+    write_seconds = perf_counter() - start
+
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # Cold reads reconstruct every template, warm reads hit the caches
+    sql_helper.clear_caches()
+    start = perf_counter()
+    for id in ids:
+        sql_helper.get_prompt_details(cursor, id)
+    cold_ms = (perf_counter() - start) / len(ids) * 1000
+
+    start = perf_counter()
+    for id in ids:
+        sql_helper.get_prompt_details(cursor, id)
+    warm_ms = (perf_counter() - start) / len(ids) * 1000
+
+    return {
+        'mode': mode,
+        'versions': len(ids),
+        'db_size_kb': os.path.getsize(db_path) / 1024,
+        'template_table_kb': (template_table_size(connection) or 0) / 1024,
+        'write_s': write_seconds,
+        'cold_read_ms': cold_ms,
+        'warm_read_ms': warm_ms,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--versions', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'versions':>8} {'db_size_kb':>11} {'templates_kb':>13} {'write_s':>8} {'cold_read_ms':>13} {'warm_read_ms':>13}")
+    for mode in ('text', 'delta'):
+        result = run(mode, args.groups, args.versions, args.seed)
+        print(f"{result['mode']:<6} {result['versions']:>8} {result['db_size_kb']:>11.1f} {result['template_table_kb']:>13.1f} {result['write_s']:>8.2f} {result['cold_read_ms']:>13.3f} {result['warm_read_ms']:>13.3f}")
@@ -1,11 +1,12 @@
 import os
-import json
 import streamlit as st
 from st_pages import Page, show_pages, hide_pages
 from streamlit_extras.grid import grid
 from streamlit_extras.card import card
 from streamlit_extras.switch_page_button import switch_page
 
+from utils.config_helper import load_config
+
 from dotenv import load_dotenv
 load_dotenv()
 ### IMPORTS END ###
@@ -13,9 +14,8 @@ load_dotenv()
 # Setup the page
 st.set_page_config(layout='centered')
 
-# Import Config
-with open(os.getenv('CONFIG_FPATH'), 'r') as f:
-    st.session_state['config'] = json.load(f)
+# Import Config (parsed once per process, re-read when the file changes)
+st.session_state['config'] = load_config(os.getenv('CONFIG_FPATH'))
 
 st.title('Prompt Engineering Studio')
 st.header('Welcome to the Studio', divider='rainbow')
@@ -36,6 +36,7 @@ create_new_prompt_from_current_page = Page("project_pages/create_new_prompt_from
 edit_current_prompt_version_page = Page("project_pages/edit_current_prompt_version.py", "edit_current_prompt_version")
 create_new_prompt_from_project_page = Page("project_pages/create_new_prompt_from_project.py", "create_new_prompt_from_project")
 project_level_prompt_lineage_page = Page("project_pages/project_level_prompt_lineage.py", "project_level_prompt_lineage")
+compare_prompt_versions_page = Page("project_pages/compare_prompt_versions.py", "compare_prompt_versions")
 
 show_pages([
     home_page,
@@ -52,6 +53,7 @@ show_pages([
     edit_current_prompt_version_page,
     create_new_prompt_from_project_page,
     project_level_prompt_lineage_page,
+    compare_prompt_versions_page,
 ])
 
 hide_pages(st.session_state['config']['hidden_pages'])
@@ -0,0 +1,239 @@
+import os
+import sqlite3
+import pandas as pd
+import streamlit as st
+from jinja2 import TemplateError
+from st_pages import hide_pages
+from streamlit_extras.switch_page_button import switch_page
+
+import sys
+
+sys.path.append('../utils')
+from utils.sql_helper import get_all_projects, get_prompt_group_details, get_all_prompt_versions, get_prompt_details
+from utils.db_helper import get_connection
+from utils.batch_helper import BATCH_MAX_WORKERS, load_dataset, run_comparison, summarize_comparison
+from utils.eval_helper import save_eval_run, results_from_batch
+from utils.llm_helper import calculate_model_hash
+
+from dotenv import load_dotenv
+load_dotenv()
+### IMPORTS END ###
+
+if 'config' not in st.session_state:
+    switch_page("home")
+
+# Setup the page
+st.set_page_config(layout='wide')
+
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
+cursor = connection.cursor()
+
+# Hide Internal Pages
+hide_pages(st.session_state['config']['hidden_pages'])
+
+
+## Local Variables
+if 'COMPARISON_RESULTS' not in st.session_state:
+    st.session_state['COMPARISON_RESULTS'] = None
+
+# Initial model configurations of the editor below, the edits are kept by the editor itself
+if 'COMPARISON_MODEL_CONFIGS' not in st.session_state:
+    st.session_state['COMPARISON_MODEL_CONFIGS'] = pd.DataFrame([
+        {'provider': 'Mock', 'model_name': 'mock-fast', 'temperature': 0.0, 'max_output_tokens': 1024},
+    ])
+
+# Get the Current Project and Prompt Group Details
+all_projects = get_all_projects(cursor)
+prompt_name, prompt_description = get_prompt_group_details(cursor, st.session_state['CURRENT_PROMPT_GROUP_ID'])
+all_versions = get_all_prompt_versions(cursor, st.session_state['CURRENT_PROMPT_GROUP_ID'])
+version_ids = dict(zip(all_versions.version, all_versions.id))
+
+
+## Helper Functions
+# Delete local variables from session state
+def clean_session_state():
+    st.session_state.pop('COMPARISON_RESULTS')
+    st.session_state.pop('COMPARISON_MODEL_CONFIGS')
+    st.session_state.pop('comparison_versions')
+    st.session_state.pop('comparison_model_configs_editor')
+    st.session_state.pop('comparison_dataset_file')
+    st.session_state.pop('comparison_max_workers')
+
+# Get the model configurations from the editor, skipping incomplete rows and repeats
+def get_model_configs(model_configs_df:pd.DataFrame) -> list:
+    model_configs = []
+    for config in model_configs_df.to_dict(orient='records'):
+        if not config['provider'] or not config['model_name']:
+            continue
+        config = {
+            'provider': config['provider'],
+            'model_name': config['model_name'],
+            'temperature': float(config['temperature']) if pd.notna(config['temperature']) else 0.0,
+            'max_output_tokens': int(config['max_output_tokens']) if pd.notna(config['max_output_tokens']) else 1024,
+        }
+        if config not in model_configs:
+            model_configs.append(config)
+    return model_configs
+
+# Get the model configurations whose model is not offered by their provider
+def get_invalid_model_configs(model_configs:list) -> list:
+    return [config for config in model_configs if config['model_name'] not in st.session_state['config']['models'].get(config['provider'], [])]
+
+# Store each (version, model) cell group of a comparison as an evaluation run
+def save_comparison(results:pd.DataFrame, prompts:list, model_configs:list):
+    model_settings = {calculate_model_hash(**config): config for config in model_configs}
+    input_variables = {prompt['id']: prompt['input_variables'] for prompt in prompts}
+
+    for (prompt_id, model_hash), group in results.groupby(['prompt_id', 'model_hash'], sort=False):
+        save_eval_run(prompt_id, model_settings[model_hash], results_from_batch(group, input_variables[prompt_id]), connection, cursor, source='comparison')
+
+
+## HEADER
+st.title('Prompt Engineering Studio')
+st.header('Projects', divider='rainbow')
+
+
+## SUB-HEADERs
+subheader_cols = st.columns(2)
+with subheader_cols[0]:
+    st.subheader(all_projects[st.session_state['CURRENT_PROJECT_ID']]['name'])
+    st.write(all_projects[st.session_state['CURRENT_PROJECT_ID']]['description'])
+
+with subheader_cols[1]:
+    st.subheader(f'{prompt_name} - Compare Versions')
+    st.write(prompt_description)
+st.divider()
+
+
+## Comparison Setup
+setup_cols = st.columns([.05, .4, .05, .45, .05])
+
+with setup_cols[1]:
+    # Prompt Versions, the two latest by default
+    st.multiselect(
+        'Prompt Versions',
+        options=list(all_versions.version),
+        default=list(all_versions.version[:2]),
+        format_func=lambda version: f'v{version}',
+        key='comparison_versions',
+    )
+
+    # Dataset
+    st.file_uploader(
+        'Dataset (CSV or JSONL)',
+        type=['csv', 'jsonl'],
+        key='comparison_dataset_file',
+        help='One row per example, with a column for each input variable of the selected versions',
+    )
+    st.number_input('Workers', min_value=1, max_value=64, value=BATCH_MAX_WORKERS, key='comparison_max_workers')
+
+with setup_cols[3]:
+    # Model Configurations
+    model_configs_df = st.data_editor(
+        st.session_state['COMPARISON_MODEL_CONFIGS'],
+        column_config={
+            'provider': st.column_config.SelectboxColumn('LLM Provider', options=st.session_state['config']['llm_providers'], required=True),
+            'model_name': st.column_config.SelectboxColumn('Model', options=sorted({model for models in st.session_state['config']['models'].values() for model in models}), required=True),
+            'temperature': st.column_config.NumberColumn('Temperature', min_value=0.0, max_value=1.0, step=0.05, default=0.0),
+            'max_output_tokens': st.column_config.NumberColumn('Max Output Tokens', min_value=1, max_value=2048, step=1, default=1024),
+        },
+        num_rows='dynamic',
+        use_container_width=True,
+        hide_index=True,
+        key='comparison_model_configs_editor',
+    )
+
+    model_configs = get_model_configs(model_configs_df)
+    invalid_model_configs = get_invalid_model_configs(model_configs)
+    for config in invalid_model_configs:
+        st.error(f"{config['model_name']} is not available on {config['provider']}", icon="🚫")
+
+    # Number of cells in the matrix, identical (rendered prompt, model) cells are only called once
+    st.caption(f"{len(st.session_state['comparison_versions'])} versions × {len(model_configs)} models per dataset row")
+
+# Button should be disabled if there is nothing to compare
+run_comparison_disabled = (
+    st.session_state['comparison_dataset_file'] is None
+    or len(st.session_state['comparison_versions']) == 0
+    or len(model_configs) == 0
+    or len(invalid_model_configs) > 0
+)
+st.columns(5)[2].button('⚙️ :green[Run Comparison]', key='run_comparison_button', use_container_width=True, disabled=run_comparison_disabled)
+
+if st.session_state['run_comparison_button']:
+    try:
+        dataset = load_dataset(st.session_state['comparison_dataset_file'])
+        prompts = [get_prompt_details(cursor, version_ids[version]) for version in sorted(st.session_state['comparison_versions'])]
+
+        progress_bar = st.progress(0.0, text='Running comparison...')
+        st.session_state['COMPARISON_RESULTS'] = run_comparison(
+            prompts=prompts,
+            model_configs=model_configs,
+            dataset=dataset,
+            max_workers=st.session_state['comparison_max_workers'],
+            progress_callback=lambda completed, total: progress_bar.progress(completed / total, text=f'Running comparison... {completed}/{total} calls'),
+            pricing=st.session_state['config'].get('model_pricing', {}),
+        )
+        progress_bar.empty()
+    except (ValueError, TemplateError) as e:
+        st.error(e)
+    else:
+        # The calls are already paid for, keep and show the results even if they cannot be stored
+        try:
+            save_comparison(st.session_state['COMPARISON_RESULTS'], prompts, model_configs)
+        except sqlite3.Error as e:
+            st.error(f"Could not store the comparison in the evaluation history: {e}", icon="🚫")
+
+st.divider()
+
+
+## Comparison Results
+if st.session_state['COMPARISON_RESULTS'] is not None:
+    results = st.session_state['COMPARISON_RESULTS']
+
+    # Totals, shared cells reused another cell's call
+    total_cols = st.columns(5)
+    total_cols[0].metric('Cells', len(results))
+    total_cols[1].metric('Model Calls', int((~results['shared']).sum()))
+    total_cols[2].metric('Errors', int(results['error'].notna().sum()))
+    total_cols[3].metric('Cached', int(results['cached'].sum()))
+    total_spent = pd.to_numeric(results['cost']).where(~results['shared'], 0).sum()
+    total_cols[4].metric('Estimated Cost', f"${total_spent:.4f}")
+
+    st.subheader('Summary')
+    st.dataframe(summarize_comparison(results), use_container_width=True, hide_index=True)
+
+    # Matrix of dataset rows × (version, model) cells
+    st.subheader('Matrix')
+    matrix_results = results.assign(cell=results['version'].map(lambda version: f'v{version}') + ' | ' + results['model'])
+    matrix_tabs = st.tabs(['Outputs', 'Latency (s)', 'Input Tokens', 'Output Tokens', 'Cost ($)'])
+    for tab, value in zip(matrix_tabs, ['output', 'latency', 'input_token_count', 'output_token_count', 'cost']):
+        with tab:
+            matrix = matrix_results.assign(value=matrix_results['output'].fillna(matrix_results['error']) if value == 'output' else matrix_results[value])
+            st.dataframe(matrix.pivot(index='row', columns='cell', values='value'), use_container_width=True)
+
+    st.download_button(
+        'Download Results',
+        data=results.to_csv(index=False),
+        file_name=f"{prompt_name}_comparison_results.csv",
+        mime='text/csv',
+    )
+    st.divider()
+
+
+button_cols = st.columns(5)
+back_to_prompt_versions = button_cols[1].button(':leftwards_arrow_with_hook: Back to Prompt Versions', use_container_width=True)
+back_to_current_project = button_cols[3].button(':leftwards_arrow_with_hook: Back to Current Project', use_container_width=True)
+
+if back_to_prompt_versions:
+    clean_session_state()
+    switch_page("show_prompt_versions")
+
+if back_to_current_project:
+    clean_session_state()
+    switch_page("show_project")
+
+st.divider()
+with st.expander('Session State'):
+    st.json(st.session_state, expanded=True)
@@ -1,6 +1,5 @@
 import os
 import streamlit as st
-import sqlite3
 from time import sleep
 from st_pages import hide_pages
 from streamlit_extras.switch_page_button import switch_page
@@ -9,6 +8,7 @@ import sys
 
 sys.path.append('../utils')
 from utils.sql_helper import create_project, ProjectAlreadyExistsError
+from utils.db_helper import get_connection
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -16,8 +16,8 @@ load_dotenv()
 if 'config' not in st.session_state:
     switch_page("home")
 
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
@@ -1,5 +1,4 @@
 import os
-import sqlite3
 import streamlit as st
 import pandas as pd
 from st_pages import hide_pages
@@ -11,6 +10,7 @@ import sys
 sys.path.append('../utils')
 
 from utils.sql_helper import get_all_projects, create_prompt, get_all_prompts, get_prompt_details
+from utils.db_helper import get_connection
 from utils.helper import load_codeEditor_buttons_config, load_codeEditor_config, load_codeEditor_infobar_config, get_input_variables
 
 from dotenv import load_dotenv
@@ -24,8 +24,8 @@ if 'config' not in st.session_state:
 ## Setup the page
 st.set_page_config(layout='wide')
 
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
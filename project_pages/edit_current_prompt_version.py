@@ -1,5 +1,4 @@
 import os
-import sqlite3
 import streamlit as st
 from st_pages import hide_pages
 from streamlit_extras.switch_page_button import switch_page
@@ -10,6 +9,7 @@ import sys
 sys.path.append('../utils')
 
 from utils.sql_helper import get_all_projects, update_prompt, get_prompt_details
+from utils.db_helper import get_connection
 from utils.helper import load_codeEditor_buttons_config, load_codeEditor_config, load_codeEditor_infobar_config, get_input_variables
 
 from dotenv import load_dotenv
@@ -23,8 +23,8 @@ if 'config' not in st.session_state:
 ## Setup the page
 st.set_page_config(layout='wide')
 
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
@@ -1,7 +1,4 @@
 import os
-import sqlite3
-from hashlib import sha256
-import jinja2
 import pandas as pd
 import streamlit as st
 from st_pages import hide_pages
@@ -9,16 +6,15 @@ from streamlit_extras.grid import grid
 from streamlit_extras.switch_page_button import switch_page
 from code_editor import code_editor
 
-import google.generativeai as google_genai
-import vertexai.language_models as vertexai_plam2
-import vertexai.generative_models as vertexai_genai
-
 import sys
 
 sys.path.append('../utils')
 from utils.sql_helper import get_prompt_details, get_all_projects, get_all_prompts
+from utils.db_helper import get_connection
 from utils.helper import load_codeEditor_buttons_config, load_codeEditor_config, load_codeEditor_infobar_config, get_input_variables
-from utils.llm_helper import setup_gemini_model, setup_palm2_model
+from utils.retry_helper import CircuitOpenError
+from utils.template_helper import render_template
+from utils.llm_helper import generate_stream, get_model, is_model_loaded, calculate_model_hash as calculate_llm_model_hash
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -30,8 +26,8 @@ if 'config' not in st.session_state:
 ## Setup the page
 st.set_page_config(layout='wide')
 
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 
@@ -48,6 +44,12 @@ if 'INPUT_TOKEN_COUNT' not in st.session_state:
 if 'OUTPUT_TOKEN_COUNT' not in st.session_state:
     st.session_state['OUTPUT_TOKEN_COUNT'] = None
 
+if 'LLM_OUTPUT_CACHED' not in st.session_state:
+    st.session_state['LLM_OUTPUT_CACHED'] = False
+
+if 'LLM_OUTPUT_STATS' not in st.session_state:
+    st.session_state['LLM_OUTPUT_STATS'] = None
+
 if 'CURRENT_PROMPT_INFO' in st.session_state:
     st.session_state.pop('CURRENT_PROMPT_INFO')
 
@@ -82,10 +84,6 @@ if 'PROMPT_TEMPLATE' not in st.session_state:
     st.session_state['PROMPT_TEMPLATE'] = ''
 
 ## Setup Required Variables
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
-cursor = connection.cursor()
-
 # Hide Internal Pages
 hide_pages(st.session_state['config']['hidden_pages'])
 
@@ -98,6 +96,8 @@ def clean_session_state():
     st.session_state.pop('LLM_OUTPUT')
     st.session_state.pop('INPUT_TOKEN_COUNT')
     st.session_state.pop('OUTPUT_TOKEN_COUNT')
+    st.session_state.pop('LLM_OUTPUT_CACHED')
+    st.session_state.pop('LLM_OUTPUT_STATS')
     st.session_state.pop('ALL_PROJECTS')
     st.session_state.pop('PROJECT_ID_LOOKUP')
     st.session_state.pop('ALL_PROMPTS')
@@ -115,115 +115,60 @@ def clean_session_state():
     
     if 'LLM' in st.session_state:
         st.session_state.pop('LLM')
+        st.session_state.pop('LLM_HASH')
 
 # Copy the value of one widget to another
 def copy_widget_value(copy_from_key:str, copy_to_key:str):
     st.session_state[copy_to_key] = st.session_state[copy_from_key]
 
+# Get the model settings from the LLM Settings widgets
+def get_model_settings() -> dict:
+    return {
+        'provider': st.session_state['llm_providers'],
+        'model_name': st.session_state['model_selection'],
+        'temperature': st.session_state['temperature_slider'],
+        'max_output_tokens': st.session_state['max_output_tokens_slider'],
+        'top_p': st.session_state['top_p'],
+        'top_k': st.session_state['top_k'],
+        # 'stop_sequence': st.session_state['stop_sequence'],
+    }
+
 # Calculate the hash of the model using the model settings
 def calculate_model_hash() -> str:
-    
-    model_name = st.session_state['model_selection']
-    temperature = st.session_state['temperature_slider']
-    max_output_tokens = st.session_state['max_output_tokens_slider']
-    top_p = st.session_state['top_p']
-    top_k = st.session_state['top_k']
-    stop_sequence = st.session_state['stop_sequence']
-    
-    string_to_hash = f"{model_name}-{temperature}-{max_output_tokens}-{top_p}-{top_k}-{stop_sequence}"
-    return sha256(string_to_hash.encode()).hexdigest()
+    return calculate_llm_model_hash(**get_model_settings())
 
-# Load the Model
+# Load the Model from the shared model registry
 def load_model():
-    
-    if st.session_state['llm_providers'] == 'GoogleAI':
-        st.session_state['LLM'] = setup_gemini_model(
-            model_name=st.session_state['model_selection'],
-            temperature=st.session_state['temperature_slider'],
-            max_output_tokens=st.session_state['max_output_tokens_slider'],
-            top_p=st.session_state['top_p'],
-            top_k=st.session_state['top_k'],
-            # stop_sequence=st.session_state['stop_sequence']
-            is_vertexai_model=False,
-        )
-    elif st.session_state['llm_providers'] == 'VertexAI':
-        if 'gemini' in st.session_state['model_selection']:
-            st.session_state['LLM'] = setup_gemini_model(
-                model_name=st.session_state['model_selection'],
-                temperature=st.session_state['temperature_slider'],
-                max_output_tokens=st.session_state['max_output_tokens_slider'],
-                top_p=st.session_state['top_p'],
-                top_k=st.session_state['top_k'],
-                # stop_sequence=st.session_state['stop_sequence']
-                is_vertexai_model=True,
-            )
-        else:
-            st.session_state['LLM'], st.session_state['PARAMETERS'] = setup_palm2_model(
-                model_name=st.session_state['model_selection'],
-                temperature=st.session_state['temperature_slider'],
-                max_output_tokens=st.session_state['max_output_tokens_slider'],
-                top_p=st.session_state['top_p'],
-                top_k=st.session_state['top_k'],
-                # stop_sequence=st.session_state['stop_sequence']
-            )
+    st.session_state['LLM'], st.session_state['PARAMETERS'] = get_model(**get_model_settings())
+    st.session_state['LLM_HASH'] = calculate_model_hash()
 
 # Render Prompt
 def render_prompt() -> str:
-    
-    # Setup the Jinja2 Environment
-    env = jinja2.Environment()
-    
-    # Get the Prompt Template
-    prompt_template = env.from_string(st.session_state['prompt_template_editor']['text'])
-    
-    # Render the Prompt
-    rendered_prompt = prompt_template.render(**st.session_state['INPUT_VARIABLE_VALUES'])
-    
-    return rendered_prompt
+    return render_template(st.session_state['prompt_template_editor']['text'], **st.session_state['INPUT_VARIABLE_VALUES'])
 
 # Run Model
-def run_model():
+def run_model() -> bool:
     # Get the Input Text
     input_text = render_prompt()
     
-    with st.spinner('Running LLM Model...'):
-            
-        if st.session_state['llm_providers'] == 'GoogleAI' and 'gemini' in st.session_state['model_selection']:
-            llm:google_genai.GenerativeModel = st.session_state['LLM']
-            
-            print('Getting Input Token Count...')
-            st.session_state['INPUT_TOKEN_COUNT'] = get_token_count(render_prompt())
-            print('Running Model...')
-            st.session_state['LLM_OUTPUT'] = llm.generate_content(input_text).text
-            print('Getting Outpu Token Count...')
-            st.session_state['OUTPUT_TOKEN_COUNT'] = get_token_count(st.session_state['LLM_OUTPUT'])
-        
-        elif st.session_state['llm_providers'] == 'VertexAI' and 'gemini' in st.session_state['model_selection']:
-            llm:vertexai_genai.GenerativeModel = st.session_state['LLM']
-            
-            print('Getting LLM Output...')
-            response = llm.generate_content(input_text)
-            st.session_state['LLM_OUTPUT'] = response.text
-            st.session_state['INPUT_TOKEN_COUNT'] = response.to_dict()['usage_metadata']['prompt_token_count']
-            st.session_state['OUTPUT_TOKEN_COUNT'] = response.to_dict()['usage_metadata']['candidates_token_count']
-        
-        elif st.session_state['llm_providers'] == 'VertexAI' and 'text' in st.session_state['model_selection']:
-            llm: vertexai_plam2.TextGenerationModel = st.session_state['LLM']
-
-            print('Getting LLM Output...')
-            st.session_state['LLM_OUTPUT'] = llm.predict(input_text, **st.session_state['PARAMETERS']).text
-            st.session_state['INPUT_TOKEN_COUNT'] = None
-            st.session_state['OUTPUT_TOKEN_COUNT'] = None
-
-# Get token count
-def get_token_count(text:str) -> int:
-
-    # If model is Gemini
-    if 'gemini' in st.session_state['model_selection']:
-        llm:google_genai.GenerativeModel = st.session_state['LLM']
-        response = llm.count_tokens(text)
-        
-        return response.total_tokens
+    # Render the output as it streams in, the output editor below shows the full text afterwards
+    stats = {}
+    try:
+        st.write_stream(generate_stream(input_text, **get_model_settings(), stats=stats))
+    except CircuitOpenError as e:
+        st.error(f"{e}. Please try again later.", icon="🚫")
+        return False
+    except Exception as e:
+        # Transient errors were already retried, anything reaching here is final
+        st.error(f"Model call failed: {e}", icon="🚫")
+        return False
+    
+    st.session_state['LLM_OUTPUT'] = stats['text']
+    st.session_state['INPUT_TOKEN_COUNT'] = stats['input_token_count']
+    st.session_state['OUTPUT_TOKEN_COUNT'] = stats['output_token_count']
+    st.session_state['LLM_OUTPUT_CACHED'] = stats['cached']
+    st.session_state['LLM_OUTPUT_STATS'] = stats
+    return True
 
 # Turn on the flag
 def turn_on_flag(flag:str):
@@ -379,8 +324,13 @@ with main_columns[3]:
         
         # Check if the model hash has changed
         if st.session_state['llm_providers'] and st.session_state['model_selection']:
-            if st.session_state['MODEL_HASH'] != calculate_model_hash():
-                st.session_state['MODEL_HASH'] = calculate_model_hash()
+            st.session_state['MODEL_HASH'] = calculate_model_hash()
+            
+            # Reuse an already loaded model with the same settings without asking again
+            if is_model_loaded(st.session_state['MODEL_HASH']):
+                if st.session_state.get('LLM_HASH') != st.session_state['MODEL_HASH']:
+                    load_model()
+            else:
                 st.warning('Setting changed. Please load model again!', icon="❗")
                 
                 # Load Model Button
@@ -464,14 +414,24 @@ with example_cols[3]:
     if st.session_state['run_button']:
         update_input_variable_dict()
         with st.empty():
-            run_model()
+            # Clear the streamed output once the editor below has it, errors stay visible
+            if run_model():
+                st.empty()
     
     if not run_button_disabled:
         input_text = render_prompt()
         expander_test = f"Input Text - `{st.session_state['INPUT_TOKEN_COUNT']}` Tokens" if st.session_state['INPUT_TOKEN_COUNT'] else "Input Text"
         with st.expander(expander_test):
-            st.code(render_prompt(), language='txt', line_numbers=True)
+            st.code(input_text, language='txt', line_numbers=True)
         
+    # Latency of the last run
+    if st.session_state['LLM_OUTPUT_STATS']:
+        stats = st.session_state['LLM_OUTPUT_STATS']
+        latency_info = [f"Time to first token: {stats['time_to_first_token']:.2f}s" if stats['time_to_first_token'] is not None else None, f"Total: {stats['total_time']:.2f}s"]
+        if stats['tokens_per_second']:
+            latency_info.append(f"{stats['tokens_per_second']:.1f} tokens/sec")
+        st.caption(' | '.join(info for info in latency_info if info))
+    
     # The prompt template editor
     options = load_codeEditor_config()
     options['readOnly'] = True
@@ -481,7 +441,7 @@ with example_cols[3]:
     button_config.pop(1)
     
     info_bar_options = load_codeEditor_infobar_config()
-    info_bar_options['info'][0]['name'] = f"LLM Output | {st.session_state['model_selection'] if st.session_state['model_selection'] else 'Select Model'}{' | ' + str(st.session_state['OUTPUT_TOKEN_COUNT']) + ' Tokens' if st.session_state['OUTPUT_TOKEN_COUNT'] else ''}"
+    info_bar_options['info'][0]['name'] = f"LLM Output | {st.session_state['model_selection'] if st.session_state['model_selection'] else 'Select Model'}{' | ' + str(st.session_state['OUTPUT_TOKEN_COUNT']) + ' Tokens' if st.session_state['OUTPUT_TOKEN_COUNT'] else ''}{' | Cached' if st.session_state['LLM_OUTPUT_CACHED'] else ''}"
     code_editor(
         code=st.session_state['LLM_OUTPUT'],
         options=options,
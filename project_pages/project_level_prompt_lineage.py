@@ -1,5 +1,4 @@
 import os
-import sqlite3
 import streamlit as st
 from st_pages import hide_pages
 from streamlit_extras.switch_page_button import switch_page
@@ -7,7 +6,8 @@ from streamlit_extras.switch_page_button import switch_page
 import sys
 
 sys.path.append('../utils')
-from utils.sql_helper import get_all_prompts, get_all_projects
+from utils.sql_helper import get_project_lineage, get_prompt_group_lineage, get_all_projects
+from utils.db_helper import get_connection
 from utils.helper import project_level_prompt_lineage
 
 from dotenv import load_dotenv
@@ -19,8 +19,8 @@ if 'config' not in st.session_state:
 
 # Setup the page
 st.set_page_config(layout='centered')
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
@@ -30,13 +30,18 @@ hide_pages(st.session_state['config']['hidden_pages'])
 # Delete local variables from st.session_state
 def clean_session_state():
     st.session_state.pop('PROJECTS')
-    st.session_state.pop('PROMPTS')
+    st.session_state.pop('LINEAGE')
+    st.session_state.pop('LINEAGE_PROMPT_GROUP_ID', None)
 
 if 'PROJECTS' not in st.session_state:
     st.session_state['PROJECTS'] = get_all_projects(cursor)
 
-if 'PROMPTS' not in st.session_state:
-    st.session_state['PROMPTS'] = get_all_prompts(cursor, st.session_state['CURRENT_PROJECT_ID'], output_type='df')
+# Show only the lineage of a prompt group when one was selected, otherwise the whole project
+if 'LINEAGE' not in st.session_state:
+    if st.session_state.get('LINEAGE_PROMPT_GROUP_ID'):
+        st.session_state['LINEAGE'] = get_prompt_group_lineage(cursor, st.session_state['LINEAGE_PROMPT_GROUP_ID'])
+    else:
+        st.session_state['LINEAGE'] = get_project_lineage(cursor, st.session_state['CURRENT_PROJECT_ID'])
 
 
 ## HEADER
@@ -51,7 +56,7 @@ with cols[1]:
     
     # Create Lineage Graph
     with st.spinner('Creating Lineage Graph...'):
-        lineage_graph = project_level_prompt_lineage(st.session_state['PROMPTS'])
+        lineage_graph = project_level_prompt_lineage(*st.session_state['LINEAGE'])
     
     # Render Lineage Graph
     st.graphviz_chart(lineage_graph, use_container_width=True)
@@ -1,5 +1,4 @@
 import os
-import sqlite3
 import streamlit as st
 from st_pages import hide_pages
 from streamlit_extras.card import card
@@ -9,7 +8,8 @@ from streamlit_extras.switch_page_button import switch_page
 import sys
 
 sys.path.append('../utils')
-from utils.sql_helper import get_all_projects
+from utils.sql_helper import list_projects, search_prompts, import_project, ProjectAlreadyExistsError, PromptAlreadyExistsError, CONFLICT_POLICIES
+from utils.db_helper import get_connection
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -21,8 +21,8 @@ if 'config' not in st.session_state:
 # Setup the page
 st.set_page_config(layout='centered')
 
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
@@ -31,23 +31,79 @@ hide_pages(st.session_state['config']['hidden_pages'])
 st.title('Prompt Engineering Studio')
 st.header('Projects', divider='rainbow')
 
+# Number of project cards shown per page (plus the create card)
+PAGE_SIZE = 11
+
+## Local Variables
+# Cursors of the pages visited so far, the first page starts at None
+if 'PROJECTS_PAGE_CURSORS' not in st.session_state:
+    st.session_state['PROJECTS_PAGE_CURSORS'] = [None]
+
+if 'SWITCH_TO_PROMPT_TESTING' not in st.session_state:
+    st.session_state['SWITCH_TO_PROMPT_TESTING'] = False
+
+search_results = []
+
 ## Helper functions
 # Delete local variables from st.session_state
 def clean_session_state():
     st.session_state.pop("create_project_card")
+    st.session_state.pop("PROJECTS_PAGE_CURSORS")
+    st.session_state.pop("SWITCH_TO_PROMPT_TESTING")
+    st.session_state.pop("prompt_search")
     
-    for project_id in all_projects:
-        st.session_state.pop(f"{all_projects[project_id]['name']}_project_card")
-
-# Get all the Projects
-all_projects = get_all_projects(cursor)
+    for project in projects_page:
+        st.session_state.pop(f"{project.name}_project_card")
+    
+    for result in search_results:
+        st.session_state.pop(f"search_result_{result['id']}")
+
+# Open a prompt found by the search
+def go_to_prompt(project_id: str, prompt_id: str):
+    st.session_state['CURRENT_PROJECT_ID'] = project_id
+    st.session_state['CURRENT_PROMPT_ID'] = prompt_id
+    st.session_state['SWITCH_TO_PROMPT_TESTING'] = True
+
+# Move to the next page of projects
+def next_page():
+    st.session_state['PROJECTS_PAGE_CURSORS'].append(next_cursor)
+
+# Move back to the previous page of projects
+def previous_page():
+    st.session_state['PROJECTS_PAGE_CURSORS'].pop()
+
+# Search Prompts across all the Projects
+st.text_input(
+    label='Search Prompts',
+    key='prompt_search',
+    placeholder='🔍 Search prompt names, descriptions, notes and templates',
+    label_visibility='collapsed',
+)
+
+if len(st.session_state['prompt_search'].strip()) > 0:
+    search_results = search_prompts(cursor, st.session_state['prompt_search'])
+    
+    if len(search_results) == 0:
+        st.info('No prompts found!')
+    
+    for result in search_results:
+        result_cols = st.columns([0.25, 0.6, 0.15])
+        result_cols[0].markdown(f"**{result['name']}** `v{result['version']}`")
+        result_cols[1].markdown(result['snippet'])
+        result_cols[2].button('Open', key=f"search_result_{result['id']}", on_click=go_to_prompt, args=(result['project_id'], result['id']), use_container_width=True)
+    st.divider()
+
+# Get the current page of Projects
+projects_page, next_cursor = list_projects(
+    cursor,
+    columns=('id', 'name', 'description'),
+    page_size=PAGE_SIZE,
+    after=st.session_state['PROJECTS_PAGE_CURSORS'][-1],
+)
 
 # Setup the Grid to display Project Cards
-if len(all_projects) == 0:
-    rows = 1
-else:
-    quotient, remainder = divmod(len(all_projects) + 1, 3)
-    rows = quotient if remainder == 0 else quotient + 1
+quotient, remainder = divmod(len(projects_page) + 1, 3)
+rows = quotient if remainder == 0 else quotient + 1
 project_grid = grid(*[3 for _ in range(rows)])
 
 # Universal Card Style
@@ -82,23 +138,57 @@ with project_grid.container():
 # Individual Project Cards
 cards = []
 card_ids = []
-for project_id in all_projects:
+for project in projects_page:
     with project_grid.container():
-        if all_projects[project_id]["description"]:
-            if len(all_projects[project_id]["description"]) < 30:
-                description = all_projects[project_id]["description"]
+        if project.description:
+            if len(project.description) < 30:
+                description = project.description
             else:
-                description = all_projects[project_id]["description"][:30] + "..."
+                description = project.description[:30] + "..."
         else:
             description = ""
         
         cards.append(card(
-            title=all_projects[project_id]["name"],
+            title=project.name,
             text=description,
             styles=card_styles,
-            key=f'{all_projects[project_id]["name"]}_project_card',
+            key=f'{project.name}_project_card',
         ))
-        card_ids.append(project_id)
+        card_ids.append(project.id)
+
+# Pagination
+page_cols = st.columns(5)
+page_cols[1].button(':arrow_backward: Previous', key='projects_previous_page', use_container_width=True, on_click=previous_page, disabled=len(st.session_state['PROJECTS_PAGE_CURSORS']) == 1)
+page_cols[2].markdown(f"<p style='text-align: center'>Page {len(st.session_state['PROJECTS_PAGE_CURSORS'])}</p>", unsafe_allow_html=True)
+page_cols[3].button('Next :arrow_forward:', key='projects_next_page', use_container_width=True, on_click=next_page, disabled=next_cursor is None)
+
+# Import a Project archive exported from another studio
+with st.expander('Import Project'):
+    archive = st.file_uploader('Project Archive', type=['gz'])
+    on_conflict = st.selectbox('If the project or prompts already exist', CONFLICT_POLICIES, format_func=str.capitalize)
+
+    if st.button(':inbox_tray: Import', use_container_width=True, disabled=archive is None):
+        progress_bar = st.progress(0, text='Importing prompts...')
+        try:
+            counts = import_project(
+                archive,
+                connection,
+                cursor,
+                on_conflict=on_conflict,
+                progress_callback=lambda read, total: progress_bar.progress(read / max(total, 1), text=f'Read {read}/{total} prompts')
+            )
+            st.success(f"Imported {counts['prompts']} prompts and {counts['templates']} templates")
+        except ProjectAlreadyExistsError:
+            st.error('Project already exists!')
+        except PromptAlreadyExistsError:
+            st.error('Some prompts already exist!')
+        except ValueError as e:
+            st.error(str(e))
+
+# Switch to the Prompt if a search result was opened
+if st.session_state['SWITCH_TO_PROMPT_TESTING']:
+    clean_session_state()
+    switch_page("prompt_version_testing")
 
 # Switch to Create New Project Page
 if st.session_state['create_project_card']:
@@ -1,25 +1,24 @@
 import os
-import sqlite3
-from hashlib import sha256
-import jinja2
 
 import streamlit as st
+from jinja2 import TemplateError
 from streamlit.delta_generator import DeltaGenerator
 from st_pages import hide_pages
 from streamlit_extras.grid import grid
 from streamlit_extras.switch_page_button import switch_page
 from code_editor import code_editor
 
-import google.generativeai as google_genai
-import vertexai.language_models as vertexai_plam2
-import vertexai.generative_models as vertexai_genai
-
 import sys
 
 sys.path.append('../utils')
 from utils.sql_helper import get_all_projects, get_prompt_details
+from utils.db_helper import get_connection
 from utils.helper import load_codeEditor_buttons_config, load_codeEditor_config, load_codeEditor_infobar_config
-from utils.llm_helper import setup_gemini_model, setup_palm2_model
+from utils.batch_helper import BATCH_MAX_WORKERS, load_dataset, run_batch, summarize_batch
+from utils.retry_helper import CircuitOpenError
+from utils.eval_helper import EVAL_EXPORT_FORMATS, save_eval_run, results_from_batch, get_eval_runs, get_eval_results, export_eval_results
+from utils.template_helper import render_template
+from utils.llm_helper import generate_stream, get_model, is_model_loaded, calculate_model_hash as calculate_llm_model_hash
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -44,6 +43,15 @@ if 'INPUT_TOKEN_COUNT' not in st.session_state:
 if 'OUTPUT_TOKEN_COUNT' not in st.session_state:
     st.session_state['OUTPUT_TOKEN_COUNT'] = None
 
+if 'LLM_OUTPUT_CACHED' not in st.session_state:
+    st.session_state['LLM_OUTPUT_CACHED'] = False
+
+if 'LLM_OUTPUT_STATS' not in st.session_state:
+    st.session_state['LLM_OUTPUT_STATS'] = None
+
+if 'BATCH_RESULTS' not in st.session_state:
+    st.session_state['BATCH_RESULTS'] = None
+
 if 'SWITCH_TO_EDIT_CURRENT_PROMPT_VERSION' not in st.session_state:
     st.session_state['SWITCH_TO_EDIT_CURRENT_PROMPT_VERSION'] = False
 
@@ -73,8 +81,8 @@ if None not in st.session_state['config']['models']:
 
 
 ## Setup Required Variables
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
@@ -95,6 +103,9 @@ def clean_session_state():
     st.session_state.pop('LLM_OUTPUT')
     st.session_state.pop('INPUT_TOKEN_COUNT')
     st.session_state.pop('OUTPUT_TOKEN_COUNT')
+    st.session_state.pop('LLM_OUTPUT_CACHED')
+    st.session_state.pop('LLM_OUTPUT_STATS')
+    st.session_state.pop('BATCH_RESULTS')
     st.session_state.pop('SWITCH_TO_EDIT_CURRENT_PROMPT_VERSION')
     st.session_state.pop('SWITCH_TO_CREATE_NEW_PROMPT')
     st.session_state.pop('SWITCH_TO_CREATE_NEW_VERSION')
@@ -113,118 +124,86 @@ def clean_session_state():
     
     if 'LLM' in st.session_state:
         st.session_state.pop('LLM')
+        st.session_state.pop('LLM_HASH')
 
 # Copy the value of one widget to another
 def copy_widget_value(copy_from_key:str, copy_to_key:str):
     st.session_state[copy_to_key] = st.session_state[copy_from_key]
 
+# Get the model settings from the LLM Settings widgets
+def get_model_settings() -> dict:
+    return {
+        'provider': st.session_state['llm_providers'],
+        'model_name': st.session_state['model_selection'],
+        'temperature': st.session_state['temperature_slider'],
+        'max_output_tokens': st.session_state['max_output_tokens_slider'],
+        'top_p': st.session_state['top_p'],
+        'top_k': st.session_state['top_k'],
+        # 'stop_sequence': st.session_state['stop_sequence'],
+    }
+
 # Calculate the hash of the model using the model settings
 def calculate_model_hash() -> str:
-    
-    model_name = st.session_state['model_selection']
-    temperature = st.session_state['temperature_slider']
-    max_output_tokens = st.session_state['max_output_tokens_slider']
-    top_p = st.session_state['top_p']
-    top_k = st.session_state['top_k']
-    stop_sequence = st.session_state['stop_sequence']
-    
-    string_to_hash = f"{model_name}-{temperature}-{max_output_tokens}-{top_p}-{top_k}-{stop_sequence}"
-    return sha256(string_to_hash.encode()).hexdigest()
+    return calculate_llm_model_hash(**get_model_settings())
 
-# Load the Model
+# Load the Model from the shared model registry
 def load_model():
-    
-    if st.session_state['llm_providers'] == 'GoogleAI':
-        st.session_state['LLM'] = setup_gemini_model(
-            model_name=st.session_state['model_selection'],
-            temperature=st.session_state['temperature_slider'],
-            max_output_tokens=st.session_state['max_output_tokens_slider'],
-            top_p=st.session_state['top_p'],
-            top_k=st.session_state['top_k'],
-            # stop_sequence=st.session_state['stop_sequence']
-            is_vertexai_model=False,
-        )
-    elif st.session_state['llm_providers'] == 'VertexAI':
-        if 'gemini' in st.session_state['model_selection']:
-            st.session_state['LLM'] = setup_gemini_model(
-                model_name=st.session_state['model_selection'],
-                temperature=st.session_state['temperature_slider'],
-                max_output_tokens=st.session_state['max_output_tokens_slider'],
-                top_p=st.session_state['top_p'],
-                top_k=st.session_state['top_k'],
-                # stop_sequence=st.session_state['stop_sequence']
-                is_vertexai_model=True,
-            )
-        else:
-            st.session_state['LLM'], st.session_state['PARAMETERS'] = setup_palm2_model(
-                model_name=st.session_state['model_selection'],
-                temperature=st.session_state['temperature_slider'],
-                max_output_tokens=st.session_state['max_output_tokens_slider'],
-                top_p=st.session_state['top_p'],
-                top_k=st.session_state['top_k'],
-                # stop_sequence=st.session_state['stop_sequence']
-            )
+    st.session_state['LLM'], st.session_state['PARAMETERS'] = get_model(**get_model_settings())
+    st.session_state['LLM_HASH'] = calculate_model_hash()
 
 # Render Prompt
 def render_prompt() -> str:
-    
-    # Setup the Jinja2 Environment
-    env = jinja2.Environment()
-    
-    # Get the Prompt Template
-    prompt_template = env.from_string(prompt_info['prompt_template'])
-    
-    # Render the Prompt
-    rendered_prompt = prompt_template.render(
+    return render_template(
+        prompt_info['prompt_template'],
         **{var: st.session_state[f"{var}_input"] for var in prompt_info['input_variables']}
     )
-    
-    return rendered_prompt
+
+# Store the result of a single run, for comparing versions later
+def save_run_result(input_text:str, **result):
+    save_eval_run(
+        prompt_info['id'],
+        get_model_settings(),
+        [{
+            "input_text": input_text,
+            "input_values": {var: st.session_state[f"{var}_input"] for var in prompt_info['input_variables']},
+            **result
+        }],
+        connection,
+        cursor,
+    )
 
 # Run Model
-def run_model():
+def run_model() -> bool:
     # Get the Input Text
     input_text = render_prompt()
     
-    with st.spinner('Running LLM Model...'):
-            
-        if st.session_state['llm_providers'] == 'GoogleAI' and 'gemini' in st.session_state['model_selection']:
-            gemini_model:google_genai.GenerativeModel = st.session_state['LLM']
-            
-            print('Getting Input Token Count...')
-            st.session_state['INPUT_TOKEN_COUNT'] = get_token_count(render_prompt())
-            print('Running Model...')
-            st.session_state['LLM_OUTPUT'] = gemini_model.generate_content(input_text).text
-            print('Getting Outpu Token Count...')
-            st.session_state['OUTPUT_TOKEN_COUNT'] = get_token_count(st.session_state['LLM_OUTPUT'])
-        
-        elif st.session_state['llm_providers'] == 'VertexAI' and 'gemini' in st.session_state['model_selection']:
-            gemini_vertexai_model:vertexai_genai.GenerativeModel = st.session_state['LLM']
-            
-            print('Getting LLM Output...')
-            response = gemini_vertexai_model.generate_content(input_text)
-            st.session_state['LLM_OUTPUT'] = response.text
-            st.session_state['INPUT_TOKEN_COUNT'] = response.to_dict()['usage_metadata']['prompt_token_count']
-            st.session_state['OUTPUT_TOKEN_COUNT'] = response.to_dict()['usage_metadata']['candidates_token_count']
-        
-        elif st.session_state['llm_providers'] == 'VertexAI' and 'text' in st.session_state['model_selection']:
-            palm2_model: vertexai_plam2.TextGenerationModel = st.session_state['LLM']
-
-            print('Getting LLM Output...')
-            st.session_state['LLM_OUTPUT'] = palm2_model.predict(input_text, **st.session_state['PARAMETERS']).text
-            st.session_state['INPUT_TOKEN_COUNT'] = None
-            st.session_state['OUTPUT_TOKEN_COUNT'] = None
-        
-
-# Get token count
-def get_token_count(text:str) -> int:
-
-    # If model is Gemini
-    if 'gemini' in st.session_state['model_selection']:
-        llm:google_genai.GenerativeModel = st.session_state['LLM']
-        response = llm.count_tokens(text)
-        
-        return response.total_tokens
+    # Render the output as it streams in, the output editor below shows the full text afterwards
+    stats = {}
+    try:
+        st.write_stream(generate_stream(input_text, **get_model_settings(), stats=stats))
+    except CircuitOpenError as e:
+        st.error(f"{e}. Please try again later.", icon="🚫")
+        return False
+    except Exception as e:
+        # Transient errors were already retried, anything reaching here is final
+        st.error(f"Model call failed: {e}", icon="🚫")
+        save_run_result(input_text, error=f"{type(e).__name__}: {e}")
+        return False
+    
+    st.session_state['LLM_OUTPUT'] = stats['text']
+    st.session_state['INPUT_TOKEN_COUNT'] = stats['input_token_count']
+    st.session_state['OUTPUT_TOKEN_COUNT'] = stats['output_token_count']
+    st.session_state['LLM_OUTPUT_CACHED'] = stats['cached']
+    st.session_state['LLM_OUTPUT_STATS'] = stats
+    save_run_result(
+        input_text,
+        output=stats['text'],
+        latency=stats['total_time'],
+        input_token_count=stats['input_token_count'],
+        output_token_count=stats['output_token_count'],
+        cached=stats['cached'],
+    )
+    return True
 
 # Turn on the flag
 def turn_on_flag(flag:str):
@@ -360,8 +339,13 @@ with main_columns[3]:
         
         # Check if the model hash has changed
         if st.session_state['llm_providers'] and st.session_state['model_selection']:
-            if st.session_state['MODEL_HASH'] != calculate_model_hash():
-                st.session_state['MODEL_HASH'] = calculate_model_hash()
+            st.session_state['MODEL_HASH'] = calculate_model_hash()
+            
+            # Reuse an already loaded model with the same settings without asking again
+            if is_model_loaded(st.session_state['MODEL_HASH']):
+                if st.session_state.get('LLM_HASH') != st.session_state['MODEL_HASH']:
+                    load_model()
+            else:
                 st.warning('Setting changed. Please load model again!', icon="❗")
                 
                 # Load Model Button
@@ -457,14 +441,24 @@ with example_cols[3]:
     
     if st.session_state['run_button']:
         with st.empty():
-            run_model()
+            # Clear the streamed output once the editor below has it, errors stay visible
+            if run_model():
+                st.empty()
     
     if not run_button_disabled:
         input_text = render_prompt()
         expander_test = f"Input Text - `{st.session_state['INPUT_TOKEN_COUNT']}` Tokens" if st.session_state['INPUT_TOKEN_COUNT'] else "Input Text"
         with st.expander(expander_test):
-            st.code(render_prompt(), language='txt', line_numbers=True)
+            st.code(input_text, language='txt', line_numbers=True)
         
+    # Latency of the last run
+    if st.session_state['LLM_OUTPUT_STATS']:
+        stats = st.session_state['LLM_OUTPUT_STATS']
+        latency_info = [f"Time to first token: {stats['time_to_first_token']:.2f}s" if stats['time_to_first_token'] is not None else None, f"Total: {stats['total_time']:.2f}s"]
+        if stats['tokens_per_second']:
+            latency_info.append(f"{stats['tokens_per_second']:.1f} tokens/sec")
+        st.caption(' | '.join(info for info in latency_info if info))
+    
     # The prompt template editor
     options = load_codeEditor_config()
     options['readOnly'] = True
@@ -474,7 +468,7 @@ with example_cols[3]:
     button_config.pop(1)
     
     info_bar_options = load_codeEditor_infobar_config()
-    info_bar_options['info'][0]['name'] = f"LLM Output | {st.session_state['llm_providers'] if st.session_state['llm_providers'] else 'Select LLM Provider'} | {st.session_state['model_selection'] if st.session_state['model_selection'] else 'Select Model'}{' | ' + str(st.session_state['OUTPUT_TOKEN_COUNT']) + ' Tokens' if st.session_state['OUTPUT_TOKEN_COUNT'] else ''}"
+    info_bar_options['info'][0]['name'] = f"LLM Output | {st.session_state['llm_providers'] if st.session_state['llm_providers'] else 'Select LLM Provider'} | {st.session_state['model_selection'] if st.session_state['model_selection'] else 'Select Model'}{' | ' + str(st.session_state['OUTPUT_TOKEN_COUNT']) + ' Tokens' if st.session_state['OUTPUT_TOKEN_COUNT'] else ''}{' | Cached' if st.session_state['LLM_OUTPUT_CACHED'] else ''}"
     code_editor(
         code=st.session_state['LLM_OUTPUT'],
         options=options,
@@ -486,6 +480,98 @@ with example_cols[3]:
     )
 
 
+
+## Batch Run
+st.divider()
+st.subheader('Batch Run')
+batch_cols = st.columns([.05, .4, .05, .55, .05])
+
+with batch_cols[1]:
+    st.file_uploader(
+        'Dataset (CSV or JSONL)',
+        type=['csv', 'jsonl'],
+        key='batch_dataset_file',
+        help=f"One row per example, with a column for each input variable: {', '.join(prompt_info['input_variables'])}",
+    )
+    st.number_input('Workers', min_value=1, max_value=64, value=BATCH_MAX_WORKERS, key='batch_max_workers')
+    
+    # Button should be disabled if there is no dataset or the model is not selected
+    batch_run_disabled = st.session_state['batch_dataset_file'] is None or st.session_state['model_selection'] is None
+    st.columns(3)[1].button('⚙️ :green[Run Batch]', key='batch_run_button', use_container_width=True, disabled=batch_run_disabled)
+
+with batch_cols[3]:
+    
+    if st.session_state['batch_run_button']:
+        try:
+            dataset = load_dataset(st.session_state['batch_dataset_file'])
+            progress_bar = st.progress(0.0, text='Running batch...')
+            st.session_state['BATCH_RESULTS'] = run_batch(
+                prompt_template=prompt_info['prompt_template'],
+                input_variables=prompt_info['input_variables'],
+                dataset=dataset,
+                model_settings=get_model_settings(),
+                max_workers=st.session_state['batch_max_workers'],
+                progress_callback=lambda completed, total: progress_bar.progress(completed / total, text=f'Running batch... {completed}/{total}'),
+            )
+            progress_bar.empty()
+            save_eval_run(
+                prompt_info['id'],
+                get_model_settings(),
+                results_from_batch(st.session_state['BATCH_RESULTS'], prompt_info['input_variables']),
+                connection,
+                cursor,
+                source='batch',
+            )
+        except (ValueError, TemplateError) as e:
+            st.error(e)
+    
+    if st.session_state['BATCH_RESULTS'] is not None:
+        batch_summary = summarize_batch(st.session_state['BATCH_RESULTS'])
+        summary_cols = st.columns(4)
+        summary_cols[0].metric('Rows', batch_summary['rows'])
+        summary_cols[1].metric('Errors', batch_summary['errors'])
+        summary_cols[2].metric('Mean Latency', f"{batch_summary['mean_latency']:.2f}s" if batch_summary['mean_latency'] is not None else '-')
+        summary_cols[3].metric('Tokens (In / Out)', f"{batch_summary['input_tokens']} / {batch_summary['output_tokens']}")
+        
+        st.dataframe(st.session_state['BATCH_RESULTS'], use_container_width=True, hide_index=True)
+        st.download_button(
+            'Download Results',
+            data=st.session_state['BATCH_RESULTS'].to_csv(index=False),
+            file_name=f"{prompt_info['name']}_v{prompt_info['version']}_batch_results.csv",
+            mime='text/csv',
+        )
+
+
+## Evaluation History
+st.divider()
+st.subheader('Evaluation History')
+history_cols = st.columns([.05, .9, .05])
+
+with history_cols[1]:
+    # Stored runs of all versions of this prompt
+    eval_runs = get_eval_runs(cursor, prompt_group_id=prompt_info['prompt_group_id'])
+    
+    if len(eval_runs) == 0:
+        st.info('No stored runs yet!')
+    else:
+        st.dataframe(eval_runs.drop(columns=['id', 'prompt_id', 'model_hash']), use_container_width=True, hide_index=True)
+        
+        export_cols = st.columns([0.3, 0.35, 0.35])
+        export_format = export_cols[0].selectbox('Export Format', list(EVAL_EXPORT_FORMATS), format_func=str.capitalize, label_visibility='collapsed')
+        if export_cols[1].button(':package: Prepare Export', use_container_width=True):
+            try:
+                extension, mime = EVAL_EXPORT_FORMATS[export_format]
+                export_cols[2].download_button(
+                    ':arrow_down: Download Results',
+                    data=export_eval_results(get_eval_results(cursor, run_ids=eval_runs['id']), format=export_format),
+                    file_name=f"{prompt_info['name']}_eval_results.{extension}",
+                    mime=mime,
+                    use_container_width=True,
+                )
+            except ImportError as e:
+                st.error(e)
+
+
 st.divider()
 button_cols = st.columns(5)
 back_to_projects = button_cols[1].button(':leftwards_arrow_with_hook: Back to Projects', use_container_width=True)
@@ -1,5 +1,5 @@
+import io
 import os
-import sqlite3
 import streamlit as st
 from st_pages import hide_pages
 from streamlit_extras.card import card
@@ -9,7 +9,8 @@ from streamlit_extras.switch_page_button import switch_page
 import sys
 
 sys.path.append('../utils')
-from utils.sql_helper import get_all_prompt_groups, get_all_projects
+from utils.sql_helper import list_prompt_groups, get_project_details, export_project
+from utils.db_helper import get_connection
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -20,40 +21,63 @@ if 'config' not in st.session_state:
 
 # Setup the page
 st.set_page_config(layout='centered')
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
 hide_pages(st.session_state['config']['hidden_pages'])
 
+# Number of prompt cards shown per page (plus the two create cards)
+PAGE_SIZE = 10
+
+## Local Variables
+# Cursors of the pages visited so far, reset when the project changes
+if st.session_state.get('PROMPT_GROUPS_PAGE_PROJECT_ID') != st.session_state['CURRENT_PROJECT_ID']:
+    st.session_state['PROMPT_GROUPS_PAGE_PROJECT_ID'] = st.session_state['CURRENT_PROJECT_ID']
+    st.session_state['PROMPT_GROUPS_PAGE_CURSORS'] = [None]
+
 ## Helper functions
 # Delete local variables from st.session_state
 def clean_session_state():
     st.session_state.pop("create_prompt_from_scratch_card")
     st.session_state.pop("create_prompt_from_db_card")
+    st.session_state.pop("PROMPT_GROUPS_PAGE_PROJECT_ID")
+    st.session_state.pop("PROMPT_GROUPS_PAGE_CURSORS")
     
-    for idx in range(len(all_prompts)):
-        st.session_state.pop(f"prompt_card_{idx}")
+    for prompt_group in prompt_groups_page:
+        st.session_state.pop(f"prompt_card_{prompt_group.prompt_group_id}")
+
+# Move to the next page of prompts
+def next_page():
+    st.session_state['PROMPT_GROUPS_PAGE_CURSORS'].append(next_cursor)
+
+# Move back to the previous page of prompts
+def previous_page():
+    st.session_state['PROMPT_GROUPS_PAGE_CURSORS'].pop()
 
 
 # Get the Current Project Details
-all_projects = get_all_projects(cursor)
+project_info = get_project_details(cursor, st.session_state['CURRENT_PROJECT_ID'])
 
 st.title('Prompt Engineering Studio')
 st.header('Projects', divider='rainbow')
-st.subheader(all_projects[st.session_state['CURRENT_PROJECT_ID']]['name'])
-st.write(all_projects[st.session_state['CURRENT_PROJECT_ID']]['description'])
+st.subheader(project_info['name'])
+st.write(project_info['description'])
 st.divider()
 
-all_prompts = get_all_prompt_groups(cursor, st.session_state['CURRENT_PROJECT_ID'])
-all_prompts = {k: v for k, v in sorted(all_prompts.items(), key=lambda item: item[1]['name'])}
+# Get the current page of Prompts
+prompt_groups_page, next_cursor = list_prompt_groups(
+    cursor,
+    st.session_state['CURRENT_PROJECT_ID'],
+    columns=('prompt_group_id', 'name', 'description'),
+    page_size=PAGE_SIZE,
+    after=st.session_state['PROMPT_GROUPS_PAGE_CURSORS'][-1],
+)
+
 COL_NUM = 3
-if len(all_prompts) == 0:
-    rows = 1
-else:
-    quotient, remainder = divmod(len(all_prompts) + 2, COL_NUM)
-    rows = quotient if remainder == 0 else quotient + 1
+quotient, remainder = divmod(len(prompt_groups_page) + 2, COL_NUM)
+rows = quotient if remainder == 0 else quotient + 1
 
 project_grid = grid(*[COL_NUM for _ in range(rows)])
 
@@ -97,23 +121,29 @@ with project_grid.container():
 # Individual Prompt Cards
 cards = []
 card_ids = []
-for idx, prompt_group_id in enumerate(all_prompts):
+for prompt_group in prompt_groups_page:
     with project_grid.container():
-        if all_prompts[prompt_group_id]["description"]:
-            if len(all_prompts[prompt_group_id]["description"]) < 30:
-                description = all_prompts[prompt_group_id]["description"]
+        if prompt_group.description:
+            if len(prompt_group.description) < 30:
+                description = prompt_group.description
             else:
-                description = all_prompts[prompt_group_id]["description"][:30] + "..."
+                description = prompt_group.description[:30] + "..."
         else:
             description = ""
 
         cards.append(card(
-            title=all_prompts[prompt_group_id]['name'],
+            title=prompt_group.name,
             text=[description],
             styles=card_styles,
-            key=f"prompt_card_{idx}"
+            key=f"prompt_card_{prompt_group.prompt_group_id}"
         ))
-        card_ids.append(prompt_group_id)
+        card_ids.append(prompt_group.prompt_group_id)
+
+# Pagination
+page_cols = st.columns(5)
+page_cols[1].button(':arrow_backward: Previous', key='prompt_groups_previous_page', use_container_width=True, on_click=previous_page, disabled=len(st.session_state['PROMPT_GROUPS_PAGE_CURSORS']) == 1)
+page_cols[2].markdown(f"<p style='text-align: center'>Page {len(st.session_state['PROMPT_GROUPS_PAGE_CURSORS'])}</p>", unsafe_allow_html=True)
+page_cols[3].button('Next :arrow_forward:', key='prompt_groups_next_page', use_container_width=True, on_click=next_page, disabled=next_cursor is None)
 
 # Switch to Create New Prompt Page
 if st.session_state['create_prompt_from_scratch_card']:
@@ -147,8 +177,23 @@ if update_project:
 
 if lineage_graph:
     clean_session_state()
+    st.session_state.pop('LINEAGE_PROMPT_GROUP_ID', None)
     switch_page("project_level_prompt_lineage")
 
+# Export the Project with all its prompt versions as a compressed archive
+with st.expander('Export Project'):
+    if st.button(':package: Prepare Archive', use_container_width=True):
+        archive = io.BytesIO()
+        with st.spinner('Exporting prompts...'):
+            prompt_count = export_project(cursor, project_info['id'], archive)
+        st.download_button(
+            label=f':arrow_down: Download ({prompt_count} prompts)',
+            data=archive.getvalue(),
+            file_name=f"{project_info['name']}.jsonl.gz",
+            mime='application/gzip',
+            use_container_width=True
+        )
+
 st.divider()
 with st.expander('Session State'):
     st.json(st.session_state, expanded=True)
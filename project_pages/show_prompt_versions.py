@@ -1,5 +1,4 @@
 import os
-import sqlite3
 import streamlit as st
 from st_pages import hide_pages
 from streamlit_extras.grid import grid
@@ -9,6 +8,7 @@ import sys
 
 sys.path.append('../utils')
 from utils.sql_helper import get_prompt_group_details, get_all_projects, get_all_prompt_versions
+from utils.db_helper import get_connection
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -20,8 +20,8 @@ if 'config' not in st.session_state:
 # Setup the page
 st.set_page_config(layout='wide')
 
-# Set Connection to SQL Database and Create a cursor object
-connection = sqlite3.connect(os.getenv('DB_PATH'))
+# Get the pooled SQL Database connection and Create a cursor object
+connection = get_connection()
 cursor = connection.cursor()
 
 # Hide Internal Pages
@@ -107,9 +107,11 @@ if st.session_state["SWITCH_TO_PROMPT_TESTING"]:
     switch_page("prompt_version_testing")
 
 st.divider()
-button_cols = st.columns(5)
+button_cols = st.columns(6)
 back_to_projects = button_cols[1].button(':leftwards_arrow_with_hook: Back to Projects', use_container_width=True)
-back_to_current_project = button_cols[3].button(':leftwards_arrow_with_hook: Back to Current Project', use_container_width=True)
+lineage_graph = button_cols[2].button(':bar_chart: Lineage Graph', use_container_width=True)
+compare_versions = button_cols[3].button(':scales: Compare Versions', use_container_width=True)
+back_to_current_project = button_cols[4].button(':leftwards_arrow_with_hook: Back to Current Project', use_container_width=True)
 
 if back_to_projects:
     clean_session_state()
@@ -119,6 +121,15 @@ if back_to_current_project:
     clean_session_state()
     switch_page("show_project")
 
+if lineage_graph:
+    clean_session_state()
+    st.session_state['LINEAGE_PROMPT_GROUP_ID'] = st.session_state['CURRENT_PROMPT_GROUP_ID']
+    switch_page("project_level_prompt_lineage")
+
+if compare_versions:
+    clean_session_state()
+    switch_page("compare_prompt_versions")
+
 st.divider()
 with st.expander('Session State'):
     st.json(st.session_state, expanded=True)
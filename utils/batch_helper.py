@@ -0,0 +1,221 @@
+import io
+import os
+import time
+import asyncio
+import pandas as pd
+from concurrent.futures import as_completed
+from typing import Callable, Dict, List, Optional, Union
+
+from utils.llm_helper import agenerate, submit, calculate_model_hash
+from utils.template_helper import compile_template
+
+# Default number of concurrent model calls of a batch run
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 8))
+
+# Columns added to the dataset by `run_batch`
+BATCH_RESULT_COLUMNS = ['output', 'error', 'latency', 'input_token_count', 'output_token_count', 'cached']
+
+# Columns of the results that a dataset must not have, they would be overwritten
+BATCH_RESERVED_COLUMNS = ['rendered_prompt'] + BATCH_RESULT_COLUMNS
+COMPARISON_RESERVED_COLUMNS = ['prompt_id', 'version', 'model', 'model_hash', 'row'] + BATCH_RESERVED_COLUMNS + ['shared', 'cost']
+
+
+# Load a dataset of input variable rows from a CSV or JSONL file (path or uploaded file object)
+# All values are read as text, missing values become empty strings
+def load_dataset(file:Union[str, io.IOBase], file_name:Optional[str] = None) -> pd.DataFrame:
+    file_name = file_name or getattr(file, 'name', None) or str(file)
+
+    if file_name.lower().endswith(('.jsonl', '.ndjson')):
+        dataset = pd.read_json(file, lines=True, dtype=False)
+    elif file_name.lower().endswith('.csv'):
+        dataset = pd.read_csv(file, dtype=str, keep_default_na=False)
+    else:
+        raise ValueError(f"Unsupported dataset format: {file_name}")
+
+    return dataset.fillna('').astype(str)
+
+
+# Get the input variables of the template that are missing in the dataset
+def get_missing_columns(dataset:pd.DataFrame, input_variables:List[str]) -> List[str]:
+    return [var for var in input_variables if var not in dataset.columns]
+
+
+# Check that the dataset has every input variable and none of the reserved result columns
+def check_dataset_columns(dataset:pd.DataFrame, input_variables:List[str], reserved_columns:List[str]):
+    missing_columns = get_missing_columns(dataset, input_variables)
+    if missing_columns:
+        raise ValueError(f"Dataset is missing the input variables: {', '.join(missing_columns)}")
+
+    reserved = [column for column in dataset.columns if column in reserved_columns]
+    if reserved:
+        raise ValueError(f"Dataset columns are reserved for the results, please rename them: {', '.join(map(str, reserved))}")
+
+
+# Run a single row and time it, errors are recorded instead of raised so one bad row does not stop the batch
+async def _run_row(input_text:str, model_settings:dict, semaphore:asyncio.Semaphore) -> dict:
+    async with semaphore:
+        start_time = time.perf_counter()
+        try:
+            response = await agenerate(input_text, **model_settings)
+            error = None
+        except Exception as e:
+            response = {'text': None, 'input_token_count': None, 'output_token_count': None, 'cached': False}
+            error = f"{type(e).__name__}: {e}"
+
+    return {
+        "output": response['text'],
+        "error": error,
+        "latency": time.perf_counter() - start_time,
+        "input_token_count": response['input_token_count'],
+        "output_token_count": response['output_token_count'],
+        "cached": response['cached']
+    }
+
+
+# Render every row of the dataset with the prompt template and run them concurrently against the model
+# At most `max_workers` rows are in flight, on top of the provider's own concurrency and rate limits
+# `progress_callback(completed, total)` is called from the calling thread, so it can update the UI
+# Returns a copy of the dataset with the rendered prompt and the `BATCH_RESULT_COLUMNS`, in the original row order
+def run_batch(
+    prompt_template:str,
+    input_variables:List[str],
+    dataset:pd.DataFrame,
+    model_settings:dict,
+    max_workers:int = BATCH_MAX_WORKERS,
+    progress_callback:Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
+
+    check_dataset_columns(dataset, input_variables, BATCH_RESERVED_COLUMNS)
+
+    # Compile the template once for all rows
+    template, _ = compile_template(prompt_template)
+    rendered_prompts = [template.render(**row) for row in dataset[input_variables].to_dict(orient='records')]
+
+    # Rows run on the shared event loop, results are collected here as they complete
+    results = [None] * len(rendered_prompts)
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    futures = {submit(_run_row(input_text, model_settings, semaphore)): idx for idx, input_text in enumerate(rendered_prompts)}
+
+    for completed, future in enumerate(as_completed(futures), start=1):
+        results[futures[future]] = future.result()
+        if progress_callback is not None:
+            progress_callback(completed, len(rendered_prompts))
+
+    output = dataset.reset_index(drop=True).copy()
+    output['rendered_prompt'] = rendered_prompts
+    return pd.concat([output, pd.DataFrame(results, columns=BATCH_RESULT_COLUMNS)], axis=1)
+
+
+# Summary of a batch run
+def summarize_batch(results:pd.DataFrame) -> dict:
+    succeeded = results[results['error'].isna()]
+
+    return {
+        "rows": len(results),
+        "errors": int(results['error'].notna().sum()),
+        "cached": int(results['cached'].sum()),
+        "mean_latency": float(succeeded['latency'].mean()) if len(succeeded) else None,
+        "p95_latency": float(succeeded['latency'].quantile(0.95)) if len(succeeded) else None,
+        "input_tokens": int(pd.to_numeric(results['input_token_count']).fillna(0).sum()),
+        "output_tokens": int(pd.to_numeric(results['output_token_count']).fillna(0).sum())
+    }
+
+
+# Label of a model configuration in comparison results
+def model_label(model_settings:dict) -> str:
+    return f"{model_settings['provider']}/{model_settings['model_name']} (t={model_settings.get('temperature', 0)}, max={model_settings.get('max_output_tokens', 1024)})"
+
+
+# Estimated cost in USD of a call, `pricing` maps model names to USD per million input and output tokens
+# Cached responses cost nothing, unknown models and token counts are None
+def estimate_cost(model_name:str, input_token_count:Optional[int], output_token_count:Optional[int], cached:bool, pricing:Dict[str, dict]) -> Optional[float]:
+    if cached:
+        return 0.0
+    if model_name not in pricing or input_token_count is None or output_token_count is None:
+        return None
+    return (input_token_count * pricing[model_name]['input'] + output_token_count * pricing[model_name]['output']) / 1e6
+
+
+# Run every dataset row through every prompt version with every model configuration
+# `prompts` are prompt details (id, version, prompt_template, input_variables) and `model_configs` model settings dicts
+# Identical (rendered prompt, model) cells, e.g. versions whose templates render the same, share a single call
+# All calls go through the shared event loop and provider rate limits, at most `max_workers` at a time
+# `progress_callback(completed, total)` counts distinct calls
+# Returns one row per (version, model, dataset row) with the dataset columns, the `COMPARISON_RESERVED_COLUMNS`,
+# where `shared` means the result came from another cell's call and `cost` is the estimated cost of the call
+def run_comparison(
+    prompts:List[dict],
+    model_configs:List[dict],
+    dataset:pd.DataFrame,
+    max_workers:int = BATCH_MAX_WORKERS,
+    progress_callback:Optional[Callable[[int, int], None]] = None,
+    pricing:Optional[Dict[str, dict]] = None) -> pd.DataFrame:
+
+    input_variables = sorted({var for prompt in prompts for var in prompt['input_variables']})
+    check_dataset_columns(dataset, input_variables, COMPARISON_RESERVED_COLUMNS)
+
+    dataset_rows = dataset.to_dict(orient='records')
+    rows = dataset[input_variables].to_dict(orient='records')
+    model_hashes = [calculate_model_hash(**model_settings) for model_settings in model_configs]
+
+    # Render every version once per row, then lay out the cells and the distinct calls behind them
+    cells, calls = [], {}
+    for prompt in prompts:
+        template, _ = compile_template(prompt['prompt_template'])
+        rendered_prompts = [template.render(**row) for row in rows]
+        for model_settings, model_hash in zip(model_configs, model_hashes):
+            for idx, input_text in enumerate(rendered_prompts):
+                key = (model_hash, input_text)
+                cells.append((prompt, model_settings, idx, input_text, key, key in calls))
+                calls.setdefault(key, (input_text, model_settings))
+
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    futures = {submit(_run_row(input_text, model_settings, semaphore)): key for key, (input_text, model_settings) in calls.items()}
+
+    results = {}
+    for completed, future in enumerate(as_completed(futures), start=1):
+        results[futures[future]] = future.result()
+        if progress_callback is not None:
+            progress_callback(completed, len(futures))
+
+    pricing = pricing or {}
+    records = []
+    for prompt, model_settings, idx, input_text, key, shared in cells:
+        result = results[key]
+        records.append({
+            **dataset_rows[idx],
+            "prompt_id": prompt['id'],
+            "version": prompt['version'],
+            "model": model_label(model_settings),
+            "model_hash": key[0],
+            "row": idx,
+            "rendered_prompt": input_text,
+            **result,
+            "shared": shared,
+            "cost": estimate_cost(model_settings['model_name'], result['input_token_count'], result['output_token_count'], result['cached'], pricing)
+        })
+
+    return pd.DataFrame(records)
+
+
+# Summary per (version, model) of a comparison run; the spend only counts the calls each cell group actually made
+def summarize_comparison(results:pd.DataFrame) -> pd.DataFrame:
+    cost = pd.to_numeric(results['cost'])
+    results = results.assign(
+        failed=results['error'].notna(),
+        latency=results['latency'].where(results['error'].isna()),
+        spent=cost.where(~results['shared'] | cost.isna(), 0),
+        input_token_count=pd.to_numeric(results['input_token_count']),
+        output_token_count=pd.to_numeric(results['output_token_count']),
+    )
+
+    return results.groupby(['version', 'model'], sort=False).agg(
+        rows=('row', 'size'),
+        errors=('failed', 'sum'),
+        shared=('shared', 'sum'),
+        cached=('cached', 'sum'),
+        mean_latency=('latency', 'mean'),
+        p95_latency=('latency', lambda latency: latency.quantile(0.95)),
+        input_tokens=('input_token_count', 'sum'),
+        output_tokens=('output_token_count', 'sum'),
+        cost=('spent', lambda spent: spent.sum(min_count=1)),
+    ).reset_index()
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+# Thread-safe LRU cache shared by all sessions of the process
+# Entries are stored per key; `generation` is bumped by writers to retire cached listings,
+# which are stored under keys containing the generation they were read at
+class LRUCache:
+
+    def __init__(self, maxsize:int = 1024):
+        self.maxsize = maxsize
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key:Hashable) -> bool:
+        return key in self._data
+
+    # Get a value and mark it as most recently used
+    def get(self, key:Hashable, default:Optional[Any] = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    # Add a value, evicting the least recently used entries over `maxsize`
+    def set(self, key:Hashable, value:Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # Drop a single entry
+    def invalidate(self, key:Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    # Retire every entry stored under the current generation
+    def bump_generation(self) -> int:
+        with self._lock:
+            self.generation += 1
+            return self.generation
+
+    # Drop everything
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
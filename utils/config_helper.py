@@ -0,0 +1,31 @@
+import os
+import copy
+import json
+import threading
+from typing import Any, Dict, Tuple
+
+# Parsed JSON config files keyed by absolute path, with the modification time they were read at
+_CONFIGS: Dict[str, Tuple[float, Any]] = {}
+_CONFIGS_LOCK = threading.Lock()
+
+
+# Load a JSON config file once per process, re-reading it only when its modification time changes
+# Returns a deep copy, so callers can change it (e.g. `readOnly`, `wrap`) without affecting others
+def load_config(fpath:str) -> Any:
+    fpath = os.path.abspath(fpath)
+    mtime = os.stat(fpath).st_mtime_ns
+
+    cached = _CONFIGS.get(fpath)
+    if cached is None or cached[0] != mtime:
+        with _CONFIGS_LOCK:
+            with open(fpath, "r") as f:
+                cached = (mtime, json.load(f))
+            _CONFIGS[fpath] = cached
+
+    return copy.deepcopy(cached[1])
+
+
+# Forget the loaded configs, the next `load_config` reads from disk
+def clear_configs():
+    with _CONFIGS_LOCK:
+        _CONFIGS.clear()
@@ -0,0 +1,89 @@
+import os
+import atexit
+import sqlite3
+import threading
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from utils.schema_helper import migrate, register_functions
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Pragmas applied to every pooled connection
+# WAL lets readers proceed while a writer commits, NORMAL sync is safe under WAL
+CONNECTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'recursive_triggers': 'ON',
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,       # ~20MB page cache
+    'mmap_size': 268435456,     # 256MB
+}
+
+# Number of compiled statements kept per connection for reuse
+CACHED_STATEMENTS = 256
+
+# Process-wide connection pool, one shared connection per database file
+_CONNECTIONS: Dict[str, sqlite3.Connection] = {}
+_POOL_LOCK = threading.Lock()
+
+# Serialises access to the shared connections across Streamlit sessions (threads)
+DB_LOCK = threading.RLock()
+
+
+# Open a new connection, apply the tuned pragmas, register the SQL functions and bring the schema up to date
+def _open_connection(db_path:str) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        db_path,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+        timeout=CONNECTION_PRAGMAS['busy_timeout'] / 1000,
+    )
+    for pragma, value in CONNECTION_PRAGMAS.items():
+        connection.execute(f"PRAGMA {pragma} = {value}")
+
+    register_functions(connection)
+    migrate(connection)
+
+    return connection
+
+
+# Get the pooled connection for the database, creating it on first use
+def get_connection(db_path:Optional[str] = None) -> sqlite3.Connection:
+    db_path = db_path or os.getenv('DB_PATH')
+
+    connection = _CONNECTIONS.get(db_path)
+    if connection is not None:
+        return connection
+
+    with _POOL_LOCK:
+        if db_path not in _CONNECTIONS:
+            _CONNECTIONS[db_path] = _open_connection(db_path)
+        return _CONNECTIONS[db_path]
+
+
+# Get a fresh cursor on the pooled connection
+def get_cursor(db_path:Optional[str] = None) -> sqlite3.Cursor:
+    return get_connection(db_path).cursor()
+
+
+# Close all pooled connections
+def close_connections():
+    with _POOL_LOCK:
+        for connection in _CONNECTIONS.values():
+            connection.close()
+        _CONNECTIONS.clear()
+
+atexit.register(close_connections)
+
+
+# Decorator to run a function while holding the database lock
+def synchronized(func:Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with DB_LOCK:
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,85 @@
+import json
+import zlib
+import sqlite3
+from difflib import SequenceMatcher
+
+from utils.cache_helper import LRUCache
+
+# Reconstructed text of encoded templates, keyed by hash so it never goes stale
+TEMPLATE_CACHE = LRUCache(maxsize=1024)
+
+
+# Compress a full template snapshot
+def compress_text(text:str) -> bytes:
+    return zlib.compress(text.encode(), 9)
+
+
+# Decompress a full template snapshot
+def decompress_text(data:bytes) -> str:
+    return zlib.decompress(data).decode()
+
+
+# Line based delta turning `base` into `text`
+# Serialized as a list of [start, end] (copy lines from base) or strings (inserted text)
+def make_delta(base:str, text:str) -> bytes:
+    base_lines = base.splitlines(keepends=True)
+    text_lines = text.splitlines(keepends=True)
+
+    operations = []
+    matcher = SequenceMatcher(None, base_lines, text_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            operations.append([i1, i2])
+        elif j2 > j1:
+            operations.append(''.join(text_lines[j1:j2]))
+
+    return zlib.compress(json.dumps(operations, separators=(',', ':')).encode(), 9)
+
+
+# Rebuild the text from its base and a delta created by `make_delta`
+def apply_delta(base:str, delta:bytes) -> str:
+    base_lines = base.splitlines(keepends=True)
+
+    parts = []
+    for operation in json.loads(zlib.decompress(delta)):
+        if isinstance(operation, str):
+            parts.append(operation)
+        else:
+            parts.extend(base_lines[operation[0]:operation[1]])
+
+    return ''.join(parts)
+
+
+# Get the text of a stored template, following its delta chain back to a snapshot if encoded
+# `cache` (an LRUCache) holds reconstructed texts by hash, they never go stale
+def load_template(cursor:sqlite3.Cursor, template_hash:str, cache=None) -> str:
+
+    # Walk back until a plain, snapshot or already reconstructed template
+    deltas = []
+    current_hash = template_hash
+    while True:
+        text = cache.get(current_hash) if cache is not None else None
+        if text is not None:
+            break
+
+        cursor.execute("SELECT template, encoding, base_hash, data FROM prompt_templates WHERE hash = ?", (current_hash,))
+        template, encoding, base_hash, data = cursor.fetchone()
+        if encoding == 'text':
+            text = template
+            break
+        if encoding == 'zlib':
+            text = decompress_text(data)
+            if cache is not None:
+                cache.set(current_hash, text)
+            break
+
+        deltas.append((current_hash, data))
+        current_hash = base_hash
+
+    # Replay the deltas from the oldest
+    for delta_hash, delta in reversed(deltas):
+        text = apply_delta(text, delta)
+        if cache is not None:
+            cache.set(delta_hash, text)
+
+    return text
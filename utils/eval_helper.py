@@ -0,0 +1,173 @@
+import io
+import json
+import time
+import uuid
+import sqlite3
+import pandas as pd
+from hashlib import sha256
+from typing import List, Optional, Sequence, Union
+
+from utils.cache_helper import LRUCache
+from utils.db_helper import synchronized
+from utils.sql_helper import PROMPT_CACHE, transaction
+from utils.llm_helper import calculate_model_hash
+
+# Where a run came from
+EVAL_SOURCES = ('single', 'batch', 'comparison')
+
+# Columns of a stored result, in `get_eval_results` order
+EVAL_RESULT_COLUMNS = ['run_id', 'prompt_id', 'model_hash', 'input_hash', 'input_values', 'input_text', 'output', 'error', 'latency', 'input_token_count', 'output_token_count', 'cached', 'created_at']
+
+# Export formats as (file extension, mime type); Parquet and Arrow need pyarrow
+EVAL_EXPORT_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.file'),
+    'csv': ('csv', 'text/csv'),
+}
+
+# Run listings, stored under the generations of this cache (bumped by `save_eval_run`) and of the prompt cache
+EVAL_CACHE = LRUCache(maxsize=256)
+
+
+# Hash of a rendered model input, results of the same input are matched on it
+def input_hash(input_text:str) -> str:
+    return sha256(input_text.encode()).hexdigest()
+
+
+# Store a run of a prompt version with its results in one transaction, returns the run id
+# `model_settings` are the keyword arguments of `calculate_model_hash` (provider, model_name, temperature...)
+# Each result is a dict with input_text and optionally input_values, output, error, latency, input_token_count, output_token_count and cached
+@synchronized
+def save_eval_run(
+    prompt_id:str,
+    model_settings:dict,
+    results:List[dict],
+    connection:sqlite3.Connection,
+    cursor:sqlite3.Cursor,
+    source:str = 'single',
+    notes:Optional[str] = None) -> str:
+
+    if source not in EVAL_SOURCES:
+        raise ValueError(f"Invalid eval run source: {source}")
+
+    run_id = uuid.uuid4().hex
+    model_hash = calculate_model_hash(**model_settings)
+    now = time.time()
+
+    with transaction(connection):
+        cursor.execute(
+            "INSERT INTO eval_runs (id, prompt_id, model_hash, provider, model_name, model_settings, source, notes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, prompt_id, model_hash, model_settings['provider'], model_settings['model_name'], json.dumps(model_settings, sort_keys=True), source, notes, now)
+        )
+        cursor.executemany(
+            "INSERT INTO eval_results (run_id, prompt_id, model_hash, input_hash, input_values, input_text, output, error, latency, input_token_count, output_token_count, cached, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    run_id, prompt_id, model_hash, input_hash(result['input_text']),
+                    json.dumps(result['input_values'], sort_keys=True) if result.get('input_values') is not None else None,
+                    result['input_text'], result.get('output'), result.get('error'), result.get('latency'),
+                    result.get('input_token_count'), result.get('output_token_count'), int(bool(result.get('cached'))), now
+                )
+                for result in results
+            ]
+        )
+
+    EVAL_CACHE.bump_generation()
+    return run_id
+
+
+# Convert the output of `batch_helper.run_batch` to results for `save_eval_run`
+def results_from_batch(batch_results:pd.DataFrame, input_variables:List[str]) -> List[dict]:
+    records = batch_results.astype(object).where(batch_results.notna(), None).to_dict(orient='records')
+    return [
+        {
+            "input_text": record['rendered_prompt'],
+            "input_values": {var: record[var] for var in input_variables},
+            "output": record['output'],
+            "error": record['error'],
+            "latency": record['latency'],
+            "input_token_count": record['input_token_count'],
+            "output_token_count": record['output_token_count'],
+            "cached": record['cached']
+        }
+        for record in records
+    ]
+
+
+# Get the runs of a prompt version or of all versions of a prompt group, newest first, with their result counts
+# Listings are cached until the next run is stored or a prompt changes
+@synchronized
+def get_eval_runs(cursor:sqlite3.Cursor, prompt_id:Optional[str] = None, prompt_group_id:Optional[str] = None, limit:int = 100) -> pd.DataFrame:
+    if prompt_id is not None:
+        where, params = "eval_runs.prompt_id = ?", [prompt_id]
+    elif prompt_group_id is not None:
+        where, params = "eval_runs.prompt_id IN (SELECT id FROM prompts WHERE prompt_group_id = ?)", [prompt_group_id]
+    else:
+        where, params = "1", []
+
+    cache_key = ('runs', prompt_id, prompt_group_id, limit, EVAL_CACHE.generation, PROMPT_CACHE.generation)
+    runs = EVAL_CACHE.get(cache_key)
+    if runs is not None:
+        return runs.copy()
+
+    cursor.execute(f"""
+        SELECT eval_runs.id, eval_runs.prompt_id, prompts.version, eval_runs.provider, eval_runs.model_name, eval_runs.model_hash, eval_runs.source,
+            COUNT(eval_results.id), SUM(eval_results.error IS NOT NULL), AVG(eval_results.latency),
+            SUM(eval_results.input_token_count), SUM(eval_results.output_token_count), eval_runs.notes, eval_runs.created_at
+        FROM eval_runs
+        JOIN prompts ON prompts.id = eval_runs.prompt_id
+        LEFT JOIN eval_results ON eval_results.run_id = eval_runs.id
+        WHERE {where}
+        GROUP BY eval_runs.id
+        ORDER BY eval_runs.created_at DESC
+        LIMIT ?
+        """, params + [limit])
+
+    runs = pd.DataFrame(cursor.fetchall(), columns=['id', 'prompt_id', 'version', 'provider', 'model_name', 'model_hash', 'source', 'rows', 'errors', 'mean_latency', 'input_tokens', 'output_tokens', 'notes', 'created_at'])
+    runs['created_at'] = pd.to_datetime(runs['created_at'], unit='s')
+    EVAL_CACHE.set(cache_key, runs)
+    return runs.copy()
+
+
+# Get the stored results of some runs, or of a prompt version optionally narrowed to a model and an input
+@synchronized
+def get_eval_results(
+    cursor:sqlite3.Cursor,
+    run_ids:Optional[Sequence[str]] = None,
+    prompt_id:Optional[str] = None,
+    model_hash:Optional[str] = None,
+    input_text:Optional[str] = None) -> pd.DataFrame:
+
+    if run_ids is not None:
+        where, params = "run_id IN (SELECT value FROM json_each(?))", [json.dumps(list(run_ids))]
+    elif prompt_id is not None:
+        where, params = "prompt_id = ?", [prompt_id]
+        if model_hash is not None:
+            where, params = where + " AND model_hash = ?", params + [model_hash]
+            if input_text is not None:
+                where, params = where + " AND input_hash = ?", params + [input_hash(input_text)]
+    else:
+        raise ValueError("Either run_ids or prompt_id is required")
+
+    cursor.execute(f"SELECT {', '.join(EVAL_RESULT_COLUMNS)} FROM eval_results WHERE {where} ORDER BY created_at, id", params)
+
+    results = pd.DataFrame(cursor.fetchall(), columns=EVAL_RESULT_COLUMNS)
+    results['cached'] = results['cached'].astype(bool)
+    results['created_at'] = pd.to_datetime(results['created_at'], unit='s')
+    return results
+
+
+# Write results to a file path or buffer as Parquet, Arrow (IPC file) or CSV; returns the bytes if no destination is given
+def export_eval_results(results:pd.DataFrame, destination:Union[str, io.IOBase, None] = None, format:str = 'parquet') -> Optional[bytes]:
+    if format not in EVAL_EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {format}")
+
+    buffer = io.BytesIO() if destination is None else destination
+    if format == 'parquet':
+        results.to_parquet(buffer, index=False)
+    elif format == 'arrow':
+        results.reset_index(drop=True).to_feather(buffer)
+    else:
+        results.to_csv(buffer, index=False)
+
+    return buffer.getvalue() if destination is None else None
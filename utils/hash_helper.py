@@ -0,0 +1,6 @@
+import hashlib
+
+
+# Content hash used as the key of a stored prompt template and of compiled templates
+def template_hash(prompt_template:str) -> str:
+    return hashlib.sha256(prompt_template.encode()).hexdigest()
@@ -1,49 +1,33 @@
 import os
-import pandas as pd
 from graphviz import Digraph
+from itertools import groupby
+from operator import itemgetter
+from typing import List
 import re
 
+from utils.config_helper import load_config
+from utils.template_helper import compile_template
+
 def load_codeEditor_config(
     fpath: str = os.path.join("utils", "codeEditorOptions.json"),
 ) -> dict:
-    import json
-
-    with open(fpath, "r") as f:
-        config = json.load(f)
-    return config
+    return load_config(fpath)
 
 
 def load_codeEditor_infobar_config(
     fpath: str = os.path.join("utils", "codeEditorInfoBar.json"),
 ) -> dict:
-    import json
-
-    with open(fpath, "r") as f:
-        config = json.load(f)
-    return config
+    return load_config(fpath)
 
 
 def load_codeEditor_buttons_config(
     fpath: str = os.path.join("utils", "codeEditorButtons.json"),
 ) -> dict:
-    import json
-
-    with open(fpath, "r") as f:
-        config = json.load(f)
-    return config
+    return load_config(fpath)
 
 # Get input variables from given prompt template
 def get_input_variables(prompt_template_text:str) -> list:
-    
-    from jinja2 import Environment, meta
-    
-    # Initialize Jinja2 environment
-    env = Environment()
-    
-    # Find variable names
-    input_variables = list(meta.find_undeclared_variables(env.parse(prompt_template_text)))
-
-    return input_variables
+    return compile_template(prompt_template_text)[1]
 
 
 # Replace a space with a newline after every couple of words
@@ -54,17 +38,18 @@ def replace_space_with_newline(text):
 
 
 # Create Project Level Prompt Lineage Graph
-def project_level_prompt_lineage(prompts:pd.DataFrame) -> Digraph:
+# `nodes` are (id, prompt_group_id, name, version) ordered by prompt_group_id, `edges` are (parent_id, child_id)
+def project_level_prompt_lineage(nodes:List[tuple], edges:List[tuple]) -> Digraph:
     
     # Initiate a Digraph
     g = Digraph('G')
     
-    # Create clusters by prompt_group_id
-    for cluster_idx, prompt_group_id in enumerate(prompts.prompt_group_id.unique()):
+    # Create clusters by prompt_group_id, the nodes arrive grouped so a single pass is enough
+    for cluster_idx, (prompt_group_id, subprompts) in enumerate(groupby(nodes, key=itemgetter(1))):
         
         # Different versions of the same prompt act as Nodes in the cluster
-        subprompts:pd.DataFrame = prompts[prompts.prompt_group_id == prompt_group_id].copy(deep=True)
-        subgraph_name:str = subprompts.name.values[0]
+        subprompts = list(subprompts)
+        subgraph_name:str = subprompts[0][2]
         
         if len(subgraph_name.split()) > 2:
             subgraph_name = replace_space_with_newline(subgraph_name)
@@ -72,13 +57,10 @@ def project_level_prompt_lineage(prompts:pd.DataFrame) -> Digraph:
         with g.subgraph(name=f'cluster_{cluster_idx}') as c:
             c.attr(label=subgraph_name)
 
-            for prompt_idx, prompt in subprompts.iterrows():
-                c.node(name=prompt.id, label=f'v{str(prompt.version)}')
+            for id, _, _, version in subprompts:
+                c.node(name=id, label=f'v{str(version)}')
     
     # Create edges between prompts
-    for prompt_idx, prompt in prompts.iterrows():
-        if prompt.parent_prompt_id:
-            for parent_idx in prompt.parent_prompt_id.split(','):
-                g.edge(parent_idx, prompt.id)
+    g.edges(edges)
     
     return g
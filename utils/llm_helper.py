@@ -1,24 +1,83 @@
 import os
-import google.generativeai as google_genai
+import math
+import time
+import asyncio
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from hashlib import sha256
+from typing import TYPE_CHECKING, Any, Coroutine, Iterator, List, Optional, Tuple, Union
 
-import google.auth
-import vertexai
-import vertexai.generative_models as vertexai_genai
-import vertexai.language_models as vertexai_plam2
+from utils.cache_helper import LRUCache
+from utils.mock_llm_helper import MockModel
+from utils.rate_limit_helper import TokenBucket
+from utils.retry_helper import call_with_retry, call_with_retry_sync
+from utils.response_cache_helper import is_cacheable, get_cached_response, set_cached_response
 
-from typing import List, Optional, Tuple, Union
+# The SDKs are heavy to import, they are only loaded once a provider is used (see `init_google_ai` / `init_vertexai`)
+if TYPE_CHECKING:
+    import google.generativeai as google_genai
+    import vertexai.generative_models as vertexai_genai
+    import vertexai.language_models as vertexai_plam2
 
 from dotenv import load_dotenv
 load_dotenv()
 
-# Configure the API key
-# google_genai.configure(api_key=os.getenv('GOOGLE_API_KEY'), transport="rest") ## Facing Issues with GRPC, hence `rest` is used
-google_genai.configure(api_key=os.getenv('GOOGLE_API_KEY')) ## Issue solved - Issue was with WSL
+# Offline mode: only the Mock provider is usable and no credentials are looked up
+LLM_OFFLINE = os.getenv('LLM_OFFLINE', '').lower() in ('1', 'true', 'yes')
 
-# Setup VertexAI
-credentials, project_id = google.auth.default()
 LOCATION = os.getenv('GCP_LOCATION')
-vertexai.init(project=os.getenv('GCP_PROJECT'), location=LOCATION, credentials=credentials)
+
+# Providers initialised so far in this process
+_INITIALISED_PROVIDERS = set()
+_INIT_LOCK = threading.Lock()
+
+
+# Fail early when a real provider is requested in offline mode
+def _check_online(provider:str):
+    if LLM_OFFLINE:
+        raise RuntimeError(f"{provider} is not available in offline mode (LLM_OFFLINE is set), use the Mock provider")
+
+
+# Import and configure the Google AI SDK, once per process
+def init_google_ai():
+    if 'GoogleAI' in _INITIALISED_PROVIDERS:
+        return
+    
+    _check_online('GoogleAI')
+    with _INIT_LOCK:
+        if 'GoogleAI' not in _INITIALISED_PROVIDERS:
+            import google.generativeai as google_genai
+            
+            # Configure the API key
+            # google_genai.configure(api_key=os.getenv('GOOGLE_API_KEY'), transport="rest") ## Facing Issues with GRPC, hence `rest` is used
+            google_genai.configure(api_key=os.getenv('GOOGLE_API_KEY')) ## Issue solved - Issue was with WSL
+            _INITIALISED_PROVIDERS.add('GoogleAI')
+
+
+# Import the VertexAI SDK, resolve the default credentials and initialise it, once per process
+def init_vertexai():
+    if 'VertexAI' in _INITIALISED_PROVIDERS:
+        return
+    
+    _check_online('VertexAI')
+    with _INIT_LOCK:
+        if 'VertexAI' not in _INITIALISED_PROVIDERS:
+            import google.auth
+            import vertexai
+            
+            # Setup VertexAI
+            credentials, project_id = google.auth.default()
+            vertexai.init(project=os.getenv('GCP_PROJECT'), location=LOCATION, credentials=credentials)
+            _INITIALISED_PROVIDERS.add('VertexAI')
+
+# Process-wide registry of loaded models keyed by the model settings hash
+# Model handles (and their gRPC channels) are shared by all sessions and pages
+MODEL_REGISTRY = LRUCache(maxsize=int(os.getenv('MODEL_REGISTRY_SIZE', 16)))
+
+# Exact token counts returned by `count_tokens`
+TOKEN_COUNT_CACHE = LRUCache(maxsize=4096)
 
 
 # Setup Gemini Model
@@ -30,11 +89,13 @@ def setup_gemini_model(
     top_k:int=40,
     stop_sequence:Optional[List[str]]=None,
     is_vertexai_model:bool=False,
-) -> Union[google_genai.GenerativeModel, vertexai_genai.GenerativeModel]:
+) -> Union['google_genai.GenerativeModel', 'vertexai_genai.GenerativeModel']:
     
     if is_vertexai_model:
+        init_vertexai()
         from vertexai.generative_models import GenerativeModel, GenerationConfig, HarmCategory, HarmBlockThreshold
     else:
+        init_google_ai()
         from google.generativeai import GenerativeModel, GenerationConfig
         from google.generativeai.types import HarmCategory, HarmBlockThreshold
     
@@ -96,14 +157,17 @@ def setup_palm2_model(
     top_p:float=1,
     top_k:int=40,
     stop_sequences:Optional[List[str]]=None,
-) -> Tuple[vertexai_plam2.TextGenerationModel, dict]:
+) -> Tuple['vertexai_plam2.TextGenerationModel', dict]:
+    
+    init_vertexai()
+    from vertexai.language_models import TextGenerationModel
     
     if "@002" in model_name:
         max_output_tokens = min(max_output_tokens, 1024)
     top_k = min(top_k, 40)
     
     # Load the Model
-    palm2_model = vertexai_plam2.TextGenerationModel.from_pretrained(model_name)
+    palm2_model = TextGenerationModel.from_pretrained(model_name)
     
     # Set Parameters
     parameters = {
@@ -115,4 +179,434 @@ def setup_palm2_model(
     }
     
     return palm2_model, parameters
-    
\ No newline at end of file
+    
+
+# Calculate the hash of the model using the provider and model settings
+def calculate_model_hash(
+    provider:str,
+    model_name:str,
+    temperature:float=0,
+    max_output_tokens:int=1024,
+    top_p:float=1,
+    top_k:int=40,
+    stop_sequence:Optional[List[str]]=None,
+) -> str:
+    string_to_hash = f"{provider}-{model_name}-{temperature}-{max_output_tokens}-{top_p}-{top_k}-{stop_sequence}"
+    return sha256(string_to_hash.encode()).hexdigest()
+
+
+# Rough local token count, Gemini and PaLM average about 4 characters per token
+def estimate_token_count(text:str) -> int:
+    return math.ceil(len(text) / 4)
+
+
+# Exact token count from the model, memoized by (model name, text hash)
+def count_tokens(model:Any, model_name:str, text:str) -> int:
+    key = (model_name, sha256(text.encode()).hexdigest())
+    token_count = TOKEN_COUNT_CACHE.get(key)
+    if token_count is None:
+        token_count = model.count_tokens(text).total_tokens
+        TOKEN_COUNT_CACHE.set(key, token_count)
+    
+    return token_count
+
+
+# Check if a model with the given settings hash is already loaded
+def is_model_loaded(model_hash:str) -> bool:
+    return model_hash in MODEL_REGISTRY
+
+
+# Get the model for the given settings from the registry, loading it on first use
+# Returns the model and its predict parameters (PaLM2 only, None for Gemini)
+def get_model(
+    provider:str,
+    model_name:str,
+    temperature:float=0,
+    max_output_tokens:int=1024,
+    top_p:float=1,
+    top_k:int=40,
+    stop_sequence:Optional[List[str]]=None,
+) -> Tuple[Any, Optional[dict]]:
+    
+    model_hash = calculate_model_hash(provider, model_name, temperature, max_output_tokens, top_p, top_k, stop_sequence)
+    model = MODEL_REGISTRY.get(model_hash)
+    if model is not None:
+        return model
+    
+    if provider == 'Mock':
+        model = MockModel(model_name, max_output_tokens=max_output_tokens), None
+    elif provider == 'GoogleAI' or 'gemini' in model_name:
+        model = setup_gemini_model(
+            model_name=model_name,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            top_p=top_p,
+            top_k=top_k,
+            stop_sequence=stop_sequence,
+            is_vertexai_model=provider == 'VertexAI',
+        ), None
+    else:
+        model = setup_palm2_model(
+            model_name=model_name,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            top_p=top_p,
+            top_k=top_k,
+            stop_sequences=stop_sequence,
+        )
+    
+    MODEL_REGISTRY.set(model_hash, model)
+    return model
+
+
+# Token counts from the response's usage metadata, estimated locally when the SDK does not report them
+# Avoids the extra count_tokens round trips per run
+def _google_usage(response:Any, input_text:str, text:str) -> Tuple[int, int]:
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    
+    input_token_count = getattr(usage_metadata, 'prompt_token_count', None)
+    output_token_count = getattr(usage_metadata, 'candidates_token_count', None)
+    
+    return (
+        input_token_count if input_token_count else estimate_token_count(input_text),
+        output_token_count if output_token_count else estimate_token_count(text),
+    )
+
+
+# Request and token rate limits per provider, `<NAME>_REQUESTS_PER_MINUTE`, `<NAME>_TOKENS_PER_MINUTE` and
+# `<NAME>_MAX_CONCURRENCY` environment variables override them (0 disables a limit)
+PROVIDER_LIMITS = {
+    'GoogleAIGemini': {'requests_per_minute': 60, 'tokens_per_minute': 32000, 'max_concurrency': 8},
+    'VertexAIGemini': {'requests_per_minute': 300, 'tokens_per_minute': 300000, 'max_concurrency': 16},
+    'VertexAIPaLM': {'requests_per_minute': 60, 'tokens_per_minute': 0, 'max_concurrency': 8},
+    'Mock': {'requests_per_minute': 0, 'tokens_per_minute': 0, 'max_concurrency': 64},
+}
+
+
+# A model backend with its own concurrency and rate limits
+# Subclasses implement `_generate` (async, one request) and `stream` (sync, text chunks)
+class LLMProvider(ABC):
+    
+    name:str = None
+    
+    def __init__(self, requests_per_minute:float, tokens_per_minute:float, max_concurrency:int):
+        self.request_limiter = TokenBucket(requests_per_minute)
+        self.token_limiter = TokenBucket(tokens_per_minute)
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    
+    # Create the provider with its limits from `PROVIDER_LIMITS` and the environment
+    @classmethod
+    def from_env(cls) -> 'LLMProvider':
+        limits = {
+            key: type(value)(os.getenv(f"{cls.name.upper()}_{key.upper()}", value))
+            for key, value in PROVIDER_LIMITS[cls.name].items()
+        }
+        return cls(**limits)
+    
+    # Wait for a request slot and the prompt's (estimated) tokens
+    async def acquire(self, input_text:str):
+        await self.request_limiter.acquire(1)
+        await self.token_limiter.acquire(estimate_token_count(input_text))
+    
+    # Generate the output within the concurrency and rate limits
+    # Transient errors are retried with backoff behind the model's circuit breaker (see `utils.retry_helper`)
+    async def generate(self, model:Any, parameters:Optional[dict], input_text:str, model_name:str) -> dict:
+        
+        # The slot is released between attempts, so backing off does not block other requests
+        async def attempt() -> dict:
+            async with self.semaphore:
+                await self.acquire(input_text)
+                return await self._generate(model, parameters, input_text)
+        
+        response = await call_with_retry(attempt, f"{self.name}/{model_name}")
+        
+        # Output tokens are only known afterwards, they are charged to the following requests
+        self.token_limiter.consume(response['output_token_count'] or estimate_token_count(response['text']))
+        return response
+    
+    # Take a concurrency slot and wait for the rate limits, for calls made outside `generate` such as streams
+    # The slot must be given back with `release_slot`
+    async def acquire_slot(self, input_text:str):
+        await self.semaphore.acquire()
+        try:
+            await self.acquire(input_text)
+        except BaseException:
+            self.semaphore.release()
+            raise
+    
+    # Give back a slot taken with `acquire_slot`, from any thread
+    def release_slot(self):
+        get_event_loop().call_soon_threadsafe(self.semaphore.release)
+    
+    @abstractmethod
+    async def _generate(self, model:Any, parameters:Optional[dict], input_text:str) -> dict:
+        ...
+    
+    @abstractmethod
+    def stream(self, model:Any, parameters:Optional[dict], input_text:str, usage:dict) -> Iterator[str]:
+        ...
+
+
+# Gemini through the Google AI (API key) SDK
+class GoogleAIGeminiProvider(LLMProvider):
+    
+    name = 'GoogleAIGemini'
+    
+    async def _generate(self, model:Any, parameters:Optional[dict], input_text:str) -> dict:
+        response = await model.generate_content_async(input_text)
+        input_token_count, output_token_count = _google_usage(response, input_text, response.text)
+        
+        return {
+            "text": response.text,
+            "input_token_count": input_token_count,
+            "output_token_count": output_token_count
+        }
+    
+    def stream(self, model:Any, parameters:Optional[dict], input_text:str, usage:dict) -> Iterator[str]:
+        response = model.generate_content(input_text, stream=True)
+        chunks = []
+        for chunk in response:
+            chunks.append(chunk.text)
+            yield chunk.text
+        usage['input_token_count'], usage['output_token_count'] = _google_usage(response, input_text, ''.join(chunks))
+
+
+# Gemini through VertexAI
+class VertexAIGeminiProvider(LLMProvider):
+    
+    name = 'VertexAIGemini'
+    
+    async def _generate(self, model:Any, parameters:Optional[dict], input_text:str) -> dict:
+        response = await model.generate_content_async(input_text)
+        usage_metadata = response.to_dict()['usage_metadata']
+        
+        return {
+            "text": response.text,
+            "input_token_count": usage_metadata['prompt_token_count'],
+            "output_token_count": usage_metadata['candidates_token_count']
+        }
+    
+    def stream(self, model:Any, parameters:Optional[dict], input_text:str, usage:dict) -> Iterator[str]:
+        usage_metadata = {}
+        for chunk in model.generate_content(input_text, stream=True):
+            usage_metadata = chunk.to_dict().get('usage_metadata') or usage_metadata
+            yield chunk.text
+        usage['input_token_count'] = usage_metadata.get('prompt_token_count')
+        usage['output_token_count'] = usage_metadata.get('candidates_token_count')
+
+
+# PaLM2 text models through VertexAI
+class VertexAIPaLMProvider(LLMProvider):
+    
+    name = 'VertexAIPaLM'
+    
+    # PaLM responses carry no usage counts, the tokens are estimated so the calls can still be priced
+    async def _generate(self, model:Any, parameters:Optional[dict], input_text:str) -> dict:
+        response = await model.predict_async(input_text, **parameters)
+        
+        return {
+            "text": response.text,
+            "input_token_count": estimate_token_count(input_text),
+            "output_token_count": estimate_token_count(response.text)
+        }
+    
+    def stream(self, model:Any, parameters:Optional[dict], input_text:str, usage:dict) -> Iterator[str]:
+        chunks = []
+        for chunk in model.predict_streaming(input_text, **parameters):
+            chunks.append(chunk.text)
+            yield chunk.text
+        
+        usage['input_token_count'] = estimate_token_count(input_text)
+        usage['output_token_count'] = estimate_token_count(''.join(chunks))
+
+
+# Offline stand-in, see `utils.mock_llm_helper`
+class MockProvider(LLMProvider):
+    
+    name = 'Mock'
+    
+    async def _generate(self, model:Any, parameters:Optional[dict], input_text:str) -> dict:
+        response = await model.generate_content_async(input_text)
+        
+        return {
+            "text": response.text,
+            "input_token_count": response.usage_metadata.prompt_token_count,
+            "output_token_count": response.usage_metadata.candidates_token_count
+        }
+    
+    def stream(self, model:Any, parameters:Optional[dict], input_text:str, usage:dict) -> Iterator[str]:
+        for chunk in model.generate_content(input_text, stream=True):
+            if chunk.usage_metadata is not None:
+                usage['input_token_count'] = chunk.usage_metadata.prompt_token_count
+                usage['output_token_count'] = chunk.usage_metadata.candidates_token_count
+            yield chunk.text
+
+
+# One instance per provider class, so the limits are shared by every session of the process
+_PROVIDERS = {}
+_PROVIDERS_LOCK = threading.Lock()
+
+
+# Get the provider serving the model
+def get_provider(provider:str, model_name:str) -> LLMProvider:
+    if provider == 'Mock':
+        provider_class = MockProvider
+    elif provider == 'GoogleAI':
+        provider_class = GoogleAIGeminiProvider
+    elif 'gemini' in model_name:
+        provider_class = VertexAIGeminiProvider
+    else:
+        provider_class = VertexAIPaLMProvider
+    
+    with _PROVIDERS_LOCK:
+        if provider_class.name not in _PROVIDERS:
+            _PROVIDERS[provider_class.name] = provider_class.from_env()
+        return _PROVIDERS[provider_class.name]
+
+
+# Shared event loop running in a background thread, Streamlit script threads hand coroutines to it
+_EVENT_LOOP = None
+_EVENT_LOOP_LOCK = threading.Lock()
+
+
+# Get the shared event loop, starting it on first use
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _EVENT_LOOP
+    
+    with _EVENT_LOOP_LOCK:
+        if _EVENT_LOOP is None:
+            _EVENT_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_EVENT_LOOP.run_forever, name='llm-event-loop', daemon=True).start()
+        return _EVENT_LOOP
+
+
+# Schedule a coroutine on the shared event loop
+def submit(coroutine:Coroutine) -> Future:
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+
+
+# Run a coroutine on the shared event loop and wait for its result
+def run_sync(coroutine:Coroutine) -> Any:
+    return submit(coroutine).result()
+
+
+# Generate the output for the input text with the given model settings
+# Deterministic calls (see `RESPONSE_CACHE_MAX_TEMPERATURE`) are answered from the response cache when possible
+async def agenerate(
+    input_text:str,
+    provider:str,
+    model_name:str,
+    temperature:float=0,
+    max_output_tokens:int=1024,
+    top_p:float=1,
+    top_k:int=40,
+    stop_sequence:Optional[List[str]]=None,
+) -> dict:
+    
+    model_settings = {
+        'provider': provider,
+        'model_name': model_name,
+        'temperature': temperature,
+        'max_output_tokens': max_output_tokens,
+        'top_p': top_p,
+        'top_k': top_k,
+        'stop_sequence': stop_sequence,
+    }
+    model_hash = calculate_model_hash(**model_settings)
+    
+    # The cache and the model setup are blocking, keep them off the event loop
+    cacheable = is_cacheable(temperature)
+    if cacheable:
+        response = await asyncio.to_thread(get_cached_response, model_hash, input_text)
+        if response is not None:
+            return {**response, 'cached': True}
+    
+    model, parameters = await asyncio.to_thread(get_model, **model_settings)
+    response = await get_provider(provider, model_name).generate(model, parameters, input_text, model_name)
+    
+    if cacheable:
+        await asyncio.to_thread(set_cached_response, model_hash, input_text, provider, model_name, **response)
+    
+    return {**response, 'cached': False}
+
+
+# Blocking version of `agenerate`, runs on the shared event loop
+def generate(input_text:str, **model_settings) -> dict:
+    return run_sync(agenerate(input_text, **model_settings))
+
+
+# Stream the output for the input text with the given model settings
+# Yields text chunks as they arrive; once exhausted `stats` holds the same keys as `generate` plus
+# `time_to_first_token` and `total_time` in seconds and `tokens_per_second`
+def generate_stream(
+    input_text:str,
+    provider:str,
+    model_name:str,
+    temperature:float=0,
+    max_output_tokens:int=1024,
+    top_p:float=1,
+    top_k:int=40,
+    stop_sequence:Optional[List[str]]=None,
+    stats:Optional[dict]=None,
+) -> Iterator[str]:
+    
+    stats = {} if stats is None else stats
+    model_settings = {
+        'provider': provider,
+        'model_name': model_name,
+        'temperature': temperature,
+        'max_output_tokens': max_output_tokens,
+        'top_p': top_p,
+        'top_k': top_k,
+        'stop_sequence': stop_sequence,
+    }
+    model_hash = calculate_model_hash(**model_settings)
+    start_time = time.perf_counter()
+    
+    cacheable = is_cacheable(temperature)
+    response = get_cached_response(model_hash, input_text) if cacheable else None
+    if response is not None:
+        # Nothing was generated, the latency stats would only measure the cache lookup
+        stats.update(response, cached=True, time_to_first_token=None)
+        yield response['text']
+    else:
+        model, parameters = get_model(**model_settings)
+        llm_provider = get_provider(provider, model_name)
+        usage = {'input_token_count': None, 'output_token_count': None}
+        
+        # Retry until the first chunk arrives, a stream failing halfway is not retried as part of it was already shown
+        # The provider's concurrency slot is held for the whole stream, and given back between attempts
+        def start_stream() -> Tuple[Iterator[str], Optional[str]]:
+            run_sync(llm_provider.acquire_slot(input_text))
+            try:
+                stream = llm_provider.stream(model, parameters, input_text, usage)
+                return stream, next(stream, None)
+            except BaseException:
+                llm_provider.release_slot()
+                raise
+        
+        stream, first_chunk = call_with_retry_sync(start_stream, f"{llm_provider.name}/{model_name}")
+        stats['time_to_first_token'] = time.perf_counter() - start_time
+        
+        chunks = []
+        try:
+            for chunk in itertools.chain([first_chunk] if first_chunk is not None else [], stream):
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            llm_provider.release_slot()
+        
+        response = {'text': ''.join(chunks), **usage}
+        get_event_loop().call_soon_threadsafe(llm_provider.token_limiter.consume, response['output_token_count'] or estimate_token_count(response['text']))
+        stats.update(response, cached=False)
+        
+        if cacheable:
+            set_cached_response(model_hash, input_text, provider, model_name, **response)
+    
+    # Throughput over the streaming part, after the first token arrived
+    stats['total_time'] = time.perf_counter() - start_time
+    generation_time = stats['total_time'] - (stats['time_to_first_token'] or 0)
+    if stats['output_token_count'] and generation_time > 0 and not stats['cached']:
+        stats['tokens_per_second'] = stats['output_token_count'] / generation_time
+    else:
+        stats['tokens_per_second'] = None
@@ -0,0 +1,127 @@
+import os
+import math
+import time
+import random
+import asyncio
+from hashlib import sha256
+from typing import Iterator, List, Optional
+
+# Offline stand-in for the Gemini and PaLM2 models, for benchmarking and load testing without network or credentials
+# The defaults come from `MOCK_LLM_*` environment variables, the profiles below override them per model name
+MOCK_LLM_DEFAULTS = {
+    'latency': float(os.getenv('MOCK_LLM_LATENCY', 0.5)),                   # median time to first token, seconds
+    'latency_sigma': float(os.getenv('MOCK_LLM_LATENCY_SIGMA', 0.5)),       # spread of the log-normal latency
+    'error_rate': float(os.getenv('MOCK_LLM_ERROR_RATE', 0)),               # share of calls failing with a 503
+    'output_tokens': int(os.getenv('MOCK_LLM_OUTPUT_TOKENS', 200)),         # mean output length
+    'tokens_per_second': float(os.getenv('MOCK_LLM_TOKENS_PER_SECOND', 100)),
+}
+
+MOCK_LLM_PROFILES = {
+    'mock-fast': {'latency': 0.05, 'latency_sigma': 0.2, 'tokens_per_second': 1000},
+    'mock-slow': {'latency': 2, 'latency_sigma': 0.5, 'tokens_per_second': 30},
+    'mock-flaky': {'error_rate': 0.2},
+}
+
+# Words the mock outputs are made of
+_VOCABULARY = (
+    "the model prompt response token output input template version project test example value result "
+    "quick brown fox jumps over lazy dog and then returns with a short summary of everything"
+).split()
+
+
+# Raised for simulated failures, named like the google.api_core error so it is retried as a transient one
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class MockUsageMetadata:
+    def __init__(self, prompt_token_count:int, candidates_token_count:int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class MockResponse:
+    def __init__(self, text:str, prompt_token_count:Optional[int] = None, candidates_token_count:Optional[int] = None):
+        self.text = text
+        self.usage_metadata = MockUsageMetadata(prompt_token_count, candidates_token_count) if prompt_token_count is not None else None
+
+    def to_dict(self) -> dict:
+        if self.usage_metadata is None:
+            return {'text': self.text}
+        return {'text': self.text, 'usage_metadata': vars(self.usage_metadata)}
+
+
+class MockTokenCount:
+    def __init__(self, total_tokens:int):
+        self.total_tokens = total_tokens
+
+
+# Mimics `generate_content` (Gemini), `predict` (PaLM2) and `count_tokens`, sync, async and streaming
+# Outputs are deterministic per prompt, latency and errors are random
+class MockModel:
+
+    def __init__(self, model_name:str, max_output_tokens:int = 1024, **settings):
+        self.model_name = model_name
+        self.max_output_tokens = max_output_tokens
+        self.settings = {**MOCK_LLM_DEFAULTS, **MOCK_LLM_PROFILES.get(model_name, {}), **settings}
+
+    def count_tokens(self, text:str) -> MockTokenCount:
+        return MockTokenCount(math.ceil(len(text) / 4))
+
+    # Output words for a prompt, seeded by the prompt so repeated calls agree
+    def _output_words(self, text:str) -> List[str]:
+        rng = random.Random(sha256(f"{self.model_name}\x00{text}".encode()).hexdigest())
+        output_tokens = max(1, min(self.max_output_tokens, int(rng.expovariate(1 / self.settings['output_tokens'])) + 1))
+        return [rng.choice(_VOCABULARY) for _ in range(output_tokens)]
+
+    # Sample the time to first token, or fail like an overloaded backend
+    def _first_token_delay(self) -> float:
+        if random.random() < self.settings['error_rate']:
+            raise ServiceUnavailable(f"{self.model_name} is temporarily unavailable (mock)")
+        return random.lognormvariate(math.log(max(self.settings['latency'], 1e-6)), self.settings['latency_sigma'])
+
+    def _token_delay(self, token_count:int) -> float:
+        return token_count / self.settings['tokens_per_second'] if self.settings['tokens_per_second'] > 0 else 0
+
+    def _response(self, text:str, words:List[str]) -> MockResponse:
+        return MockResponse(' '.join(words), self.count_tokens(text).total_tokens, len(words))
+
+    def _stream(self, text:str) -> Iterator[MockResponse]:
+        time.sleep(self._first_token_delay())
+        words = self._output_words(text)
+
+        # Chunks of about 8 tokens, the last one carries the usage like the real SDKs
+        for start in range(0, len(words), 8):
+            chunk = words[start:start + 8]
+            time.sleep(self._token_delay(len(chunk)))
+            last = start + 8 >= len(words)
+            yield MockResponse(
+                ' '.join(chunk) + ('' if last else ' '),
+                self.count_tokens(text).total_tokens if last else None,
+                len(words) if last else None,
+            )
+
+    def generate_content(self, text:str, stream:bool = False):
+        if stream:
+            return self._stream(text)
+
+        time.sleep(self._first_token_delay())
+        words = self._output_words(text)
+        time.sleep(self._token_delay(len(words)))
+        return self._response(text, words)
+
+    async def generate_content_async(self, text:str) -> MockResponse:
+        await asyncio.sleep(self._first_token_delay())
+        words = self._output_words(text)
+        await asyncio.sleep(self._token_delay(len(words)))
+        return self._response(text, words)
+
+    def predict(self, text:str, **parameters) -> MockResponse:
+        return self.generate_content(text)
+
+    async def predict_async(self, text:str, **parameters) -> MockResponse:
+        return await self.generate_content_async(text)
+
+    def predict_streaming(self, text:str, **parameters) -> Iterator[MockResponse]:
+        return self._stream(text)
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+
+# Async token bucket refilled continuously at `rate_per_minute`, with a burst of up to one minute's worth
+# A rate of 0 (or less) disables the limit
+class TokenBucket:
+
+    def __init__(self, rate_per_minute:float):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_minute / 60)
+        self.updated_at = now
+
+    # Wait until `amount` tokens are available and take them
+    # Requests larger than the bucket only wait for a full bucket, otherwise they would never run
+    async def acquire(self, amount:float = 1):
+        if self.rate_per_minute <= 0:
+            return
+
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) * 60 / self.rate_per_minute)
+
+    # Take tokens without waiting, e.g. for usage only known after the call; the balance may go negative
+    def consume(self, amount:float):
+        if self.rate_per_minute <= 0:
+            return
+
+        self._refill()
+        self.tokens -= amount
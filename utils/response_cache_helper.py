@@ -0,0 +1,118 @@
+import os
+import time
+from hashlib import sha256
+from typing import Optional
+
+from utils.db_helper import get_connection, synchronized
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Responses older than this many seconds are treated as missing (default 7 days)
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 7 * 24 * 60 * 60))
+
+# Least recently used responses are evicted beyond this count or this total response size in bytes (default 64MB)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 5000))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Only calls at or below this temperature are cached, sampled outputs are expected to differ between runs
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv('RESPONSE_CACHE_MAX_TEMPERATURE', 0))
+
+# Process-wide counters
+RESPONSE_CACHE_STATS = {'hits': 0, 'misses': 0, 'skipped': 0}
+
+
+# Key of a response, the model hash covers the provider, model and full generation config
+def response_cache_key(model_hash:str, prompt:str) -> str:
+    return sha256(f"{model_hash}\x00{prompt}".encode()).hexdigest()
+
+
+# Check if a call with these settings can be served from the cache
+def is_cacheable(temperature:float) -> bool:
+    if RESPONSE_CACHE_MAX_ENTRIES <= 0 or temperature > RESPONSE_CACHE_MAX_TEMPERATURE:
+        RESPONSE_CACHE_STATS['skipped'] += 1
+        return False
+    return True
+
+
+# Get a cached response as a dict of text and token counts, None on a miss or an expired entry
+@synchronized
+def get_cached_response(model_hash:str, prompt:str) -> Optional[dict]:
+    connection = get_connection()
+    key = response_cache_key(model_hash, prompt)
+    now = time.time()
+
+    row = connection.execute(
+        "SELECT response, input_token_count, output_token_count FROM llm_responses WHERE key = ? AND created_at >= ?",
+        (key, now - RESPONSE_CACHE_TTL)
+    ).fetchone()
+    if row is None:
+        RESPONSE_CACHE_STATS['misses'] += 1
+        return None
+
+    connection.execute("UPDATE llm_responses SET hit_count = hit_count + 1, last_used_at = ? WHERE key = ?", (now, key))
+    connection.commit()
+    RESPONSE_CACHE_STATS['hits'] += 1
+
+    text, input_token_count, output_token_count = row
+    return {
+        "text": text,
+        "input_token_count": input_token_count,
+        "output_token_count": output_token_count
+    }
+
+
+# Store a response, then drop expired entries and the least recently used ones over the count or size limit
+@synchronized
+def set_cached_response(
+    model_hash:str,
+    prompt:str,
+    provider:str,
+    model_name:str,
+    text:str,
+    input_token_count:Optional[int] = None,
+    output_token_count:Optional[int] = None):
+
+    connection = get_connection()
+    now = time.time()
+    try:
+        connection.execute(
+            """
+            INSERT INTO llm_responses (key, provider, model_name, response, input_token_count, output_token_count, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET provider = excluded.provider, model_name = excluded.model_name, response = excluded.response,
+                input_token_count = excluded.input_token_count, output_token_count = excluded.output_token_count, created_at = excluded.created_at, last_used_at = excluded.last_used_at
+            """,
+            (response_cache_key(model_hash, prompt), provider, model_name, text, input_token_count, output_token_count, now, now)
+        )
+        connection.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - RESPONSE_CACHE_TTL,))
+
+        # The totals are kept by triggers, the table is only walked (oldest first) when a limit is exceeded
+        entries, size = connection.execute("SELECT entries, bytes FROM llm_response_totals").fetchone()
+        if entries > RESPONSE_CACHE_MAX_ENTRIES or size > RESPONSE_CACHE_MAX_BYTES:
+            evicted = []
+            for key, length in connection.execute("SELECT key, LENGTH(CAST(response AS BLOB)) FROM llm_responses ORDER BY last_used_at"):
+                if entries <= RESPONSE_CACHE_MAX_ENTRIES and size <= RESPONSE_CACHE_MAX_BYTES:
+                    break
+                evicted.append((key,))
+                entries -= 1
+                size -= length
+            connection.executemany("DELETE FROM llm_responses WHERE key = ?", evicted)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+# Get the hit/miss counters of this process and the number and total size of stored responses
+@synchronized
+def get_response_cache_stats() -> dict:
+    entries, size = get_connection().execute("SELECT entries, bytes FROM llm_response_totals").fetchone()
+    return {**RESPONSE_CACHE_STATS, 'entries': entries, 'bytes': size}
+
+
+# Drop every cached response
+@synchronized
+def clear_response_cache():
+    connection = get_connection()
+    connection.execute("DELETE FROM llm_responses")
+    connection.commit()
@@ -0,0 +1,214 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional
+
+# HTTP status codes worth retrying: timeouts, quota (429) and transient server errors
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Exception class names of the Google SDKs (google.api_core) for the same conditions, matched by name
+# so this module does not need the SDKs
+TRANSIENT_ERROR_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+    'DeadlineExceeded', 'GatewayTimeout', 'BadGateway', 'Aborted',
+}
+
+# Process-wide retry metrics, keyed by (metric, model key)
+RETRY_STATS = Counter()
+_STATS_LOCK = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, key:str, retry_in:float):
+        self.key = key
+        self.retry_in = retry_in
+        super().__init__(f"{key} is failing, calls are paused for {retry_in:.0f}s")
+
+
+# Backoff settings, `RETRY_MAX_ATTEMPTS`, `RETRY_BASE_DELAY` and `RETRY_MAX_DELAY` environment variables override the defaults
+# A `max_attempts` of 1 (or less) disables retries
+class RetryPolicy:
+
+    def __init__(self, max_attempts:int = 5, base_delay:float = 1, max_delay:float = 60):
+        # At least one attempt, otherwise the call would never be made
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_env(cls) -> 'RetryPolicy':
+        return cls(
+            max_attempts=int(os.getenv('RETRY_MAX_ATTEMPTS', 5)),
+            base_delay=float(os.getenv('RETRY_BASE_DELAY', 1)),
+            max_delay=float(os.getenv('RETRY_MAX_DELAY', 60)),
+        )
+
+    # Exponential backoff with full jitter, never shorter than the server's retry-after hint
+    def get_delay(self, attempt:int, retry_after:Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+# Fails fast after `failure_threshold` consecutive transient failures, lets one trial call through
+# after `reset_timeout` seconds (half open) and closes again on its success
+class CircuitBreaker:
+
+    def __init__(self, key:str, failure_threshold:int = 5, reset_timeout:float = 30):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    # Raise `CircuitOpenError` if calls are currently paused
+    def before_call(self):
+        with self._lock:
+            if self.state == 'open':
+                raise CircuitOpenError(self.key, self.reset_timeout - (time.monotonic() - self.opened_at))
+            if self.state == 'half_open':
+                # Only one trial call, the others keep failing fast until it succeeds
+                self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_CIRCUIT_BREAKERS = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+# Get the circuit breaker of a model, creating it on first use
+def get_circuit_breaker(key:str) -> CircuitBreaker:
+    with _CIRCUIT_BREAKERS_LOCK:
+        if key not in _CIRCUIT_BREAKERS:
+            _CIRCUIT_BREAKERS[key] = CircuitBreaker(
+                key,
+                failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)),
+                reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30)),
+            )
+        return _CIRCUIT_BREAKERS[key]
+
+
+# Check if an error is transient (quota, overload, timeout) and the call should be retried
+def is_transient_error(error:Exception) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and code in TRANSIENT_STATUS_CODES:
+        return True
+
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+
+# Seconds to wait suggested by the server, from a Retry-After header or a RetryInfo error detail
+def get_retry_after(error:Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after') is not None:
+            return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        pass
+
+    for detail in getattr(error, 'details', None) or []:
+        retry_delay = getattr(detail, 'retry_delay', None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+
+    return None
+
+
+def _record(metric:str, key:str):
+    with _STATS_LOCK:
+        RETRY_STATS[(metric, key)] += 1
+
+
+# Get the retry metrics as {model key: {metric: count}}
+def get_retry_stats() -> dict:
+    stats = {}
+    with _STATS_LOCK:
+        for (metric, key), count in RETRY_STATS.items():
+            stats.setdefault(key, {})[metric] = count
+    return stats
+
+
+# Outcome of a failed attempt: record it and return the delay before the next attempt, or re-raise
+def _handle_failure(error:Exception, key:str, attempt:int, policy:RetryPolicy, breaker:CircuitBreaker) -> float:
+    if not is_transient_error(error):
+        _record('errors', key)
+        raise error
+
+    breaker.record_failure()
+    if attempt + 1 >= policy.max_attempts:
+        _record('exhausted', key)
+        raise error
+
+    _record('retries', key)
+    return policy.get_delay(attempt, get_retry_after(error))
+
+
+# Await `func()` with retries on transient errors behind the model's circuit breaker
+async def call_with_retry(func:Callable[[], Awaitable[Any]], key:str, policy:Optional[RetryPolicy] = None) -> Any:
+    policy = policy or RetryPolicy.from_env()
+    breaker = get_circuit_breaker(key)
+
+    for attempt in range(policy.max_attempts):
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            _record('rejected', key)
+            raise
+
+        _record('attempts', key)
+        try:
+            result = await func()
+        except Exception as e:
+            await asyncio.sleep(_handle_failure(e, key, attempt, policy, breaker))
+        else:
+            breaker.record_success()
+            return result
+
+
+# Blocking version of `call_with_retry`
+def call_with_retry_sync(func:Callable[[], Any], key:str, policy:Optional[RetryPolicy] = None) -> Any:
+    policy = policy or RetryPolicy.from_env()
+    breaker = get_circuit_breaker(key)
+
+    for attempt in range(policy.max_attempts):
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            _record('rejected', key)
+            raise
+
+        _record('attempts', key)
+        try:
+            result = func()
+        except Exception as e:
+            time.sleep(_handle_failure(e, key, attempt, policy, breaker))
+        else:
+            breaker.record_success()
+            return result
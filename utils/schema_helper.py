@@ -0,0 +1,508 @@
+import sqlite3
+from typing import Callable, List, Tuple, Union
+
+from utils.hash_helper import template_hash
+from utils.delta_helper import TEMPLATE_CACHE, load_template
+
+# A migration step is either a SQL statement or a callable taking the connection
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+# Make template_hash available to SQL statements of the migrations
+def _register_template_hash(connection:sqlite3.Connection):
+    connection.create_function('template_hash', 1, template_hash, deterministic=True)
+
+
+# SQL functions the search index triggers and views need, registered on every connection before migrating
+# template_text(hash) is the text of a stored template, encoded ones are reconstructed
+def register_functions(connection:sqlite3.Connection):
+    _register_template_hash(connection)
+    connection.create_function(
+        'template_text', 1,
+        lambda prompt_template_hash: load_template(connection.cursor(), prompt_template_hash, TEMPLATE_CACHE) if prompt_template_hash is not None else None
+    )
+
+
+# Version 1 - Base tables
+CREATE_TABLES: List[MigrationStep] = [
+    """
+    CREATE TABLE IF NOT EXISTS projects (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prompts (
+        id TEXT PRIMARY KEY,
+        prompt_group_id TEXT NOT NULL,
+        project_id TEXT NOT NULL,
+        description TEXT,
+        parent_prompt_id TEXT,
+        name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        prompt_template TEXT NOT NULL,
+        input_variables TEXT,
+        favourite INTEGER NOT NULL,
+        notes TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY (project_id) REFERENCES projects (id)
+    )
+    """,
+]
+
+# Version 2 - Secondary indexes for the lookups done in sql_helper
+CREATE_INDEXES: List[MigrationStep] = [
+    "CREATE INDEX IF NOT EXISTS idx_projects_name_nocase ON projects (name COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_project_id ON prompts (project_id)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_group_version ON prompts (prompt_group_id, version)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_name_nocase ON prompts (name COLLATE NOCASE)",
+]
+
+# Version 3 - Indexes backing the keyset pagination on (name, id)
+CREATE_PAGINATION_INDEXES: List[MigrationStep] = [
+    "CREATE INDEX IF NOT EXISTS idx_projects_name_id ON projects (name, id)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_project_name_id ON prompts (project_id, name, id)",
+]
+
+# Version 4 - Covering index for the latest version per prompt group query
+CREATE_LATEST_VERSION_INDEX: List[MigrationStep] = [
+    "CREATE INDEX IF NOT EXISTS idx_prompts_project_group_version ON prompts (project_id, prompt_group_id, version)",
+]
+
+# Version 5 - Full-text search over prompts, kept in sync by triggers
+# The FTS rowid is the rowid of the prompt it indexes
+CREATE_PROMPTS_FTS: List[MigrationStep] = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5 (
+        name,
+        description,
+        notes,
+        prompt_template,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_insert AFTER INSERT ON prompts BEGIN
+        INSERT INTO prompts_fts (rowid, name, description, notes, prompt_template)
+        VALUES (NEW.rowid, NEW.name, NEW.description, NEW.notes, NEW.prompt_template);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_update AFTER UPDATE OF name, description, notes, prompt_template ON prompts BEGIN
+        UPDATE prompts_fts
+        SET name = NEW.name, description = NEW.description, notes = NEW.notes, prompt_template = NEW.prompt_template
+        WHERE rowid = OLD.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_delete AFTER DELETE ON prompts BEGIN
+        DELETE FROM prompts_fts WHERE rowid = OLD.rowid;
+    END
+    """,
+    "DELETE FROM prompts_fts",
+    "INSERT INTO prompts_fts (rowid, name, description, notes, prompt_template) SELECT rowid, name, description, notes, prompt_template FROM prompts",
+]
+
+# Version 6 - Content-addressed template storage
+# Templates move to prompt_templates keyed by their SHA-256, prompts reference the hash.
+# ref_count is maintained by triggers so a template is deleted with its last prompt.
+CREATE_TEMPLATE_STORE: List[MigrationStep] = [
+    _register_template_hash,
+    """
+    CREATE TABLE IF NOT EXISTS prompt_templates (
+        hash TEXT PRIMARY KEY,
+        template TEXT NOT NULL,
+        ref_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    INSERT OR IGNORE INTO prompt_templates (hash, template, ref_count)
+    SELECT template_hash(prompt_template), prompt_template, COUNT(*)
+    FROM prompts
+    GROUP BY template_hash(prompt_template)
+    """,
+    """
+    CREATE TABLE prompts_new (
+        id TEXT PRIMARY KEY,
+        prompt_group_id TEXT NOT NULL,
+        project_id TEXT NOT NULL,
+        description TEXT,
+        parent_prompt_id TEXT,
+        name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        template_hash TEXT NOT NULL,
+        input_variables TEXT,
+        favourite INTEGER NOT NULL,
+        notes TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY (project_id) REFERENCES projects (id),
+        FOREIGN KEY (template_hash) REFERENCES prompt_templates (hash)
+    )
+    """,
+    """
+    INSERT INTO prompts_new (rowid, id, prompt_group_id, project_id, description, parent_prompt_id, name, version, template_hash, input_variables, favourite, notes, created_at, updated_at)
+    SELECT rowid, id, prompt_group_id, project_id, description, parent_prompt_id, name, version, template_hash(prompt_template), input_variables, favourite, notes, created_at, updated_at
+    FROM prompts
+    """,
+    "DROP TABLE prompts",
+    "ALTER TABLE prompts_new RENAME TO prompts",
+    # Indexes and triggers were dropped together with the old table
+    "CREATE INDEX IF NOT EXISTS idx_prompts_project_id ON prompts (project_id)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_group_version ON prompts (prompt_group_id, version)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_name_nocase ON prompts (name COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_project_name_id ON prompts (project_id, name, id)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_project_group_version ON prompts (project_id, prompt_group_id, version)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_template_hash ON prompts (template_hash)",
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_insert AFTER INSERT ON prompts BEGIN
+        INSERT INTO prompts_fts (rowid, name, description, notes, prompt_template)
+        VALUES (NEW.rowid, NEW.name, NEW.description, NEW.notes, (SELECT template FROM prompt_templates WHERE hash = NEW.template_hash));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_update AFTER UPDATE OF name, description, notes, template_hash ON prompts BEGIN
+        UPDATE prompts_fts
+        SET name = NEW.name, description = NEW.description, notes = NEW.notes,
+            prompt_template = (SELECT template FROM prompt_templates WHERE hash = NEW.template_hash)
+        WHERE rowid = OLD.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_delete AFTER DELETE ON prompts BEGIN
+        DELETE FROM prompts_fts WHERE rowid = OLD.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_ref_insert AFTER INSERT ON prompts BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count + 1 WHERE hash = NEW.template_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_ref_update AFTER UPDATE OF template_hash ON prompts
+    WHEN NEW.template_hash != OLD.template_hash BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count + 1 WHERE hash = NEW.template_hash;
+        UPDATE prompt_templates SET ref_count = ref_count - 1 WHERE hash = OLD.template_hash;
+        DELETE FROM prompt_templates WHERE hash = OLD.template_hash AND ref_count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_ref_delete AFTER DELETE ON prompts BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count - 1 WHERE hash = OLD.template_hash;
+        DELETE FROM prompt_templates WHERE hash = OLD.template_hash AND ref_count <= 0;
+    END
+    """,
+]
+
+# Version 7 - Optional compressed / delta encoded template storage
+# encoding is 'text' (plain `template`), 'zlib' (compressed snapshot in `data`) or
+# 'delta' (compressed delta against `base_hash` in `data`). ref_count also counts deltas using a row as base.
+# The table is rebuilt because `template` becomes nullable, triggers referencing it are recreated.
+CREATE_DELTA_TEMPLATE_STORE: List[MigrationStep] = [
+    "PRAGMA defer_foreign_keys = ON",
+    "DROP TRIGGER IF EXISTS prompts_fts_insert",
+    "DROP TRIGGER IF EXISTS prompts_fts_update",
+    "DROP TRIGGER IF EXISTS prompt_templates_ref_insert",
+    "DROP TRIGGER IF EXISTS prompt_templates_ref_update",
+    "DROP TRIGGER IF EXISTS prompt_templates_ref_delete",
+    # Copy aside and recreate in place, inserting the rows back clears the deferred foreign key violations
+    "CREATE TEMP TABLE prompt_templates_backup AS SELECT rowid AS template_rowid, hash, template, ref_count FROM prompt_templates",
+    "DROP TABLE prompt_templates",
+    """
+    CREATE TABLE prompt_templates (
+        hash TEXT PRIMARY KEY,
+        template TEXT,
+        encoding TEXT NOT NULL DEFAULT 'text',
+        base_hash TEXT,
+        data BLOB,
+        chain_length INTEGER NOT NULL DEFAULT 0,
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (base_hash) REFERENCES prompt_templates (hash)
+    )
+    """,
+    "INSERT INTO prompt_templates (rowid, hash, template, ref_count) SELECT template_rowid, hash, template, ref_count FROM prompt_templates_backup",
+    "DROP TABLE prompt_templates_backup",
+    "CREATE INDEX IF NOT EXISTS idx_prompt_templates_base_hash ON prompt_templates (base_hash)",
+    # Encoded templates have no plain text, sql_helper writes their text into the index itself
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_insert AFTER INSERT ON prompts BEGIN
+        INSERT INTO prompts_fts (rowid, name, description, notes, prompt_template)
+        VALUES (NEW.rowid, NEW.name, NEW.description, NEW.notes, (SELECT template FROM prompt_templates WHERE hash = NEW.template_hash));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_update AFTER UPDATE OF name, description, notes ON prompts BEGIN
+        UPDATE prompts_fts SET name = NEW.name, description = NEW.description, notes = NEW.notes WHERE rowid = OLD.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_template_update AFTER UPDATE OF template_hash ON prompts BEGIN
+        UPDATE prompts_fts SET prompt_template = (SELECT template FROM prompt_templates WHERE hash = NEW.template_hash) WHERE rowid = OLD.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_ref_insert AFTER INSERT ON prompts BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count + 1 WHERE hash = NEW.template_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_ref_update AFTER UPDATE OF template_hash ON prompts
+    WHEN NEW.template_hash != OLD.template_hash BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count + 1 WHERE hash = NEW.template_hash;
+        UPDATE prompt_templates SET ref_count = ref_count - 1 WHERE hash = OLD.template_hash;
+        DELETE FROM prompt_templates WHERE hash = OLD.template_hash AND ref_count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_ref_delete AFTER DELETE ON prompts BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count - 1 WHERE hash = OLD.template_hash;
+        DELETE FROM prompt_templates WHERE hash = OLD.template_hash AND ref_count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_base_insert AFTER INSERT ON prompt_templates
+    WHEN NEW.base_hash IS NOT NULL BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count + 1 WHERE hash = NEW.base_hash;
+    END
+    """,
+    # Releasing a whole delta chain needs PRAGMA recursive_triggers (set on pooled connections)
+    """
+    CREATE TRIGGER IF NOT EXISTS prompt_templates_base_delete AFTER DELETE ON prompt_templates
+    WHEN OLD.base_hash IS NOT NULL BEGIN
+        UPDATE prompt_templates SET ref_count = ref_count - 1 WHERE hash = OLD.base_hash;
+        DELETE FROM prompt_templates WHERE hash = OLD.base_hash AND ref_count <= 0;
+    END
+    """,
+]
+
+# Version 8 - Normalized parent edges for lineage queries, back-filled from the comma separated parent_prompt_id
+CREATE_PROMPT_EDGES: List[MigrationStep] = [
+    """
+    CREATE TABLE IF NOT EXISTS prompt_edges (
+        child_id TEXT NOT NULL,
+        parent_id TEXT NOT NULL,
+        PRIMARY KEY (child_id, parent_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    INSERT OR IGNORE INTO prompt_edges (child_id, parent_id)
+    WITH RECURSIVE split (child_id, parent_id, rest) AS (
+        SELECT id, '', parent_prompt_id || ',' FROM prompts WHERE parent_prompt_id IS NOT NULL
+        UNION ALL
+        SELECT child_id, TRIM(SUBSTR(rest, 1, INSTR(rest, ',') - 1)), SUBSTR(rest, INSTR(rest, ',') + 1)
+        FROM split
+        WHERE rest != ''
+    )
+    SELECT child_id, parent_id FROM split WHERE parent_id != ''
+    """,
+]
+
+# Version 9 - Parent to child index on prompt_edges for descendant lookups
+CREATE_PROMPT_EDGES_PARENT_INDEX: List[MigrationStep] = [
+    "CREATE INDEX IF NOT EXISTS idx_prompt_edges_parent ON prompt_edges (parent_id, child_id)",
+]
+
+# Version 10 - On-disk cache of deterministic LLM responses
+CREATE_RESPONSE_CACHE: List[MigrationStep] = [
+    """
+    CREATE TABLE IF NOT EXISTS llm_responses (
+        key TEXT PRIMARY KEY,
+        provider TEXT,
+        model_name TEXT,
+        response TEXT NOT NULL,
+        input_token_count INTEGER,
+        output_token_count INTEGER,
+        hit_count INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses (last_used_at)",
+    "CREATE INDEX IF NOT EXISTS idx_llm_responses_created ON llm_responses (created_at)",
+]
+
+# Version 11 - Stored evaluation runs and their per-input results, removed with their prompt
+CREATE_EVAL_STORE: List[MigrationStep] = [
+    """
+    CREATE TABLE IF NOT EXISTS eval_runs (
+        id TEXT PRIMARY KEY,
+        prompt_id TEXT NOT NULL,
+        model_hash TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        model_settings TEXT NOT NULL,
+        source TEXT NOT NULL,
+        notes TEXT,
+        created_at REAL NOT NULL,
+        FOREIGN KEY (prompt_id) REFERENCES prompts (id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS eval_results (
+        id INTEGER PRIMARY KEY,
+        run_id TEXT NOT NULL,
+        prompt_id TEXT NOT NULL,
+        model_hash TEXT NOT NULL,
+        input_hash TEXT NOT NULL,
+        input_values TEXT,
+        input_text TEXT NOT NULL,
+        output TEXT,
+        error TEXT,
+        latency REAL,
+        input_token_count INTEGER,
+        output_token_count INTEGER,
+        cached INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        FOREIGN KEY (run_id) REFERENCES eval_runs (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_eval_runs_prompt_created ON eval_runs (prompt_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_eval_results_run ON eval_results (run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_eval_results_lookup ON eval_results (prompt_id, model_hash, input_hash, created_at)",
+]
+
+# Version 12 - Running entry count and byte size of the response cache, kept by triggers so eviction does not scan the table
+CREATE_RESPONSE_CACHE_TOTALS: List[MigrationStep] = [
+    """
+    CREATE TABLE IF NOT EXISTS llm_response_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        entries INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    )
+    """,
+    "INSERT OR IGNORE INTO llm_response_totals (id, entries, bytes) SELECT 0, COUNT(*), COALESCE(SUM(LENGTH(CAST(response AS BLOB))), 0) FROM llm_responses",
+    """
+    CREATE TRIGGER IF NOT EXISTS llm_responses_totals_insert AFTER INSERT ON llm_responses BEGIN
+        UPDATE llm_response_totals SET entries = entries + 1, bytes = bytes + LENGTH(CAST(new.response AS BLOB)) WHERE id = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS llm_responses_totals_delete AFTER DELETE ON llm_responses BEGIN
+        UPDATE llm_response_totals SET entries = entries - 1, bytes = bytes - LENGTH(CAST(old.response AS BLOB)) WHERE id = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS llm_responses_totals_update AFTER UPDATE OF response ON llm_responses BEGIN
+        UPDATE llm_response_totals SET bytes = bytes - LENGTH(CAST(old.response AS BLOB)) + LENGTH(CAST(new.response AS BLOB)) WHERE id = 0;
+    END
+    """,
+]
+
+# Version 13 - Index backing the case-insensitive name and version uniqueness checks of the bulk prompt writes
+CREATE_PROMPT_NAME_VERSION_INDEX: List[MigrationStep] = [
+    "CREATE INDEX IF NOT EXISTS idx_prompts_project_name_version_nocase ON prompts (project_id, name COLLATE NOCASE, version)",
+]
+
+# Version 14 - External content search index
+# The index no longer keeps its own copy of every version's template, the text is read through a view when needed
+# (snippets) and supplied by the triggers, which remove the old values before a row changes
+CREATE_EXTERNAL_CONTENT_FTS: List[MigrationStep] = [
+    "DROP TRIGGER IF EXISTS prompts_fts_insert",
+    "DROP TRIGGER IF EXISTS prompts_fts_update",
+    "DROP TRIGGER IF EXISTS prompts_fts_template_update",
+    "DROP TRIGGER IF EXISTS prompts_fts_delete",
+    "DROP TABLE IF EXISTS prompts_fts",
+    """
+    CREATE VIEW IF NOT EXISTS prompts_fts_content AS
+    SELECT rowid AS prompt_rowid, name, description, notes, template_text(template_hash) AS prompt_template
+    FROM prompts
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5 (
+        name,
+        description,
+        notes,
+        prompt_template,
+        content = 'prompts_fts_content',
+        content_rowid = 'prompt_rowid',
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_insert AFTER INSERT ON prompts BEGIN
+        INSERT INTO prompts_fts (rowid, name, description, notes, prompt_template)
+        VALUES (NEW.rowid, NEW.name, NEW.description, NEW.notes, template_text(NEW.template_hash));
+    END
+    """,
+    # The old template is still stored before the row changes, it is released afterwards
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_before_update BEFORE UPDATE OF name, description, notes, template_hash ON prompts BEGIN
+        INSERT INTO prompts_fts (prompts_fts, rowid, name, description, notes, prompt_template)
+        VALUES ('delete', OLD.rowid, OLD.name, OLD.description, OLD.notes, template_text(OLD.template_hash));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_after_update AFTER UPDATE OF name, description, notes, template_hash ON prompts BEGIN
+        INSERT INTO prompts_fts (rowid, name, description, notes, prompt_template)
+        VALUES (NEW.rowid, NEW.name, NEW.description, NEW.notes, template_text(NEW.template_hash));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS prompts_fts_delete BEFORE DELETE ON prompts BEGIN
+        INSERT INTO prompts_fts (prompts_fts, rowid, name, description, notes, prompt_template)
+        VALUES ('delete', OLD.rowid, OLD.name, OLD.description, OLD.notes, template_text(OLD.template_hash));
+    END
+    """,
+    "INSERT INTO prompts_fts (prompts_fts) VALUES ('rebuild')",
+]
+
+# Ordered list of (version, steps), append new migrations at the end
+MIGRATIONS: List[Tuple[int, List[MigrationStep]]] = [
+    (1, CREATE_TABLES),
+    (2, CREATE_INDEXES),
+    (3, CREATE_PAGINATION_INDEXES),
+    (4, CREATE_LATEST_VERSION_INDEX),
+    (5, CREATE_PROMPTS_FTS),
+    (6, CREATE_TEMPLATE_STORE),
+    (7, CREATE_DELTA_TEMPLATE_STORE),
+    (8, CREATE_PROMPT_EDGES),
+    (9, CREATE_PROMPT_EDGES_PARENT_INDEX),
+    (10, CREATE_RESPONSE_CACHE),
+    (11, CREATE_EVAL_STORE),
+    (12, CREATE_RESPONSE_CACHE_TOTALS),
+    (13, CREATE_PROMPT_NAME_VERSION_INDEX),
+    (14, CREATE_EXTERNAL_CONTENT_FTS),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# Get the schema version stored in the database file
+def get_schema_version(connection:sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Apply all pending migrations, each one in its own transaction
+def migrate(connection:sqlite3.Connection) -> int:
+
+    for version, steps in MIGRATIONS:
+        if get_schema_version(connection) >= version:
+            continue
+
+        # Take the write lock first so concurrent processes migrate one at a time
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process might have applied it while we were waiting
+            if get_schema_version(connection) >= version:
+                connection.rollback()
+                continue
+
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(step)
+
+            connection.execute(f"PRAGMA user_version = {version}")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    return get_schema_version(connection)
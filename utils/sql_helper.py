@@ -1,8 +1,22 @@
+import os
 import sqlite3
+import re
+import gzip
+import json
 import hashlib
 import pandas as pd
+from collections import namedtuple
 from datetime import datetime
-from typing import Optional, Tuple
+from functools import lru_cache
+from contextlib import contextmanager
+from typing import IO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from utils.db_helper import DB_LOCK, synchronized
+from utils.cache_helper import LRUCache
+from utils.hash_helper import template_hash
+from utils.schema_helper import get_schema_version
+from utils.template_helper import get_template_variables
+from utils.delta_helper import TEMPLATE_CACHE, compress_text, make_delta, load_template
 
 class ProjectAlreadyExistsError(Exception):
     pass
@@ -13,11 +27,74 @@ class ProjectNotFoundError(Exception):
 class PromptAlreadyExistsError(Exception):
     pass
 
+class PromptNotFoundError(Exception):
+    pass
+
+class InvalidColumnError(Exception):
+    pass
+
+
+# Columns that can be requested through the listing API
+PROJECT_COLUMNS = ('id', 'name', 'description', 'created_at', 'updated_at')
+PROMPT_COLUMNS = ('id', 'prompt_group_id', 'project_id', 'parent_prompt_id', 'name', 'description', 'version', 'prompt_template', 'input_variables', 'favourite', 'notes', 'created_at', 'updated_at')
+
+# Templates are stored once per content hash, join them back in when the text is needed
+# Encoded templates have a NULL `template`, readers also select the hash to decode them
+TEMPLATE_JOIN = "JOIN prompt_templates ON prompt_templates.hash = prompts.template_hash"
+
+# How new templates are stored, 'text' (plain) or 'delta' (compressed diff against the parent's template)
+TEMPLATE_STORAGE = os.getenv('TEMPLATE_STORAGE', 'text')
+
+# Longest delta chain before a full compressed snapshot is stored, bounds reconstruction cost
+DELTA_SNAPSHOT_INTERVAL = 8
+
+# Read-through caches for metadata read on every rerun, keyed by entity id
+# Listings are keyed by a tuple ending with the generation and retired by bumping the generation on writes
+PROJECT_CACHE = LRUCache(maxsize=1024)
+PROMPT_CACHE = LRUCache(maxsize=4096)
+
+
+# Drop all cached rows, e.g. after the database was modified by another process
+def clear_caches():
+    PROJECT_CACHE.clear()
+    PROMPT_CACHE.clear()
+    TEMPLATE_CACHE.clear()
+
+
+# Open `transaction` blocks per connection, only the outermost one commits
+_TRANSACTION_DEPTH: Dict[sqlite3.Connection, int] = {}
+
+
+# Group writes into a single transaction, committed when the block exits and rolled back if it raises
+# Holds the database lock throughout; the write functions called inside defer their commit to the block
+# Blocks can be nested, only the outermost one commits or rolls back
+@contextmanager
+def transaction(connection:sqlite3.Connection) -> Iterator[sqlite3.Cursor]:
+    with DB_LOCK:
+        depth = _TRANSACTION_DEPTH.get(connection, 0)
+        _TRANSACTION_DEPTH[connection] = depth + 1
+        try:
+            yield connection.cursor()
+            if depth == 0:
+                connection.commit()
+        except Exception:
+            if depth == 0:
+                connection.rollback()
+                # Rows cached while the transaction was open may be gone
+                clear_caches()
+            raise
+        finally:
+            if depth == 0:
+                _TRANSACTION_DEPTH.pop(connection)
+            else:
+                _TRANSACTION_DEPTH[connection] = depth
+
 
 # Add New Project
+@synchronized
 def create_project(project_name:str, connection:sqlite3.Connection, cursor:sqlite3.Cursor, description=None):
     # Check if project name already exists (case-insensitive)
-    cursor.execute("SELECT COUNT(*) FROM projects WHERE LOWER(name) = LOWER(?)", (project_name,))
+    cursor.execute("SELECT COUNT(*) FROM projects WHERE name = ? COLLATE NOCASE", (project_name,))
     count = cursor.fetchone()[0]
     if count > 0:
         raise ProjectAlreadyExistsError
@@ -29,23 +106,29 @@ def create_project(project_name:str, connection:sqlite3.Connection, cursor:sqlit
     current_date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     # Insert new record into the project table
-    if description is None:
-        cursor.execute(
-            "INSERT INTO projects (id, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
-            (project_id, project_name, current_date_time, current_date_time)
-        )
-    else:
-        cursor.execute(
-            "INSERT INTO projects (id, name, description, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-            (project_id, project_name, description, current_date_time, current_date_time)
-        )
-    connection.commit()
+    with transaction(connection):
+        if description is None:
+            cursor.execute(
+                "INSERT INTO projects (id, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (project_id, project_name, current_date_time, current_date_time)
+            )
+        else:
+            cursor.execute(
+                "INSERT INTO projects (id, name, description, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (project_id, project_name, description, current_date_time, current_date_time)
+            )
+    PROJECT_CACHE.bump_generation()
 
 
 # Get all projects
+@synchronized
 def get_all_projects(cursor: sqlite3.Cursor, output_type:str='dict') -> dict:
-    cursor.execute("SELECT * FROM projects")
-    projects = cursor.fetchall()
+    cache_key = ('all', PROJECT_CACHE.generation)
+    projects = PROJECT_CACHE.get(cache_key)
+    if projects is None:
+        cursor.execute("SELECT id, name, description, created_at, updated_at FROM projects")
+        projects = cursor.fetchall()
+        PROJECT_CACHE.set(cache_key, projects)
     
     if output_type == "dict":
         project_dict = {}
@@ -65,15 +148,74 @@ def get_all_projects(cursor: sqlite3.Cursor, output_type:str='dict') -> dict:
 
 
 # Update Project Details
+@synchronized
 def update_project(project_id:str, project_name:str, description:str, connection:sqlite3.Connection, cursor:sqlite3.Cursor):
     # Get the current date and time in YYYY-MM-DD HH:MM:SS format
     current_date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    cursor.execute("UPDATE projects SET name = ?, description = ?, updated_at = ? WHERE id = ?", (project_name, description, current_date_time, project_id))
-    connection.commit()
+    with transaction(connection):
+        cursor.execute("UPDATE projects SET name = ?, description = ?, updated_at = ? WHERE id = ?", (project_name, description, current_date_time, project_id))
+    PROJECT_CACHE.invalidate(project_id)
+    PROJECT_CACHE.bump_generation()
+
+
+# Get the text of a stored template, following its delta chain back to a snapshot if encoded
+def _load_template(cursor:sqlite3.Cursor, prompt_template_hash:str) -> str:
+    return load_template(cursor, prompt_template_hash, TEMPLATE_CACHE)
+
+
+# Replace the template column of rows read with TEMPLATE_JOIN by its text
+# The rows carry the template hash as their last column, which is dropped
+def _with_template_text(cursor:sqlite3.Cursor, rows:list, index:int) -> list:
+    decoded = []
+    for row in rows:
+        *row, prompt_template_hash = row
+        if row[index] is None:
+            row[index] = _load_template(cursor, prompt_template_hash)
+        decoded.append(tuple(row))
+    return decoded
+
+
+# Encode a template in delta storage mode
+# Stored as a delta against `base_hash` when that is smaller, otherwise as a compressed snapshot
+def _encode_template(cursor:sqlite3.Cursor, prompt_template:str, base_hash:Optional[str]) -> Tuple[str, bytes, Optional[str], int]:
+    snapshot = compress_text(prompt_template)
+
+    if base_hash is not None:
+        cursor.execute("SELECT chain_length FROM prompt_templates WHERE hash = ?", (base_hash,))
+        base = cursor.fetchone()
+        if base is not None and base[0] < DELTA_SNAPSHOT_INTERVAL:
+            delta = make_delta(_load_template(cursor, base_hash), prompt_template)
+            if len(delta) < len(snapshot):
+                return 'delta', delta, base_hash, base[0] + 1
+
+    return 'zlib', snapshot, None, 0
+
+
+# Store a template once per content hash and return the hash
+# Identical templates (e.g. a new version that only changes the notes) share one row
+def _store_template(cursor:sqlite3.Cursor, prompt_template:str, base_hash:Optional[str] = None) -> str:
+    prompt_template_hash = template_hash(prompt_template)
+
+    cursor.execute("SELECT COUNT(*) FROM prompt_templates WHERE hash = ?", (prompt_template_hash,))
+    if cursor.fetchone()[0] > 0:
+        return prompt_template_hash
+
+    if TEMPLATE_STORAGE == 'delta':
+        encoding, data, base_hash, chain_length = _encode_template(cursor, prompt_template, base_hash)
+        cursor.execute(
+            "INSERT INTO prompt_templates (hash, encoding, base_hash, data, chain_length) VALUES (?, ?, ?, ?, ?)",
+            (prompt_template_hash, encoding, base_hash, data, chain_length)
+        )
+        TEMPLATE_CACHE.set(prompt_template_hash, prompt_template)
+        return prompt_template_hash
+
+    cursor.execute("INSERT INTO prompt_templates (hash, template) VALUES (?, ?)", (prompt_template_hash, prompt_template))
+    return prompt_template_hash
 
 
 # Create a new prompt template
+@synchronized
 def create_prompt(
     project_id:str,
     prompt_name:str,
@@ -94,7 +236,7 @@ def create_prompt(
         raise ProjectNotFoundError
 
     # Check if prompt name and version already exists within the project (case-insensitive)
-    cursor.execute("SELECT COUNT(*) FROM prompts WHERE LOWER(name) = LOWER(?) AND version = ? AND project_id = ?", (prompt_name, version, project_id))
+    cursor.execute("SELECT COUNT(*) FROM prompts WHERE name = ? COLLATE NOCASE AND version = ? AND project_id = ?", (prompt_name, version, project_id))
     count = cursor.fetchone()[0]
     if count > 0:
         raise PromptAlreadyExistsError
@@ -106,17 +248,34 @@ def create_prompt(
     # Get the current date and time in YYYY-MM-DD HH:MM:SS format
     current_date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    # Insert new record into the prompt table
-    cursor.execute(
-        "INSERT INTO prompts (id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (id, prompt_group_id, project_id, parent_prompt_id, prompt_name, prompt_description, version, prompt_template, input_variables, int(favourite), notes, current_date_time, current_date_time)
-    )
-    connection.commit()
+    with transaction(connection):
+        # Delta encoded templates are stored against the (first) parent's template
+        base_hash = None
+        if parent_prompt_id and TEMPLATE_STORAGE == 'delta':
+            cursor.execute("SELECT template_hash FROM prompts WHERE id = ?", (parent_prompt_id.split(',')[0].strip(),))
+            parent = cursor.fetchone()
+            base_hash = parent[0] if parent else None
+
+        # Store the template (no-op if identical text is already stored) and insert new record into the prompt table
+        prompt_template_hash = _store_template(cursor, prompt_template, base_hash)
+        cursor.execute(
+            "INSERT INTO prompts (id, prompt_group_id, project_id, parent_prompt_id, name, description, version, template_hash, input_variables, favourite, notes, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (id, prompt_group_id, project_id, parent_prompt_id, prompt_name, prompt_description, version, prompt_template_hash, input_variables, int(favourite), notes, current_date_time, current_date_time)
+        )
+
+        # Record the lineage edges
+        if parent_prompt_id:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO prompt_edges (child_id, parent_id) VALUES (?, ?)",
+                [(id, parent_id.strip()) for parent_id in parent_prompt_id.split(',') if parent_id.strip()]
+            )
+    PROMPT_CACHE.bump_generation()
     
     return id, prompt_group_id
 
 
 # Update Prompt Template
+@synchronized
 def update_prompt(
     id:str,
     prompt_name:str,
@@ -132,37 +291,263 @@ def update_prompt(
     # Get the current date and time in YYYY-MM-DD HH:MM:SS format
     current_date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    # Update the record in the prompt table
-    cursor.execute(
-        "UPDATE prompts SET name = ?, description = ?, version = ?, prompt_template = ?, input_variables = ?, favourite = ?, notes = ?, updated_at = ? WHERE id = ?",
-        (prompt_name, prompt_description, version, prompt_template, input_variables, int(favourite), notes, current_date_time, id)
-    )
-    connection.commit()
+    with transaction(connection):
+        # Delta encoded templates are stored against the template being replaced
+        base_hash = None
+        if TEMPLATE_STORAGE == 'delta':
+            cursor.execute("SELECT template_hash FROM prompts WHERE id = ?", (id,))
+            current = cursor.fetchone()
+            base_hash = current[0] if current else None
+
+        # Update the record in the prompt table, the old template is released by a trigger if unused
+        prompt_template_hash = _store_template(cursor, prompt_template, base_hash)
+        cursor.execute(
+            "UPDATE prompts SET name = ?, description = ?, version = ?, template_hash = ?, input_variables = ?, favourite = ?, notes = ?, updated_at = ? WHERE id = ?",
+            (prompt_name, prompt_description, version, prompt_template_hash, input_variables, int(favourite), notes, current_date_time, id)
+        )
+    PROMPT_CACHE.invalidate(id)
+    PROMPT_CACHE.bump_generation()
+
+
+# Fields of the prompt dicts taken by `create_prompts_bulk` and `update_prompts_bulk`, with the defaults of the optional ones
+BULK_PROMPT_DEFAULTS = {
+    'parent_prompt_id': None,
+    'prompt_description': None,
+    'input_variables': None,
+    'favourite': False,
+    'notes': None,
+}
+
+
+# Fill in the optional fields of a bulk prompt, input variables are read from the template if not given
+def _bulk_prompt(prompt:dict, defaults:dict = BULK_PROMPT_DEFAULTS) -> dict:
+    prompt = {**defaults, **prompt}
+    if prompt['input_variables'] is None:
+        prompt['input_variables'] = ", ".join(get_template_variables(prompt['prompt_template'])) or None
+    return prompt
+
+
+# Store the templates of a batch, returns their hashes
+# `base_hashes` are the delta bases per template, only used for delta storage
+def _store_templates_bulk(cursor:sqlite3.Cursor, prompt_templates:List[str], base_hashes:List[Optional[str]]) -> List[str]:
+    if TEMPLATE_STORAGE != 'delta':
+        hashes = [template_hash(prompt_template) for prompt_template in prompt_templates]
+        cursor.executemany("INSERT OR IGNORE INTO prompt_templates (hash, template) VALUES (?, ?)", zip(hashes, prompt_templates))
+        return hashes
+
+    return [_store_template(cursor, prompt_template, base_hash) for prompt_template, base_hash in zip(prompt_templates, base_hashes)]
+
+
+# Create many prompts in one transaction, e.g. from scripted migrations or a dataset
+# Each prompt is a dict with the arguments of `create_prompt` (project_id, prompt_name, version, prompt_template
+# and optionally the `BULK_PROMPT_DEFAULTS` fields); parents may be earlier prompts of the same batch
+# Projects and name/version uniqueness are checked for the whole batch up front, nothing is written if any check fails
+# Returns the (id, prompt_group_id) of every prompt, in order
+@synchronized
+def create_prompts_bulk(prompts:List[dict], connection:sqlite3.Connection, cursor:sqlite3.Cursor) -> List[Tuple[str, str]]:
+    prompts = [_bulk_prompt(prompt) for prompt in prompts]
+    if not prompts:
+        return []
+
+    # Check that all projects exist
+    project_ids = sorted({prompt['project_id'] for prompt in prompts})
+    cursor.execute("SELECT value FROM json_each(?) WHERE value NOT IN (SELECT id FROM projects)", (json.dumps(project_ids),))
+    missing = cursor.fetchone()
+    if missing is not None:
+        raise ProjectNotFoundError(missing[0])
+
+    # Check that names and versions are unique (case-insensitive) within the batch and the projects
+    keys = [(prompt['project_id'], prompt['prompt_name'].lower(), prompt['version']) for prompt in prompts]
+    seen = set()
+    for key in keys:
+        if key in seen:
+            raise PromptAlreadyExistsError(f"{key[1]} v{key[2]}")
+        seen.add(key)
+
+    cursor.execute("""
+        SELECT prompts.name, prompts.version
+        FROM json_each(?) AS batch
+        JOIN prompts ON prompts.project_id = json_extract(batch.value, '$[0]')
+            AND prompts.name = json_extract(batch.value, '$[1]') COLLATE NOCASE
+            AND prompts.version = json_extract(batch.value, '$[2]')
+        LIMIT 1
+        """, (json.dumps(keys),))
+    existing = cursor.fetchone()
+    if existing is not None:
+        raise PromptAlreadyExistsError(f"{existing[0]} v{existing[1]}")
+
+    # Generate unique IDs using hashlib's sha, like `create_prompt`
+    ids = [
+        (
+            hashlib.sha256((prompt['project_id'] + prompt['prompt_name'] + str(prompt['version'])).encode()).hexdigest(),
+            hashlib.sha256((prompt['project_id'] + prompt['prompt_name']).encode()).hexdigest()
+        )
+        for prompt in prompts
+    ]
+
+    # Different names and versions can still hash to the same id, e.g. 'Prompt 1' v11 and 'Prompt 11' v1
+    seen = set()
+    for (id, _), prompt in zip(ids, prompts):
+        if id in seen:
+            raise PromptAlreadyExistsError(f"{prompt['prompt_name']} v{prompt['version']}")
+        seen.add(id)
+
+    # Get the current date and time in YYYY-MM-DD HH:MM:SS format
+    current_date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    with transaction(connection):
+        # Delta encoded templates are stored against the (first) parent's template, which may be in this batch
+        base_hashes = [None] * len(prompts)
+        if TEMPLATE_STORAGE == 'delta':
+            batch_hashes = {}
+            for idx, prompt in enumerate(prompts):
+                parent_id = prompt['parent_prompt_id'].split(',')[0].strip() if prompt['parent_prompt_id'] else None
+                if parent_id in batch_hashes:
+                    base_hashes[idx] = batch_hashes[parent_id]
+                elif parent_id:
+                    cursor.execute("SELECT template_hash FROM prompts WHERE id = ?", (parent_id,))
+                    parent = cursor.fetchone()
+                    base_hashes[idx] = parent[0] if parent else None
+                batch_hashes[ids[idx][0]] = template_hash(prompt['prompt_template'])
+
+        hashes = _store_templates_bulk(cursor, [prompt['prompt_template'] for prompt in prompts], base_hashes)
+        try:
+            cursor.executemany(
+                "INSERT INTO prompts (id, prompt_group_id, project_id, parent_prompt_id, name, description, version, template_hash, input_variables, favourite, notes, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (id, prompt_group_id, prompt['project_id'], prompt['parent_prompt_id'], prompt['prompt_name'], prompt['prompt_description'], prompt['version'], prompt_template_hash, prompt['input_variables'], int(prompt['favourite']), prompt['notes'], current_date_time, current_date_time)
+                    for (id, prompt_group_id), prompt, prompt_template_hash in zip(ids, prompts, hashes)
+                ]
+            )
+        except sqlite3.IntegrityError as e:
+            if 'prompts.id' in str(e):
+                raise PromptAlreadyExistsError from e
+            raise
+
+        # Record the lineage edges
+        cursor.executemany(
+            "INSERT OR IGNORE INTO prompt_edges (child_id, parent_id) VALUES (?, ?)",
+            [
+                (id, parent_id.strip())
+                for (id, _), prompt in zip(ids, prompts) if prompt['parent_prompt_id']
+                for parent_id in prompt['parent_prompt_id'].split(',') if parent_id.strip()
+            ]
+        )
+    PROMPT_CACHE.bump_generation()
+
+    return ids
+
+
+# Update many prompts in one transaction
+# Each prompt is a dict with the arguments of `update_prompt` (id, prompt_name, version, prompt_template
+# and optionally prompt_description, input_variables, favourite and notes); omitted fields keep their stored values,
+# except input_variables which are read from the new template
+# All ids and the new names and versions are checked up front, nothing is written if any check fails
+@synchronized
+def update_prompts_bulk(prompts:List[dict], connection:sqlite3.Connection, cursor:sqlite3.Cursor):
+    if not prompts:
+        return
+
+    # Each prompt can only be updated once per batch
+    seen = set()
+    for prompt in prompts:
+        if prompt['id'] in seen:
+            raise PromptAlreadyExistsError(prompt['id'])
+        seen.add(prompt['id'])
+
+    # Check that all prompts exist, and get their projects, stored fields and current templates as delta bases
+    prompt_ids = json.dumps([prompt['id'] for prompt in prompts])
+    cursor.execute("""
+        SELECT batch.value, prompts.project_id, prompts.template_hash, prompts.description, prompts.favourite, prompts.notes
+        FROM json_each(?) AS batch
+        LEFT JOIN prompts ON prompts.id = batch.value
+        """, (prompt_ids,))
+    current = {id: row for id, *row in cursor.fetchall()}
+    missing = [id for id, (_, current_hash, *_) in current.items() if current_hash is None]
+    if missing:
+        raise PromptNotFoundError(missing[0])
+    current_hashes = {id: current_hash for id, (_, current_hash, *_) in current.items()}
+
+    prompts = [
+        _bulk_prompt(prompt, {
+            'prompt_description': current[prompt['id']][2],
+            'input_variables': None,
+            'favourite': bool(current[prompt['id']][3]),
+            'notes': current[prompt['id']][4],
+        })
+        for prompt in prompts
+    ]
+
+    # Check that the new names and versions are unique (case-insensitive) within the batch and the other prompts of the projects
+    keys = [(current[prompt['id']][0], prompt['prompt_name'].lower(), prompt['version']) for prompt in prompts]
+    seen = set()
+    for key in keys:
+        if key in seen:
+            raise PromptAlreadyExistsError(f"{key[1]} v{key[2]}")
+        seen.add(key)
+
+    cursor.execute("""
+        SELECT prompts.name, prompts.version
+        FROM json_each(?) AS batch
+        JOIN prompts ON prompts.project_id = json_extract(batch.value, '$[0]')
+            AND prompts.name = json_extract(batch.value, '$[1]') COLLATE NOCASE
+            AND prompts.version = json_extract(batch.value, '$[2]')
+        WHERE prompts.id NOT IN (SELECT value FROM json_each(?))
+        LIMIT 1
+        """, (json.dumps(keys), prompt_ids))
+    existing = cursor.fetchone()
+    if existing is not None:
+        raise PromptAlreadyExistsError(f"{existing[0]} v{existing[1]}")
+
+    # Get the current date and time in YYYY-MM-DD HH:MM:SS format
+    current_date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    with transaction(connection):
+        # The old templates are released by a trigger if unused
+        hashes = _store_templates_bulk(
+            cursor,
+            [prompt['prompt_template'] for prompt in prompts],
+            [current_hashes[prompt['id']] for prompt in prompts]
+        )
+        cursor.executemany(
+            "UPDATE prompts SET name = ?, description = ?, version = ?, template_hash = ?, input_variables = ?, favourite = ?, notes = ?, updated_at = ? WHERE id = ?",
+            [
+                (prompt['prompt_name'], prompt['prompt_description'], prompt['version'], prompt_template_hash, prompt['input_variables'], int(prompt['favourite']), prompt['notes'], current_date_time, prompt['id'])
+                for prompt, prompt_template_hash in zip(prompts, hashes)
+            ]
+        )
+
+    for prompt in prompts:
+        PROMPT_CACHE.invalidate(prompt['id'])
+    PROMPT_CACHE.bump_generation()
 
 
 # Get all prompts for a project or all prompts
+@synchronized
 def get_all_prompts(cursor: sqlite3.Cursor, project_id: Optional[str] = None, output_type:str='dict') -> dict:
     
     # Prompt Table Schema
     # id TEXT PRIMARY KEY | prompt_group_id TEXT NOT NULL | project_id TEXT NOT NULL | description TEXT | parent_prompt_id TEXT | name TEXT NOT NULL | version INTEGER NOT NULL |
-    # prompt_template TEXT NOT NULL | input_variables TEXT | favourite INTEGER NOT NULL | notes TEXT | created_at TEXT NOT NULL | updated_at TEXT NOT NULL |
-    # FOREIGN KEY (project_id) REFERENCES projects (id) |
+    # template_hash TEXT NOT NULL | input_variables TEXT | favourite INTEGER NOT NULL | notes TEXT | created_at TEXT NOT NULL | updated_at TEXT NOT NULL |
+    # FOREIGN KEY (project_id) REFERENCES projects (id) | FOREIGN KEY (template_hash) REFERENCES prompt_templates (hash) |
+    # Prompt Templates Table Schema
+    # hash TEXT PRIMARY KEY | template TEXT NOT NULL | ref_count INTEGER NOT NULL |
     
     # Execute SQL Query
     if project_id:
-        cursor.execute("""
-            SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at 
-            FROM prompts 
+        cursor.execute(f"""
+            SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_templates.template, input_variables, favourite, notes, created_at, updated_at, prompts.template_hash 
+            FROM prompts {TEMPLATE_JOIN}
             WHERE project_id = ?
             """, (project_id,))
     else:
-        cursor.execute("""
-            SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at 
-            FROM prompts
+        cursor.execute(f"""
+            SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_templates.template, input_variables, favourite, notes, created_at, updated_at, prompts.template_hash 
+            FROM prompts {TEMPLATE_JOIN}
             """)
     
     # Fetch the data
-    prompts = cursor.fetchall()
+    prompts = _with_template_text(cursor, cursor.fetchall(), 7)
     
     if output_type == 'dict':
         # Convert to dictionary
@@ -192,58 +577,35 @@ def get_all_prompts(cursor: sqlite3.Cursor, project_id: Optional[str] = None, ou
         return prompt_df
 
 
-# Get all prompt groups for a project or all prompt groups
-def get_all_prompt_groups(cursor: sqlite3.Cursor, project_id: Optional[str] = None) -> dict:
-
-        # Execute SQL Query
-        if project_id:
-            cursor.execute("""
-                SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at 
-                FROM prompts 
-                WHERE project_id = ?
-                """, (project_id,))
-        else:
-            cursor.execute("""
-                SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at 
-                FROM prompts
-                """)
-        
-        # Fetch the data
-        prompts = cursor.fetchall()
-        
-        # Convert to dictionary
-        prompt_dict = {}
-        for prompt in prompts:
-            id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at = prompt
-            prompt_dict[prompt_group_id] = {
-                "project_id": project_id,
-                "parent_prompt_id": parent_prompt_id,
-                "name": name,
-                "description": description,
-                "version": version,
-                "prompt_template": prompt_template,
-                "input_variables": input_variables,
-                "favourite": favourite,
-                "notes": notes,
-                "created_at": created_at,
-                "updated_at": updated_at
-            }
-            
-        return prompt_dict
+# Latest version of every prompt group, ties on version go to the most recently inserted row
+# Only reads the (project_id, prompt_group_id, version) index, the full rows are fetched per group
+LATEST_PROMPT_VERSIONS_SQL = """
+    SELECT prompt_rowid FROM (
+        SELECT rowid AS prompt_rowid, ROW_NUMBER() OVER (PARTITION BY prompt_group_id ORDER BY version DESC, rowid DESC) AS version_rank
+        FROM prompts
+        {where}
+    )
+    WHERE version_rank = 1
+"""
 
 
-# Get prompt group details
-def get_prompt_group_details(cursor: sqlite3.Cursor, prompt_group_id: str) -> Tuple[str, str, str]:
-    cursor.execute("SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at FROM prompts WHERE prompt_group_id = ?", (prompt_group_id,))
-    prompt = cursor.fetchone()
-    id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at = prompt
+# Get prompt group details from the latest version of the group
+@synchronized
+def get_prompt_group_details(cursor: sqlite3.Cursor, prompt_group_id: str) -> Tuple[str, str]:
+    cursor.execute("SELECT name, description FROM prompts WHERE prompt_group_id = ? ORDER BY version DESC, rowid DESC LIMIT 1", (prompt_group_id,))
+    name, description = cursor.fetchone()
     return name, description
 
 
 # Get all prompt versions
+@synchronized
 def get_all_prompt_versions(cursor: sqlite3.Cursor, prompt_group_id: str) -> pd.DataFrame:
-    cursor.execute("SELECT id, version, input_variables, notes, favourite FROM prompts WHERE prompt_group_id = ?", (prompt_group_id,))
-    versions = cursor.fetchall()
+    cache_key = ('versions', prompt_group_id, PROMPT_CACHE.generation)
+    versions = PROMPT_CACHE.get(cache_key)
+    if versions is None:
+        cursor.execute("SELECT id, version, input_variables, notes, favourite FROM prompts WHERE prompt_group_id = ?", (prompt_group_id,))
+        versions = cursor.fetchall()
+        PROMPT_CACHE.set(cache_key, versions)
     
     data = {
         "id": [],
@@ -271,9 +633,13 @@ def get_all_prompt_versions(cursor: sqlite3.Cursor, prompt_group_id: str) -> pd.
 
 
 # Get all details about a prompt
+@synchronized
 def get_prompt_details(cursor: sqlite3.Cursor, id: str) -> dict:
-    cursor.execute("SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at FROM prompts WHERE id = ?", (id,))
-    prompt = cursor.fetchone()
+    prompt = PROMPT_CACHE.get(id)
+    if prompt is None:
+        cursor.execute(f"SELECT id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_templates.template, input_variables, favourite, notes, created_at, updated_at, prompts.template_hash FROM prompts {TEMPLATE_JOIN} WHERE id = ?", (id,))
+        prompt = _with_template_text(cursor, cursor.fetchall(), 7)[0]
+        PROMPT_CACHE.set(id, prompt)
     id, prompt_group_id, project_id, parent_prompt_id, name, description, version, prompt_template, input_variables, favourite, notes, created_at, updated_at = prompt
     return {
         "id": id,
@@ -293,6 +659,550 @@ def get_prompt_details(cursor: sqlite3.Cursor, id: str) -> dict:
 
 
 # Delete a Prompt by ID
+@synchronized
 def delete_prompt(id:str, connection:sqlite3.Connection, cursor:sqlite3.Cursor):
-    cursor.execute("DELETE FROM prompts WHERE id = ?", (id,))
-    connection.commit()
\ No newline at end of file
+    with transaction(connection):
+        cursor.execute("DELETE FROM prompts WHERE id = ?", (id,))
+        cursor.execute("DELETE FROM prompt_edges WHERE child_id = ?", (id,))
+        cursor.execute("DELETE FROM prompt_edges WHERE parent_id = ?", (id,))
+    PROMPT_CACHE.invalidate(id)
+    PROMPT_CACHE.bump_generation()
+
+
+# Get the details of a single project
+@synchronized
+def get_project_details(cursor: sqlite3.Cursor, project_id: str) -> dict:
+    project = PROJECT_CACHE.get(project_id)
+    if project is None:
+        cursor.execute("SELECT id, name, description, created_at, updated_at FROM projects WHERE id = ?", (project_id,))
+        project = cursor.fetchone()
+        if project is None:
+            raise ProjectNotFoundError
+        PROJECT_CACHE.set(project_id, project)
+
+    id, name, description, created_at, updated_at = project
+    return {
+        "id": id,
+        "name": name,
+        "description": description,
+        "created_at": created_at,
+        "updated_at": updated_at
+    }
+
+
+# Lightweight record type for a given column projection
+@lru_cache(maxsize=None)
+def _record_type(table:str, columns:Tuple[str, ...]):
+    return namedtuple(f"{table.capitalize()}Record", columns)
+
+
+# Validate a column projection against the allowed columns
+def _check_columns(columns:Sequence[str], allowed:Tuple[str, ...]) -> Tuple[str, ...]:
+    columns = tuple(columns)
+    invalid = [column for column in columns if column not in allowed]
+    if len(columns) == 0 or invalid:
+        raise InvalidColumnError(f"Invalid columns: {invalid}")
+    return columns
+
+
+# SELECT list, joins and template column position for a prompt column projection
+# The template text lives in prompt_templates, its hash is selected last to decode encoded templates
+def _prompt_projection(columns:Tuple[str, ...]) -> Tuple[str, str, Optional[int]]:
+    if 'prompt_template' not in columns:
+        return ', '.join(columns), '', None
+
+    select_list = ', '.join('prompt_templates.template' if column == 'prompt_template' else column for column in columns)
+    return select_list + ', prompts.template_hash', TEMPLATE_JOIN, columns.index('prompt_template')
+
+
+# Run a keyset paginated query and split the result into records and the next page cursor
+# The last two selected columns must be the keyset (name, key)
+def _fetch_page(cursor:sqlite3.Cursor, query:str, params:list, table:str, columns:Tuple[str, ...], page_size:int, template_index:Optional[int] = None):
+    cursor.execute(query, params + [page_size + 1])
+    rows = cursor.fetchall()
+
+    values = [row[:-2] for row in rows[:page_size]]
+    if template_index is not None:
+        values = _with_template_text(cursor, values, template_index)
+
+    record_type = _record_type(table, columns)
+    records = [record_type(*value) for value in values]
+
+    # There is another page only if we got more rows than asked for
+    next_cursor = tuple(rows[page_size - 1][-2:]) if len(rows) > page_size else None
+
+    return records, next_cursor
+
+
+# List projects page by page, ordered by name
+# `after` is the cursor returned with the previous page, None for the first page
+@synchronized
+def list_projects(
+    cursor: sqlite3.Cursor,
+    columns: Sequence[str] = ('id', 'name', 'description'),
+    page_size: int = 30,
+    after: Optional[Tuple[str, str]] = None) -> Tuple[List[tuple], Optional[Tuple[str, str]]]:
+
+    columns = _check_columns(columns, PROJECT_COLUMNS)
+
+    query = f"SELECT {', '.join(columns)}, name, id FROM projects"
+    params = []
+    if after is not None:
+        query += " WHERE (name, id) > (?, ?)"
+        params.extend(after)
+    query += " ORDER BY name, id LIMIT ?"
+
+    return _fetch_page(cursor, query, params, 'project', columns, page_size)
+
+
+# List prompt versions of a project (or all projects) page by page, ordered by name
+@synchronized
+def list_prompts(
+    cursor: sqlite3.Cursor,
+    project_id: Optional[str] = None,
+    columns: Sequence[str] = ('id', 'prompt_group_id', 'name', 'version'),
+    page_size: int = 30,
+    after: Optional[Tuple[str, str]] = None) -> Tuple[List[tuple], Optional[Tuple[str, str]]]:
+
+    columns = _check_columns(columns, PROMPT_COLUMNS)
+    select_list, joins, template_index = _prompt_projection(columns)
+
+    conditions, params = [], []
+    if project_id:
+        conditions.append("project_id = ?")
+        params.append(project_id)
+    if after is not None:
+        conditions.append("(name, id) > (?, ?)")
+        params.extend(after)
+
+    query = f"SELECT {select_list}, name, id FROM prompts {joins}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY name, id LIMIT ?"
+
+    return _fetch_page(cursor, query, params, 'prompt', columns, page_size, template_index)
+
+
+# List the prompt groups of a project page by page, using the latest version of each group
+@synchronized
+def list_prompt_groups(
+    cursor: sqlite3.Cursor,
+    project_id: str,
+    columns: Sequence[str] = ('prompt_group_id', 'name', 'description'),
+    page_size: int = 30,
+    after: Optional[Tuple[str, str]] = None) -> Tuple[List[tuple], Optional[Tuple[str, str]]]:
+
+    columns = _check_columns(columns, PROMPT_COLUMNS)
+    select_list, joins, template_index = _prompt_projection(columns)
+
+    query = f"""
+        WITH latest AS ({LATEST_PROMPT_VERSIONS_SQL.format(where="WHERE project_id = ?")})
+        SELECT {select_list}, name, prompt_group_id
+        FROM latest JOIN prompts ON prompts.rowid = latest.prompt_rowid {joins}
+        """
+    params = [project_id]
+    if after is not None:
+        query += " WHERE (name, prompt_group_id) > (?, ?)"
+        params.extend(after)
+    query += " ORDER BY name, prompt_group_id LIMIT ?"
+
+    # Pages are read on every rerun of the project page, keep them until the next prompt write
+    cache_key = ('groups', project_id, columns, page_size, after, PROMPT_CACHE.generation)
+    page = PROMPT_CACHE.get(cache_key)
+    if page is None:
+        page = _fetch_page(cursor, query, params, 'prompt', columns, page_size, template_index)
+        PROMPT_CACHE.set(cache_key, page)
+    return page
+
+
+# Turn free text into an FTS5 query, every word must match and the last one may be a prefix
+def _fts_query(query:str) -> Optional[str]:
+    terms = re.findall(r"\w+", query)
+    if len(terms) == 0:
+        return None
+
+    terms = [f'"{term}"' for term in terms]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Search prompt names, descriptions, notes and templates, best matches first
+@synchronized
+def search_prompts(cursor: sqlite3.Cursor, query: str, project_id: Optional[str] = None, limit: int = 20) -> List[dict]:
+
+    match_query = _fts_query(query)
+    if match_query is None:
+        return []
+
+    # Matches on the name weigh more than matches deep inside the template
+    sql = """
+        SELECT p.id, p.prompt_group_id, p.project_id, p.name, p.version,
+            snippet(prompts_fts, -1, '**', '**', '…', 16),
+            bm25(prompts_fts, 10.0, 4.0, 2.0, 1.0) AS score
+        FROM prompts_fts
+        JOIN prompts AS p ON p.rowid = prompts_fts.rowid
+        WHERE prompts_fts MATCH ?
+        """
+    params = [match_query]
+    if project_id:
+        sql += " AND p.project_id = ?"
+        params.append(project_id)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+
+    cursor.execute(sql, params)
+
+    results = []
+    for id, prompt_group_id, project_id, name, version, snippet, score in cursor.fetchall():
+        results.append({
+            "id": id,
+            "prompt_group_id": prompt_group_id,
+            "project_id": project_id,
+            "name": name,
+            "version": version,
+            "snippet": snippet,
+            "score": score
+        })
+
+    return results
+
+
+# Get the ancestors (direction='ancestors') or descendants (direction='descendants') of a prompt
+# Each prompt is returned once with its shortest distance to the given prompt
+@synchronized
+def get_prompt_relatives(cursor: sqlite3.Cursor, id: str, direction: str = 'ancestors', max_depth: int = 1000) -> List[dict]:
+
+    if direction == 'ancestors':
+        start_column, next_column = 'child_id', 'parent_id'
+    elif direction == 'descendants':
+        start_column, next_column = 'parent_id', 'child_id'
+    else:
+        raise ValueError(f"Invalid direction: {direction}")
+
+    cursor.execute(f"""
+        WITH RECURSIVE relatives (id, depth) AS (
+            SELECT {next_column}, 1 FROM prompt_edges WHERE {start_column} = ?
+            UNION
+            SELECT prompt_edges.{next_column}, relatives.depth + 1
+            FROM prompt_edges JOIN relatives ON prompt_edges.{start_column} = relatives.id
+            WHERE relatives.depth < ?
+        )
+        SELECT prompts.id, prompts.prompt_group_id, prompts.project_id, prompts.name, prompts.version, MIN(relatives.depth)
+        FROM relatives JOIN prompts ON prompts.id = relatives.id
+        GROUP BY prompts.id
+        ORDER BY MIN(relatives.depth), prompts.name, prompts.version
+        """, (id, max_depth))
+
+    relatives = []
+    for id, prompt_group_id, project_id, name, version, depth in cursor.fetchall():
+        relatives.append({
+            "id": id,
+            "prompt_group_id": prompt_group_id,
+            "project_id": project_id,
+            "name": name,
+            "version": version,
+            "depth": depth
+        })
+
+    return relatives
+
+
+# Get the ancestors of a prompt, closest first
+def get_prompt_ancestors(cursor: sqlite3.Cursor, id: str, max_depth: int = 1000) -> List[dict]:
+    return get_prompt_relatives(cursor, id, 'ancestors', max_depth)
+
+
+# Get the descendants of a prompt, closest first
+def get_prompt_descendants(cursor: sqlite3.Cursor, id: str, max_depth: int = 1000) -> List[dict]:
+    return get_prompt_relatives(cursor, id, 'descendants', max_depth)
+
+
+# Get the lineage graph of a project
+# Nodes are (id, prompt_group_id, name, version) ordered by group and version, edges are (parent_id, child_id)
+@synchronized
+def get_project_lineage(cursor: sqlite3.Cursor, project_id: str) -> Tuple[List[tuple], List[tuple]]:
+    cursor.execute("SELECT id, prompt_group_id, name, version FROM prompts WHERE project_id = ? ORDER BY prompt_group_id, version", (project_id,))
+    nodes = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT prompt_edges.parent_id, prompt_edges.child_id
+        FROM prompts AS child
+        JOIN prompt_edges ON prompt_edges.child_id = child.id
+        JOIN prompts AS parent ON parent.id = prompt_edges.parent_id
+        WHERE child.project_id = ?
+        """, (project_id,))
+    edges = cursor.fetchall()
+
+    return nodes, edges
+
+
+# Lineage of every version of a prompt group: the group, all its ancestors and all its descendants
+LINEAGE_SQL = """
+    WITH RECURSIVE
+    seeds (id) AS (
+        SELECT id FROM prompts WHERE prompt_group_id = ?
+    ),
+    ancestors (id) AS (
+        SELECT id FROM seeds
+        UNION
+        SELECT prompt_edges.parent_id FROM prompt_edges JOIN ancestors ON prompt_edges.child_id = ancestors.id
+    ),
+    descendants (id) AS (
+        SELECT id FROM seeds
+        UNION
+        SELECT prompt_edges.child_id FROM prompt_edges JOIN descendants ON prompt_edges.parent_id = descendants.id
+    ),
+    lineage (id) AS (
+        SELECT id FROM ancestors
+        UNION
+        SELECT id FROM descendants
+    )
+"""
+
+
+# Get the lineage subgraph of a prompt group, in the same shape as `get_project_lineage`
+# Only the connected prompts are read, so the cost follows the size of the subgraph rather than the project
+@synchronized
+def get_prompt_group_lineage(cursor: sqlite3.Cursor, prompt_group_id: str) -> Tuple[List[tuple], List[tuple]]:
+    cursor.execute(LINEAGE_SQL + """
+        SELECT prompts.id, prompts.prompt_group_id, prompts.name, prompts.version
+        FROM lineage JOIN prompts ON prompts.id = lineage.id
+        ORDER BY prompts.prompt_group_id, prompts.version
+        """, (prompt_group_id,))
+    nodes = cursor.fetchall()
+
+    cursor.execute(LINEAGE_SQL + """
+        SELECT prompt_edges.parent_id, prompt_edges.child_id
+        FROM lineage
+        JOIN prompt_edges ON prompt_edges.child_id = lineage.id
+        JOIN prompts ON prompts.id = prompt_edges.parent_id
+        WHERE prompt_edges.parent_id IN lineage
+        """, (prompt_group_id,))
+    edges = cursor.fetchall()
+
+    return nodes, edges
+
+
+# Project archives: gzip compressed newline-delimited JSON, one record per line
+# header, project, then each template once followed by the prompts using it, then the lineage edges
+ARCHIVE_FORMAT = 'prompt-engineering-studio/project'
+ARCHIVE_VERSION = 1
+ARCHIVE_PROMPT_COLUMNS = ('id', 'prompt_group_id', 'project_id', 'parent_prompt_id', 'name', 'description', 'version', 'template_hash', 'input_variables', 'favourite', 'notes', 'created_at', 'updated_at')
+
+# What `import_project` does with rows whose id already exists: raise, keep the existing row or overwrite it
+CONFLICT_POLICIES = ('error', 'skip', 'replace')
+
+# Rows written per executemany during an import
+IMPORT_BATCH_SIZE = 5000
+
+# Errors reading an archive that mean it is not one: not gzip, truncated, not JSON or records missing their fields
+ARCHIVE_READ_ERRORS = (OSError, EOFError, KeyError, TypeError, AttributeError, json.JSONDecodeError, UnicodeDecodeError)
+
+
+# Write a project with all its prompt versions and lineage to a compressed archive (path or binary file object)
+# Rows are streamed, so the archive size does not depend on memory; returns the number of exported prompts
+@synchronized
+def export_project(
+    cursor:sqlite3.Cursor,
+    project_id:str,
+    archive:Union[str, IO[bytes]],
+    progress_callback:Optional[Callable[[int, int], None]] = None) -> int:
+
+    project = get_project_details(cursor, project_id)
+    cursor.execute("SELECT COUNT(*) FROM prompts WHERE project_id = ?", (project_id,))
+    total = cursor.fetchone()[0]
+
+    # A second cursor reads the templates while the first one streams the prompts
+    template_cursor = cursor.connection.cursor()
+
+    with gzip.open(archive, 'wt', encoding='utf-8') as f:
+        def write(record:dict):
+            f.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False))
+            f.write('\n')
+
+        write({'type': 'header', 'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION, 'schema_version': get_schema_version(cursor.connection), 'prompts': total})
+        write({'type': 'project', **project})
+
+        exported_templates = set()
+        cursor.execute(f"SELECT {', '.join(ARCHIVE_PROMPT_COLUMNS)} FROM prompts WHERE project_id = ? ORDER BY rowid", (project_id,))
+        for count, row in enumerate(cursor, start=1):
+            prompt = dict(zip(ARCHIVE_PROMPT_COLUMNS, row))
+            if prompt['template_hash'] not in exported_templates:
+                write({'type': 'template', 'hash': prompt['template_hash'], 'template': _load_template(template_cursor, prompt['template_hash'])})
+                exported_templates.add(prompt['template_hash'])
+            write({'type': 'prompt', **prompt})
+
+            if progress_callback is not None and (count % IMPORT_BATCH_SIZE == 0 or count == total):
+                progress_callback(count, total)
+
+        template_cursor.execute("""
+            SELECT prompt_edges.child_id, prompt_edges.parent_id
+            FROM prompts JOIN prompt_edges ON prompt_edges.child_id = prompts.id
+            WHERE prompts.project_id = ?
+            """, (project_id,))
+        for child_id, parent_id in template_cursor:
+            write({'type': 'edge', 'child_id': child_id, 'parent_id': parent_id})
+
+    return total
+
+
+# Read and validate the header of an opened archive, returns the number of prompts it holds
+def _read_archive_header(f:IO[str]) -> int:
+    try:
+        header = json.loads(f.readline() or '{}')
+        if not isinstance(header, dict) or header.get('type') != 'header' or header.get('format') != ARCHIVE_FORMAT:
+            raise ValueError("Not a project archive")
+        if header['version'] > ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version: {header['version']}")
+        return int(header['prompts'])
+    except ARCHIVE_READ_ERRORS as e:
+        raise ValueError("Not a project archive") from e
+
+
+# Decode and validate the records following the header, as (type, values) ready to be written
+# Only decoding errors become ValueError, errors of the caller's writes are not caught here
+def _read_archive_records(f:IO[str]) -> Iterator[Tuple[str, Union[dict, tuple]]]:
+    lines = iter(f)
+    while True:
+        try:
+            line = next(lines, None)
+            if line is None:
+                return
+
+            record = json.loads(line)
+            record_type = record['type']
+            if record_type == 'project':
+                values = {column: record[column] for column in ('id', 'name', 'description', 'created_at', 'updated_at')}
+            elif record_type == 'template':
+                if template_hash(record['template']) != record['hash']:
+                    raise ValueError(f"Corrupted template in archive: {record['hash']}")
+                values = (record['hash'], record['template'])
+            elif record_type == 'prompt':
+                values = tuple(record[column] for column in ARCHIVE_PROMPT_COLUMNS)
+            elif record_type == 'edge':
+                values = (record['child_id'], record['parent_id'])
+            else:
+                continue
+        except ARCHIVE_READ_ERRORS as e:
+            raise ValueError("Not a project archive") from e
+
+        yield record_type, values
+
+
+# Insert the project row of an archive following the conflict policy
+# Another project with the same name (case-insensitive) is a conflict the policies cannot resolve, whatever the policy
+def _import_project_row(cursor:sqlite3.Cursor, project:dict, on_conflict:str):
+    cursor.execute("SELECT COUNT(*) FROM projects WHERE name = ? COLLATE NOCASE AND id != ?", (project['name'], project['id']))
+    if cursor.fetchone()[0] > 0:
+        raise ProjectAlreadyExistsError
+
+    if on_conflict == 'error':
+        cursor.execute("SELECT COUNT(*) FROM projects WHERE id = ?", (project['id'],))
+        if cursor.fetchone()[0] > 0:
+            raise ProjectAlreadyExistsError
+
+    conflict_clause = {
+        'error': '',
+        'skip': 'ON CONFLICT (id) DO NOTHING',
+        'replace': 'ON CONFLICT (id) DO UPDATE SET name = excluded.name, description = excluded.description, created_at = excluded.created_at, updated_at = excluded.updated_at',
+    }[on_conflict]
+    cursor.execute(
+        f"INSERT INTO projects (id, name, description, created_at, updated_at) VALUES (?, ?, ?, ?, ?) {conflict_clause}",
+        (project['id'], project['name'], project['description'], project['created_at'], project['updated_at'])
+    )
+
+
+# Write a batch of templates and the prompts using them
+# Returns the hashes of the templates that were not stored yet and the number of inserted or replaced prompts
+def _import_batch(cursor:sqlite3.Cursor, templates:List[Tuple[str, str]], prompts:List[tuple], on_conflict:str) -> Tuple[List[str], int]:
+
+    cursor.execute("SELECT value FROM json_each(?) WHERE value NOT IN (SELECT hash FROM prompt_templates)", (json.dumps([hash for hash, _ in templates]),))
+    new_hashes = [row[0] for row in cursor.fetchall()]
+
+    # Templates are content addressed, existing ones are kept whatever the policy
+    if TEMPLATE_STORAGE == 'delta':
+        for hash, text in templates:
+            _store_template(cursor, text)
+    else:
+        cursor.executemany("INSERT OR IGNORE INTO prompt_templates (hash, template) VALUES (?, ?)", templates)
+
+    conflict_clause = {
+        'error': '',
+        'skip': 'ON CONFLICT (id) DO NOTHING',
+        'replace': 'ON CONFLICT (id) DO UPDATE SET ' + ', '.join(f"{column} = excluded.{column}" for column in ARCHIVE_PROMPT_COLUMNS[1:]),
+    }[on_conflict]
+    try:
+        cursor.executemany(
+            f"INSERT INTO prompts ({', '.join(ARCHIVE_PROMPT_COLUMNS)}) VALUES ({', '.join('?' * len(ARCHIVE_PROMPT_COLUMNS))}) {conflict_clause}",
+            prompts
+        )
+        written = max(cursor.rowcount, 0)
+    except sqlite3.IntegrityError as e:
+        if on_conflict == 'error' and 'prompts.id' in str(e):
+            raise PromptAlreadyExistsError from e
+        raise
+
+    return new_hashes, written
+
+
+# Load a project archive written by `export_project` in a single transaction
+# `on_conflict` (see `CONFLICT_POLICIES`) decides what happens to projects and prompts whose sha256 id already exists
+# Files that are not a readable archive raise ValueError
+# Returns the number of templates newly stored, prompts inserted or replaced and edges added
+@synchronized
+def import_project(
+    archive:Union[str, IO[bytes]],
+    connection:sqlite3.Connection,
+    cursor:sqlite3.Cursor,
+    on_conflict:str = 'error',
+    progress_callback:Optional[Callable[[int, int], None]] = None) -> dict:
+
+    if on_conflict not in CONFLICT_POLICIES:
+        raise ValueError(f"Invalid conflict policy: {on_conflict}")
+
+    counts = {'templates': 0, 'prompts': 0, 'edges': 0}
+    read = 0
+    with gzip.open(archive, 'rt', encoding='utf-8') as f:
+        total = _read_archive_header(f)
+
+        templates, prompts, edges, new_hashes = [], [], [], []
+        try:
+            with transaction(connection):
+                for record_type, values in _read_archive_records(f):
+                    if record_type == 'project':
+                        _import_project_row(cursor, values, on_conflict)
+
+                    elif record_type == 'template':
+                        templates.append(values)
+
+                    elif record_type == 'prompt':
+                        prompts.append(values)
+                        read += 1
+                        if len(prompts) >= IMPORT_BATCH_SIZE:
+                            batch_hashes, written = _import_batch(cursor, templates, prompts, on_conflict)
+                            new_hashes.extend(batch_hashes)
+                            counts['prompts'] += written
+                            templates, prompts = [], []
+                            if progress_callback is not None:
+                                progress_callback(read, total)
+
+                    elif record_type == 'edge':
+                        edges.append(values)
+
+                batch_hashes, written = _import_batch(cursor, templates, prompts, on_conflict)
+                new_hashes.extend(batch_hashes)
+                counts['prompts'] += written
+                cursor.executemany("INSERT OR IGNORE INTO prompt_edges (child_id, parent_id) VALUES (?, ?)", edges)
+                counts['edges'] = max(cursor.rowcount, 0)
+
+                # Templates of skipped or replaced prompts that nothing references any more
+                cursor.execute("DELETE FROM prompt_templates WHERE ref_count <= 0")
+                cursor.execute("SELECT COUNT(*) FROM json_each(?) WHERE value IN (SELECT hash FROM prompt_templates)", (json.dumps(new_hashes),))
+                counts['templates'] = cursor.fetchone()[0]
+        finally:
+            clear_caches()
+
+    if progress_callback is not None:
+        progress_callback(read, total)
+
+    return counts
@@ -0,0 +1,38 @@
+import jinja2
+from jinja2 import meta
+from typing import List, Tuple
+
+from utils.cache_helper import LRUCache
+from utils.hash_helper import template_hash
+
+# Single Jinja2 environment shared by every render path
+JINJA_ENV = jinja2.Environment()
+
+# Compiled templates and their input variables keyed by the template hash
+COMPILED_TEMPLATE_CACHE = LRUCache(maxsize=512)
+
+
+# Parse and compile a prompt template once, returns the compiled template and its input (undeclared) variables
+def compile_template(prompt_template:str) -> Tuple[jinja2.Template, List[str]]:
+    key = template_hash(prompt_template)
+    compiled = COMPILED_TEMPLATE_CACHE.get(key)
+    if compiled is None:
+        ast = JINJA_ENV.parse(prompt_template)
+        compiled = (JINJA_ENV.from_string(ast), sorted(meta.find_undeclared_variables(ast)))
+        COMPILED_TEMPLATE_CACHE.set(key, compiled)
+
+    template, input_variables = compiled
+    return template, list(input_variables)
+
+
+# Render a prompt template with the given input variable values
+def render_template(prompt_template:str, **values) -> str:
+    return compile_template(prompt_template)[0].render(**values)
+
+
+# Input (undeclared) variables of a prompt template, only parsed if it was not compiled before
+def get_template_variables(prompt_template:str) -> List[str]:
+    compiled = COMPILED_TEMPLATE_CACHE.get(template_hash(prompt_template))
+    if compiled is not None:
+        return list(compiled[1])
+    return sorted(meta.find_undeclared_variables(JINJA_ENV.parse(prompt_template)))